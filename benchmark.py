@@ -0,0 +1,370 @@
+"""Бенчмарки гарячих шляхів застосунку без справжнього MySQL.
+
+Замість сервера використовується StandInConnector: вбудована база SQLite у тимчасовому файлі,
+де кожен запит (а також ping, begin, commit) рахується як звернення до сервера
+і затримується на --latency-ms. Результати записуються у JSON, щоб порівнювати версії:
+
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json --compare before.json
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+from service import (Connector, ShardMap, SQLiteBackend, PasswordHasher, Session, AccountService, SitesService,
+                     SiteWriteQueue, valid_username, valid_password, valid_email)
+
+class LatencyCursor():
+    """Курсор, що рахує кожен запит як звернення до сервера і затримує його на latency."""
+
+    def __init__(self, cursor, connection):
+        self._cursor = cursor
+        self._connection = connection
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def execute(self, query, args=None):
+        self._connection.round_trip()
+        return self._cursor.execute(query, args)
+
+    def executemany(self, query, args):
+        # pymysql збирає INSERT ... VALUES у один багаторядковий запит - одне звернення
+        self._connection.round_trip()
+        return self._cursor.executemany(query, args)
+
+
+class LatencyConnection():
+    """З'єднання вбудованої бази з імітацією мережі: ping, begin, commit і rollback
+    теж коштують по зверненню, як у MySQL."""
+
+    def __init__(self, connection, connector):
+        self._connection = connection
+        self._connector = connector
+
+    def round_trip(self):
+        self._connector.counters["round_trips"] += 1
+        if self._connector.latency:
+            time.sleep(self._connector.latency)
+
+    def cursor(self, *args):
+        return LatencyCursor(self._connection.cursor(*args), self)
+
+    def ping(self, reconnect=False):
+        self.round_trip()
+
+    def begin(self):
+        self.round_trip()
+        self._connection.begin()
+
+    def commit(self):
+        self.round_trip()
+        self._connection.commit()
+
+    def rollback(self):
+        self.round_trip()
+        self._connection.rollback()
+
+    def close(self):
+        self._connection.close()
+
+
+class StandInConnector(Connector):
+    """Connector над тимчасовою базою SQLite, чиї з'єднання імітують затримку MySQL-сервера."""
+
+    def __init__(self, latency=0.0):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        # Карта шардів з оточення тут не потрібна: міряється одна база
+        super().__init__(SQLiteBackend(os.path.join(self.tmpdir.name, "bench.db")), ShardMap())
+        self.latency = latency
+        self.counters = {"round_trips": 0, "connections": 0}
+        self.migrate(use_marker=False)  # база тимчасова, позначку перевіреної схеми не зберігаємо
+        self.counters.update(round_trips=0, connections=0)
+
+    def _connect(self):
+        self.counters["connections"] += 1
+        return LatencyConnection(self.backend.connect(), self)
+
+    def close(self):
+        super().close()
+        self.tmpdir.cleanup()
+
+    def seed_sites(self, session: Session, count):
+        """Наповнює акаунт зашифрованими сайтами напряму, без затримки і підрахунку звернень."""
+        service, rows = SitesService(self), []
+        for i in range(count):
+            entrance_type = "password" if i % 3 else "google"
+            login, password = (f"user{i}@mail.com", f"secret{i}") if entrance_type == "password" else ("", "")
+            rows.append(service._encrypted_row(session, f"site{i}.example.com", entrance_type, login, password))
+        connection = self.backend.connect()
+        try:
+            with connection.cursor() as c:
+                c.executemany(SitesService.INSERT_QUERY, rows)
+        finally:
+            connection.close()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def measure(connector, name, operation, iterations, setup=None, params=None):
+    """Запускає operation() iterations разів; setup() перед кожним запуском не входить у час.
+    Пікова пам'ять міряється окремим запуском під tracemalloc, щоб не спотворювати затримки."""
+    timings = []
+    round_trips = connections = 0
+    for _ in range(iterations):
+        if setup is not None:
+            setup()
+        before = dict(connector.counters)
+        start = time.perf_counter()
+        operation()
+        timings.append((time.perf_counter() - start) * 1000)
+        round_trips += connector.counters["round_trips"] - before["round_trips"]
+        connections += connector.counters["connections"] - before["connections"]
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    operation()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    timings.sort()
+    result = {
+        "name": name,
+        "params": params or {},
+        "iterations": iterations,
+        "latency_ms": {
+            "mean": sum(timings) / len(timings),
+            "p50": percentile(timings, 0.50),
+            "p90": percentile(timings, 0.90),
+            "p99": percentile(timings, 0.99),
+            "max": timings[-1],
+        },
+        "round_trips_per_op": round_trips / iterations,
+        "connections_per_op": connections / iterations,
+        "peak_memory_kb": peak / 1024,
+    }
+    print(f"{name:<28} {json.dumps(result['params']):<18} p50 {result['latency_ms']['p50']:9.2f} ms  "
+          f"p99 {result['latency_ms']['p99']:9.2f} ms  round trips {result['round_trips_per_op']:8.1f}  "
+          f"connections {result['connections_per_op']:4.2f}  peak {result['peak_memory_kb']:10.1f} KB")
+    return result
+
+
+def measure_memory(name, load, params):
+    """Скільки пам'яті займають рядки, які повертає load(), поки вони живі (tracemalloc до і після)."""
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    rows = load()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    result = {"name": name, "params": params, "retained_kb": retained / 1024,
+              "bytes_per_row": retained / len(rows) if rows else 0.0}
+    print(f"{name:<28} {json.dumps(params):<36} {result['retained_kb']:10.1f} KB  "
+          f"{result['bytes_per_row']:7.1f} B/рядок")
+    del rows
+    return result
+
+
+def render_rows(vault, rows, revealed=()):
+    """Форматування рядків списку сайтів так, як це робить MySitesWindow._string_generator."""
+    from main import MySitesWindow
+    window = SimpleNamespace(revealed=set(revealed), app=SimpleNamespace(user=SimpleNamespace(vault=vault)))
+    return [MySitesWindow._string_generator(window, row) for row in rows]
+
+
+def run(args):
+    connector = StandInConnector(latency=args.latency_ms / 1000)
+    connector.stats.enabled = args.instrument
+    hasher = PasswordHasher(target_seconds=args.hash_target_ms / 1000)
+    hasher.calibrate()
+    accounts = AccountService(connector, hasher)
+    sites = SitesService(connector)
+    results = []
+    counter = iter(range(10 ** 9))
+
+    try:
+        def sign_on():
+            # Не-Tk частина App.sign_on: перевірка полів і реєстрація
+            number = next(counter)
+            username, password, email = f"bench_{number}", "passw0rd1", f"bench_{number}@mail.com"
+            assert valid_username(username) and valid_email(email) and valid_password(password)
+            assert isinstance(accounts.register(Session(), username, password, email), int)
+        results.append(measure(connector, "sign_on", sign_on, args.auth_iterations))
+
+        owner = Session()
+        accounts.register(owner, "bench_owner", "passw0rd1", "owner@mail.com")
+
+        def login():
+            assert accounts.login(Session(), "bench_owner", "passw0rd1") == owner.user_id
+        results.append(measure(connector, "login", login, args.auth_iterations))
+
+        def add_site():
+            assert sites.save_site(owner, f"added{next(counter)}.example.com", "password", "me@mail.com", "pw") is None
+        results.append(measure(connector, "add_site", add_site, args.iterations))
+
+        write_queue = SiteWriteQueue(sites)
+
+        def add_sites_write_behind():
+            # Десять швидких "Додати" поспіль: черга пише їх однією транзакцією
+            for _ in range(10):
+                assert not write_queue.submit(owner, f"queued{next(counter)}.example.com", "password",
+                                              "me@mail.com", "pw").warning
+            assert write_queue.flush(30)
+            assert all(warning is None for _, _, warning in write_queue.collect())
+        results.append(measure(connector, "add_site_write_behind", add_sites_write_behind, args.iterations,
+                               params={"sites": 10}))
+        write_queue.close()
+
+        for rows in args.rows:
+            session = Session()
+            accounts.register(session, f"bench_rows_{rows}", "passw0rd1", f"rows_{rows}@mail.com")
+            connector.seed_sites(session, rows)
+            user_id, page_size = session.user_id, 100
+            cold = lambda: sites.cache.invalidate(user_id)
+
+            def first_page():
+                # Перший показ списку: одна сторінка і видимі рядки VirtualSiteList
+                render_rows(session.vault, sites.get_sites(user_id, 0, page_size)[:15])
+            results.append(measure(connector, "get_sites_first_page", first_page, args.iterations,
+                                   setup=cold, params={"rows": rows}))
+
+            def scroll_all():
+                # Прокрутка до кінця: усі сторінки за ключем і форматування кожного рядка
+                after_id, total = 0, 0
+                while True:
+                    page = sites.get_sites(user_id, after_id, page_size)
+                    total += len(render_rows(session.vault, page))
+                    if len(page) < page_size:
+                        break
+                    after_id = page[-1].id
+                assert total == rows
+            results.append(measure(connector, "get_sites_scroll_all", scroll_all,
+                                   max(1, args.iterations // max(1, rows // 1000)),
+                                   setup=cold, params={"rows": rows}))
+
+            def stream_first_chunk():
+                # Показ списку потоком: перша порція і її видимі рядки
+                chunks = sites.iter_sites(user_id)
+                render_rows(session.vault, next(chunks)[:15])
+                chunks.close()
+            results.append(measure(connector, "iter_sites_first_chunk", stream_first_chunk, args.iterations,
+                                   setup=cold, params={"rows": rows}))
+
+            def stream_all():
+                # Весь список потоком, як його отримує MySitesWindow, з форматуванням кожного рядка
+                total = sum(len(render_rows(session.vault, chunk)) for chunk in sites.iter_sites(user_id))
+                assert total == rows
+            results.append(measure(connector, "iter_sites_stream_all", stream_all,
+                                   max(1, args.iterations // max(1, rows // 1000)), setup=cold, params={"rows": rows}))
+            # Повернення на екран сайтів: акаунт з однієї порції віддається з кешу без запитів,
+            # більший читається потоком знову, бо цілком у кеш не кладеться
+            results.append(measure(connector, "iter_sites_reentry", stream_all,
+                                   max(1, args.iterations // max(1, rows // 1000)), setup=stream_all,
+                                   params={"rows": rows}))
+
+            def dict_rows(columns):
+                # Як списки сайтів були до SiteRecord: словник DictCursor на кожен рядок
+                with connector.connection() as connection, connection.cursor() as c:
+                    c.execute(f"SELECT {columns} FROM sites WHERE user_id = %s ORDER BY id", (user_id,))
+                    return list(c.fetchall())
+            results.append(measure_memory("site_rows_memory", lambda: dict_rows("*"),
+                                          {"rows": rows, "representation": "dict, SELECT *"}))
+            results.append(measure_memory("site_rows_memory", lambda: dict_rows(", ".join(SitesService.LIST_COLUMNS)),
+                                          {"rows": rows, "representation": "dict, LIST_COLUMNS"}))
+            def records():
+                # Рахуються лише самі рядки, без кешу
+                return [record for chunk in sites.iter_sites(user_id, use_cache=False) for record in chunk]
+            cold()
+            results.append(measure_memory("site_rows_memory", records, {"rows": rows, "representation": "SiteRecord"}))
+    finally:
+        hasher.shutdown()
+        connector.close()
+    return results, connector.stats.snapshot() if args.instrument else None
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {(r["name"], json.dumps(r["params"], sort_keys=True)): r for r in json.load(f)["results"]}
+    print(f"\nПорівняння з {baseline_path} (p50 або пам'ять, зміна у %):")
+    for result in results:
+        old = baseline.get((result["name"], json.dumps(result["params"], sort_keys=True)))
+        if old is None:
+            continue
+        if "retained_kb" in result:
+            before, after = old["retained_kb"], result["retained_kb"]
+            change = (after - before) / before * 100 if before else 0.0
+            print(f"{result['name']:<28} {json.dumps(result['params']):<18} {before:9.1f} -> {after:9.1f} KB "
+                  f"({change:+.1f}%)")
+            continue
+        before, after = old["latency_ms"]["p50"], result["latency_ms"]["p50"]
+        change = (after - before) / before * 100 if before else 0.0
+        print(f"{result['name']:<28} {json.dumps(result['params']):<18} {before:9.2f} -> {after:9.2f} ms "
+              f"({change:+.1f}%)  round trips {old['round_trips_per_op']:.1f} -> {result['round_trips_per_op']:.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки входу, реєстрації та списку сайтів")
+    parser.add_argument("--rows", type=lambda s: [int(x) for x in s.split(",")], default=[100, 10000, 100000],
+                        help="розміри акаунтів через кому")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--auth-iterations", type=int, default=10, help="запусків входу і реєстрації (scrypt повільний)")
+    parser.add_argument("--latency-ms", type=float, default=0.5, help="імітована затримка одного звернення до БД")
+    parser.add_argument("--hash-target-ms", type=float, default=100, help="цільова вартість хешування пароля")
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument("--compare", help="попередній JSON з результатами для порівняння")
+    parser.add_argument("--instrument", action="store_true", help="увімкнути статистику запитів і додати її до результатів")
+    args = parser.parse_args()
+
+    results, query_stats = run(args)
+    report = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "latency_ms": args.latency_ms,
+            "hash_target_ms": args.hash_target_ms,
+            "instrument": args.instrument,
+        },
+        "results": results,
+    }
+    if query_stats is not None:
+        report["query_stats"] = query_stats
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\nРезультати записано у {args.output}")
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
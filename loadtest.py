@@ -0,0 +1,344 @@
+"""Навантажувальний тест: віртуальні користувачі одночасно реєструються, входять, додають сайти
+і відкривають список через ті самі сервіси, що й застосунок (AccountService, SitesService).
+
+Відповідає на питання, скільки одночасних користувачів витримує база, перш ніж у пулу Connector
+закінчаться з'єднання або зросте затримка входу:
+
+    python loadtest.py --users 50 --ramp-up 20 --duration 60
+    python loadtest.py --target env --users 200 --pool-size 20 --mix login=1,add_site=3,list=6
+
+--target standin (типово) - тимчасова база SQLite з імітованою затримкою мережі, як у benchmark.py.
+--target env - база з .env / змінних DB_* (MySQL або SQLite). Тест створює в ній користувачів
+ld<мітка запуску>_*, тож запускайте його на окремій базі.
+"""
+import argparse
+import json
+import os
+import random
+import secrets
+import threading
+import time
+from collections import Counter
+
+from benchmark import StandInConnector, git_revision, percentile
+from service import Connector, PasswordHasher, Session, AccountService, SitesService
+
+HISTOGRAM_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+DEFAULT_MIX = "sign_on=1,login=2,add_site=5,list=10,get_sites=2"
+
+
+def parse_mix(text):
+    """'login=2,add_site=5' -> {"login": 2.0, "add_site": 5.0}"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in LoadTest.OPERATIONS:
+            raise argparse.ArgumentTypeError(f"невідома операція {name!r}; є: {', '.join(LoadTest.OPERATIONS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def histogram(latencies_ms):
+    """Кількість операцій у кожному кошику HISTOGRAM_MS (межа включно) і понад останню межу."""
+    counts = Counter()
+    for value in latencies_ms:
+        for bound in HISTOGRAM_MS:
+            if value <= bound:
+                counts[f"<={bound}"] += 1
+                break
+        else:
+            counts[f">{HISTOGRAM_MS[-1]}"] += 1
+    labels = [f"<={bound}" for bound in HISTOGRAM_MS] + [f">{HISTOGRAM_MS[-1]}"]
+    return {label: counts[label] for label in labels}
+
+
+class Recorder():
+    """Потокобезпечний збір результатів операцій: увесь прогін і поточний інтервал звіту."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.ops = {}  # назва -> {"ok", "duplicates", "errors", "latencies"}
+        self.errors = Counter()
+        self._interval = []
+
+    def record(self, name, seconds, outcome, error=None):
+        with self._lock:
+            entry = self.ops.setdefault(name, {"ok": 0, "duplicates": 0, "errors": 0, "latencies": []})
+            entry[outcome] += 1
+            entry["latencies"].append(seconds * 1000)
+            self._interval.append((name, seconds * 1000, outcome))
+            if error is not None:
+                self.errors[f"{name}: {type(error).__name__}: {error}"[:200]] += 1
+
+    def take_interval(self):
+        with self._lock:
+            interval, self._interval = self._interval, []
+        return interval
+
+
+class LoadTest():
+    """Віртуальні користувачі - потоки, бо сервіси блокуючі, як і у фонових потоках застосунку.
+    Кожен стартує із затримкою ramp_up * номер / users, виконує операції зі зваженої суміші mix
+    і чекає think_ms між ними."""
+    OPERATIONS = ("sign_on", "login", "add_site", "list", "get_sites")
+    PASSWORD = "passw0rd1"
+
+    def __init__(self, connector, hasher, args):
+        self.connector = connector
+        self.accounts = AccountService(connector, hasher)
+        self.sites = SitesService(connector)
+        self.args = args
+        self.recorder = Recorder()
+        self.run_tag = secrets.token_hex(2)
+        self.stop = threading.Event()
+        self.active = 0
+        self._active_lock = threading.Lock()
+        self._counter = iter(range(10 ** 9))
+        self._counter_lock = threading.Lock()
+        self.shared = []  # (username, user_id) спільних акаунтів
+
+    def _username(self):
+        with self._counter_lock:
+            number = next(self._counter)
+        return f"ld{self.run_tag}_{number}"
+
+    def _timed(self, name, operation):
+        start = time.perf_counter()
+        try:
+            outcome = operation()
+        except Exception as err:
+            self.recorder.record(name, time.perf_counter() - start, "errors", err)
+            return None
+        self.recorder.record(name, time.perf_counter() - start, "duplicates" if outcome is False else "ok")
+        return outcome
+
+    def _register(self, session):
+        username = self._username()
+        result = self.accounts.register(session, username, self.PASSWORD, f"{username}@load.test")
+        if not isinstance(result, int):
+            return False
+        return username
+
+    def prepare(self):
+        """Спільні акаунти (--shared-accounts) створюються до старту і в результати не входять:
+        на них віртуальні користувачі конкурують за ті самі сайти, тож спрацьовує унікальний індекс."""
+        for _ in range(self.args.shared_accounts):
+            session = Session()
+            username = self._register(session)
+            self.shared.append((username, session.user_id))
+
+    def virtual_user(self, number):
+        if self.stop.wait(self.args.ramp_up * number / max(1, self.args.users)):
+            return
+        rng = random.Random(self.args.seed * 100003 + number)
+        session = Session()
+        if self.shared:
+            username = self.shared[number % len(self.shared)][0]
+            if self._timed("login", lambda: self._login(session, username)) is None:
+                return
+        else:
+            username = self._timed("sign_on", lambda: self._register(session))
+            if not username:
+                return
+        with self._active_lock:
+            self.active += 1
+        names, weights = zip(*self.args.mix.items())
+        try:
+            while not self.stop.is_set():
+                name = rng.choices(names, weights)[0]
+                self._timed(name, lambda: getattr(self, "_op_" + name)(session, username, rng))
+                if self.args.think_ms:
+                    self.stop.wait(rng.expovariate(1000 / self.args.think_ms))
+        finally:
+            with self._active_lock:
+                self.active -= 1
+
+    # Операції повертають False, якщо спрацювало правило дублікатів, і кидають виняток при помилці
+
+    def _op_sign_on(self, session, username, rng):
+        return bool(self._register(Session()))
+
+    def _login(self, session, username):
+        user_id = self.accounts.login(session, username, self.PASSWORD)
+        if not isinstance(user_id, int):
+            raise RuntimeError(f"вхід не вдався: {user_id}")
+        return user_id
+
+    def _op_login(self, session, username, rng):
+        self._login(Session(), username)
+
+    def _op_add_site(self, session, username, rng):
+        # Невеликий набір назв і логінів, щоб частина додавань природно була дублікатами
+        site = f"site{rng.randrange(self.args.site_pool)}.example.com"
+        if rng.random() < 0.7:
+            warning = self.sites.save_site(session, site, "password", f"user{rng.randrange(3)}@mail.com", "pw")
+        else:
+            warning = self.sites.save_site(session, site, rng.choice(("google", "github", "apple")), "", "")
+        if warning in (SitesService.DUPLICATE_LOGIN, SitesService.DUPLICATE_ENTRANCE):
+            return False
+        if warning:
+            raise RuntimeError(warning)
+
+    def _op_list(self, session, username, rng):
+        # Як MySitesWindow: перша порція потоку, решта не потрібна
+        chunks = self.sites.iter_sites(session.user_id)
+        try:
+            next(chunks, None)
+        finally:
+            chunks.close()
+
+    def _op_get_sites(self, session, username, rng):
+        # Як HTTP-сервіс: сторінка за ключем через кеш
+        self.sites.get_sites(session.user_id, 0, 100)
+
+    def monitor(self, started, timeline):
+        """Раз на report_interval друкує пропускну здатність, p99 і стан пулу за минулий інтервал."""
+        pool = self.connector.pool
+        while not self.stop.wait(self.args.report_interval):
+            interval = self.recorder.take_interval()
+            latencies = sorted(ms for _, ms, _ in interval)
+            point = {
+                "t": round(time.perf_counter() - started, 1),
+                "active_users": self.active,
+                "ops_per_s": len(interval) / self.args.report_interval,
+                "p99_ms": percentile(latencies, 0.99),
+                "errors": sum(1 for _, _, outcome in interval if outcome == "errors"),
+                "pool": pool.stats(),
+            }
+            timeline.append(point)
+            p99 = f"{point['p99_ms']:8.1f}" if point["p99_ms"] is not None else "       -"
+            print(f"{point['t']:7.1f} с  користувачів {point['active_users']:4}  {point['ops_per_s']:8.1f} оп/с  "
+                  f"p99 {p99} мс  помилок {point['errors']:4}  з'єднань {point['pool']['in_use']}/"
+                  f"{point['pool']['opened']} (пік {point['pool']['peak']}, макс {point['pool']['max_size']})")
+
+    def run(self):
+        self.prepare()
+        timeline = []
+        started = time.perf_counter()
+        users = [threading.Thread(target=self.virtual_user, args=(number,), name=f"vu-{number}", daemon=True)
+                 for number in range(self.args.users)]
+        monitor = threading.Thread(target=self.monitor, args=(started, timeline), daemon=True)
+        for thread in users:
+            thread.start()
+        monitor.start()
+        try:
+            time.sleep(self.args.ramp_up + self.args.duration)
+        except KeyboardInterrupt:
+            print("Зупинка...")
+        self.stop.set()
+        for thread in users:
+            thread.join()
+        monitor.join()
+        return self.report(time.perf_counter() - started, timeline)
+
+    def report(self, elapsed, timeline):
+        operations = {}
+        total = errors = 0
+        for name, entry in sorted(self.recorder.ops.items()):
+            latencies = sorted(entry["latencies"])
+            count = len(latencies)
+            total += count
+            errors += entry["errors"]
+            operations[name] = {
+                "count": count,
+                "throughput_per_s": count / elapsed,
+                "error_rate": entry["errors"] / count,
+                "duplicate_rate": entry["duplicates"] / count,
+                "latency_ms": {
+                    "mean": sum(latencies) / count,
+                    "p50": percentile(latencies, 0.50),
+                    "p90": percentile(latencies, 0.90),
+                    "p99": percentile(latencies, 0.99),
+                    "max": latencies[-1],
+                },
+                "histogram_ms": histogram(latencies),
+            }
+        return {
+            "elapsed_s": elapsed,
+            "operations_total": total,
+            "throughput_per_s": total / elapsed,
+            "error_rate": errors / total if total else 0.0,
+            "operations": operations,
+            "errors": dict(self.recorder.errors.most_common(20)),
+            "pool": self.connector.pool.stats(),
+            "timeline": timeline,
+        }
+
+
+def print_report(report):
+    print(f"\nЗа {report['elapsed_s']:.1f} с: {report['operations_total']} операцій, "
+          f"{report['throughput_per_s']:.1f} оп/с, помилок {report['error_rate'] * 100:.2f}%")
+    print(f"{'Операція':<12}{'разів':>8}{'оп/с':>9}{'p50 мс':>9}{'p90 мс':>9}{'p99 мс':>9}{'макс мс':>9}"
+          f"{'помилок':>9}{'дублік.':>9}")
+    for name, op in report["operations"].items():
+        latency = op["latency_ms"]
+        print(f"{name:<12}{op['count']:>8}{op['throughput_per_s']:>9.1f}{latency['p50']:>9.1f}{latency['p90']:>9.1f}"
+              f"{latency['p99']:>9.1f}{latency['max']:>9.1f}{op['error_rate'] * 100:>8.1f}%"
+              f"{op['duplicate_rate'] * 100:>8.1f}%")
+    for name, op in report["operations"].items():
+        peak = max(op["histogram_ms"].values()) or 1
+        print(f"\n{name}, затримка (мс):")
+        for label, count in op["histogram_ms"].items():
+            if count:
+                print(f"  {label:>7} {count:>8}  {'#' * max(1, round(40 * count / peak))}")
+    pool = report["pool"]
+    print(f"\nПул: пік відкритих з'єднань {pool['peak']} з {pool['max_size']}, "
+          f"відмов через тайм-аут очікування {pool['timeouts']}")
+    for error, count in report["errors"].items():
+        print(f"  {count:>6} × {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Навантажувальний тест входу, реєстрації та роботи зі списком сайтів")
+    parser.add_argument("--target", choices=("standin", "env"), default="standin",
+                        help="standin - тимчасова SQLite з імітованою затримкою; env - база з .env / DB_*")
+    parser.add_argument("--users", type=int, default=20, help="кількість віртуальних користувачів")
+    parser.add_argument("--ramp-up", type=float, default=10, help="за скільки секунд стартують усі користувачі")
+    parser.add_argument("--duration", type=float, default=30, help="скільки секунд тримати повне навантаження")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix(DEFAULT_MIX),
+                        help=f"ваги операцій ({', '.join(LoadTest.OPERATIONS)}), типово {DEFAULT_MIX}")
+    parser.add_argument("--think-ms", type=float, default=100, help="середня пауза між операціями користувача")
+    parser.add_argument("--shared-accounts", type=int, default=0,
+                        help="якщо більше 0, користувачі ділять стільки акаунтів і конкурують за ті самі сайти")
+    parser.add_argument("--site-pool", type=int, default=200, help="скільки різних назв сайтів додають користувачі")
+    parser.add_argument("--pool-size", type=int, help="DB_POOL_MAX_SIZE для цього прогону")
+    parser.add_argument("--pool-timeout", type=float, help="DB_POOL_TIMEOUT для цього прогону, с")
+    parser.add_argument("--latency-ms", type=float, default=0.5, help="імітована затримка звернення (лише standin)")
+    parser.add_argument("--hash-target-ms", type=float, default=100, help="цільова вартість хешування пароля")
+    parser.add_argument("--report-interval", type=float, default=2, help="як часто друкувати проміжний стан, с")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="loadtest-results.json")
+    args = parser.parse_args()
+
+    # Пул налаштовується зі змінних оточення при першому зверненні до БД
+    if args.pool_size is not None:
+        os.environ["DB_POOL_MAX_SIZE"] = str(args.pool_size)
+    if args.pool_timeout is not None:
+        os.environ["DB_POOL_TIMEOUT"] = str(args.pool_timeout)
+    if args.target == "standin":
+        connector = StandInConnector(latency=args.latency_ms / 1000)
+    else:
+        connector = Connector()
+        connector.migrate()
+    hasher = PasswordHasher(target_seconds=args.hash_target_ms / 1000)
+    hasher.calibrate()
+    try:
+        report = LoadTest(connector, hasher, args).run()
+    finally:
+        hasher.shutdown()
+        connector.close()
+    print_report(report)
+    report["meta"] = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "target": args.target if args.target == "standin" else connector.backend.name,
+        "args": {key: value for key, value in vars(args).items() if key != "output"},
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"\nРезультати записано у {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,36 @@
+import time
+STARTED_AT = time.perf_counter()  # для --measure-startup: відлік від початку імпортів
+
 import tkinter as tk
-import re
-import os
-from dotenv import load_dotenv
-import pymysql.cursors
+from tkinter import filedialog
+import json
+import queue
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from service import (Connector, PasswordHasher, Session, AccountService, SitesService, SiteRecord, SiteWriteQueue,
+                     valid_username, valid_password, valid_email)
 
 class App():
+    WRITE_FLUSH_SECONDS = 5  # скільки чекати запису доданих сайтів при виході, далі вони зберігаються локально
+
     def __init__(self):
         self.win = tk.Tk()
+        # Вартість береться з PASSWORD_HASH_TARGET_MS під час калібрування, коли .env уже прочитано
+        self.hasher = PasswordHasher(target_seconds=None)
         self.user = User()
         self.connector = Connector()
+        self.account_service = AccountService(self.connector, self.hasher)
+        self.sites_service = SitesService(self.connector)
+        self.write_queue = SiteWriteQueue(self.sites_service)
+        self.db_worker = DBWorker(self.win)
+        self._schema_ready = False
+        self._schema_lock = threading.Lock()
+        self._loading_label = None
+        self.screens = ScreenManager(self)
         self.sites_handler = SitesHandler(self)
+        self.debug_panel = DebugPanel(self)
+        self.win.bind_all("<Control-Shift-D>", self.debug_panel.toggle)
         self.windows = {"start_window": StartWindow(self),
                         "sign_in_window": SignInWindow(self),
                         "sign_on_window": SignOnWindow(self),
@@ -17,37 +38,16 @@ class App():
                         }
 
     def validate_username(self):
-        """Дозволяє лише літери, цифри та _, від 3 до 20 символів."""
-        return bool(re.fullmatch(r'^[a-zA-Z0-9_]{3,20}$', self.user.username.get()))
+        return valid_username(self.user.username.get())
 
     def validate_password(self):
-        """Пароль має бути довжиною від 8 до 20 символів, містити хоча б одну літеру та одну цифру."""
-        return bool(re.fullmatch(r'^(?=.*[A-Za-z])(?=.*\d)[A-Za-z\d@#$%^&+=!]{8,20}$', self.user.password.get()))
+        return valid_password(self.user.password.get())
 
     def validate_email(self):
-        """Проста перевірка коректного формату email."""
-        return bool(re.fullmatch(r'^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$', self.user.email.get()))
-
-    def start_app(self):
-        self.connector.create_table("users", f"""
-                    CREATE TABLE users (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        username VARCHAR(255) UNIQUE,
-                        password VARCHAR(255),
-                        email VARCHAR(255) UNIQUE
-                    )
-                """)
-        self.connector.create_table("sites", f"""
-                    CREATE TABLE sites (
-                        id INT AUTO_INCREMENT,
-                        site VARCHAR(255),
-                        entrance_type VARCHAR(255),
-                        user_id INT, PRIMARY KEY (id),
-                        FOREIGN KEY (user_id) REFERENCES users(id),
-                        login VARCHAR(255),
-                        password VARCHAR(255)
-                    )
-                """)
+        return valid_email(self.user.email.get())
+
+    def start_app(self, measure_startup=False):
+        imported_at = time.perf_counter()
         def center_window(root, width=400, height=300):
             screen_width = root.winfo_screenwidth()
             screen_height = root.winfo_screenheight()
@@ -59,57 +59,137 @@ class App():
         self.win.title('Якийсь там застосунок')
         self.win.resizable(height=False, width=False)
         self.windows['start_window'].show()
+        # Усе, що може чекати на мережу, - вже після показу вікна і у фоні
+        schema_check = self._verify_schema()
+        # Підбір вартості KDF під цей комп'ютер, поки користувач ще нічого не ввів
+        self.db_worker.submit(self.hasher.calibrate)
+        if measure_startup:
+            self._measure_startup(imported_at, schema_check)
         self.win.mainloop()
+        self.write_queue.close(timeout=self.WRITE_FLUSH_SECONDS)
+        self.db_worker.shutdown()
+        self.hasher.shutdown()
+        self.connector.close()
+
+    def _ensure_schema(self):
+        """Виконується у фоновому потоці перед кожною дією з БД: перевіряє схему один раз за запуск,
+        а якщо перевірка не вдалася (напр. база була недоступна) - повторює її."""
+        if self._schema_ready:
+            return
+        with self._schema_lock:
+            if not self._schema_ready:
+                self.connector.migrate()
+                self._schema_ready = True
+
+    def _verify_schema(self):
+        return self.db_worker.submit(self._ensure_schema,
+                                     on_error=lambda err: self._on_db_error(err, self._verify_schema))
+
+    def _measure_startup(self, imported_at, schema_check):
+        """Режим --measure-startup: друкує час до першого кадру і до готовності схеми, потім виходить."""
+        report = {"imports_ms": (imported_at - STARTED_AT) * 1000}
+
+        def painted(event):
+            if "first_paint_ms" not in report:
+                report["first_paint_ms"] = (time.perf_counter() - STARTED_AT) * 1000
+                self.win.after(10, wait_for_schema)
+
+        def wait_for_schema():
+            if not schema_check.done():
+                self.win.after(10, wait_for_schema)
+                return
+            report["schema_ready_ms"] = (time.perf_counter() - STARTED_AT) * 1000
+            if schema_check.exception() is not None:
+                report["schema_error"] = str(schema_check.exception())
+            print(json.dumps(report), file=sys.stderr)
+            self.win.destroy()
+
+        self.win.bind("<Expose>", painted, add="+")
 
     def _go_back(self):
         self.user.reset_all()
         self.windows['start_window'].show()
 
-    def clear_window(self):
-        for widget in self.win.winfo_children():
-            widget.destroy()
+    def show_loading(self, text="Зачекайте..."):
+        if self._loading_label is None:
+            self._loading_label = tk.Label(self.win, text=text, font=("Arial", 12, "italic"), fg="gray30")
+            self._loading_label.place(relx=0.5, rely=1.0, anchor="s", y=-5)
+        self.win.config(cursor="watch")
+
+    def hide_loading(self):
+        if self._loading_label is not None:
+            self._loading_label.destroy()
+            self._loading_label = None
+        self.win.config(cursor="")
+
+    def run_in_background(self, fn, *args, on_done=None, on_error=None, action=None):
+        """Виконує fn(*args) у потоці БД, показуючи стан завантаження на поточному екрані.
+        on_done/on_error викликаються вже в потоці Tk; запити зараховуються до дії action."""
+        self.show_loading()
+        task = fn if action is None else self.connector.stats.bind(action, fn)
+
+        def run(*args):
+            self._ensure_schema()
+            return self.connector.run_with_schema(task, *args)
+
+        def done(result):
+            self.hide_loading()
+            if on_done is not None:
+                on_done(result)
+
+        def failed(err):
+            self.hide_loading()
+            if on_error is not None:
+                on_error(err)
+            else:
+                raise err
+
+        return self.db_worker.submit(run, *args, on_done=done, on_error=failed)
 
     def _show_warning_message(self, text, callback):
-        label = tk.Label(self.win, text=text, font=("Arial", 14), wraplength=260, justify="left")
-        label.pack(pady=20)
-        btn = tk.Button(self.win, text="Спробувати ще раз", command=callback)
-        btn.pack(pady=20)
+        self.screens.show_message(text, "Спробувати ще раз", callback)
 
     def _show_success_message(self, text):
-        label = tk.Label(self.win, text=text, font=("Arial", 14),  wraplength=260, justify="left")
-        label.pack(pady=20)
-        btn = tk.Button(self.win, text="Закінчити це все", command=self.win.destroy)
-        btn.pack(pady=20)
+        self.screens.show_message(text, "Закінчити це все", self.win.destroy)
 
     def sign_in(self):
         if not self.validate_username():
-            self.clear_window()
             self._show_warning_message("Ім'я має містити лише латинські літери, цифри та знак підкреслення, та має бути довжиною від 3 до 20 символів.", self.windows['sign_in_window'].show)
             self.user.reset_all()
-        elif not self.user.check_for_existence_username(self.connector,self.user.username.get()):
-            self.clear_window()
+        else:
+            # Фоновий потік отримує звичайні рядки, а не tk-змінні
+            self.run_in_background(self.account_service.login, self.user.session,
+                                   self.user.username.get(), self.user.password.get(),
+                                   on_done=self._on_credentials_checked, action="sign_in",
+                                   on_error=lambda err: self._on_db_error(err, self.windows['sign_in_window'].show))
+
+    def _on_credentials_checked(self, result):
+        if result == AccountService.NO_SUCH_USER:
             self._show_warning_message(
                 "Користувач з таким логіном не зареєстрований.",
                 self.windows['sign_in_window'].show)
             self.user.reset_all()
-        elif self.user.login(self.connector, self.user.username.get(), self.user.password.get()):
-            self.clear_window()
-            self.user.reset_all()
-            self.windows["my_sites_window"].show()
-        else:
-            self.clear_window()
+        elif result == AccountService.WRONG_PASSWORD:
             self._show_warning_message("Невірний пароль!", self.windows['sign_in_window'].show)
             self.user.reset_password()
+        else:
+            self.user.reset_all()
+            self.windows["my_sites_window"].show()
+            self.db_worker.submit(self.sites_service.encrypt_legacy_sites, self.user.session)
+            # Сайти, що не встигли записатися минулого разу
+            self.db_worker.submit(self.write_queue.restore, self.user.session,
+                                  on_done=lambda restored: self.sites_handler.watch_writes())
+
+    def _on_db_error(self, err, callback):
+        self._show_warning_message(f"Помилка бази даних: {err}", callback)
 
     def sign_on(self):
         if not self.validate_username():
-            self.clear_window()
             self._show_warning_message(
                 "Ім'я має містити лише латинські літери, цифри та знак підкреслення, та має бути довжиною від 3 до 20 символів.",
                 self.windows['sign_on_window'].show)
             self.user.reset_all()
         elif not self.validate_email():
-            self.clear_window()
             self._show_warning_message(
                 "Введіть коректну пошту.",
                 self.windows['sign_on_window'].show)
@@ -117,94 +197,218 @@ class App():
             self.user.reset_password()
             self.user.reset_repeated_password()
         elif not self.validate_password():
-            self.clear_window()
             self._show_warning_message(
                 "Пароль має бути довжиною від 8 до 20 символів, містити хоча б одну латинську літеру та одну цифру.",
                 self.windows['sign_on_window'].show)
             self.user.reset_password()
             self.user.reset_repeated_password()
         elif self.user.password.get() != self.user.repeated_password.get():
-            self.clear_window()
             self._show_warning_message(
                 "Пароль має збігатися в обох полях.",
                 self.windows['sign_on_window'].show)
             self.user.reset_password()
             self.user.reset_repeated_password()
-        elif self.user.check_for_existence_username(self.connector, self.user.username.get()):
-            self.clear_window()
+        else:
+            user = self.user
+            self.run_in_background(self.account_service.register, user.session,
+                                   user.username.get(), user.password.get(), user.email.get(),
+                                   on_done=self._on_registered, action="sign_on",
+                                   on_error=lambda err: self._on_db_error(err, self.windows['sign_on_window'].show))
+
+    def _on_registered(self, result):
+        if result == AccountService.USERNAME_TAKEN:
             self._show_warning_message("Користувач з таким ім'ям вже зареєстрований!", self.windows['sign_on_window'].show)
             self.user.reset_all()
-        elif self.user.check_has_duplication_email(self.connector, self.user.email.get()):
-            self.clear_window()
+        elif result == AccountService.EMAIL_TAKEN:
             self._show_warning_message("Користувач з такою поштою вже зареєстрований!",self.windows['sign_on_window'].show)
             self.user.reset_email()
             self.user.reset_password()
             self.user.reset_repeated_password()
         else:
-            self.user.register(self.connector)
-            self.sign_in()
+            # register вже встановив user_id, окремий вхід не потрібен
+            self.user.reset_all()
+            self.windows["my_sites_window"].show()
 
     def sign_out(self):
-        self.user.clear_user_id()
+        # Спершу ховаємо екрани користувача, щоб після блокування сховища ніщо вже не ставило сайти в чергу
         self.windows['start_window'].show()
+        self.show_loading("Зберігаємо додані сайти...")
+        self.user.clear_user_id()
+        # Незаписані сайти дописуються, а що не встигло - зберігається локально до наступного входу
+        hide = lambda result: self.hide_loading()
+        self.db_worker.submit(self.write_queue.flush_or_persist, self.WRITE_FLUSH_SECONDS,
+                              on_done=hide, on_error=hide)
+
+class DBWorker():
+    """Пул потоків для запитів до БД. Результати передаються назад у потік Tk через опитування win.after."""
+
+    def __init__(self, win, max_workers=4, poll_interval=50):
+        self.win = win
+        self.poll_interval = poll_interval
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db-worker")
+        self._results = queue.SimpleQueue()
+        self._pending = set()
+        self._generation = 0
+        self._poll_scheduled = False
+
+    def submit(self, fn, *args, on_done=None, on_error=None):
+        generation = self._generation
+        future = self.executor.submit(fn, *args)
+        self._pending.add(future)
+        future.add_done_callback(lambda f: self._results.put((generation, f, lambda: self._deliver(f, on_done, on_error))))
+        self._schedule_poll()
+        return future
+
+    def bind(self, callback):
+        """Повертає потокобезпечну обгортку над callback для проміжних повідомлень (напр. прогресу)
+        з фонової задачі. Виклики, що прийдуть після переходу на інший екран, відкидаються."""
+        generation = self._generation
+
+        def post(*args):
+            self._results.put((generation, None, lambda: callback(*args)))
+        return post
+
+    @staticmethod
+    def _deliver(future, on_done, on_error):
+        err = future.exception()
+        if err is not None:
+            if on_error is not None:
+                on_error(err)
+        elif on_done is not None:
+            on_done(future.result())
+
+    def cancel_pending(self):
+        """Скасовує ще не розпочаті задачі; результати вже запущених будуть проігноровані."""
+        self._generation += 1
+        for future in self._pending:
+            future.cancel()
+        self._pending.clear()
+
+    def _schedule_poll(self):
+        if not self._poll_scheduled:
+            self._poll_scheduled = True
+            self.win.after(self.poll_interval, self._poll)
+
+    def _poll(self):
+        self._poll_scheduled = False
+        while True:
+            try:
+                generation, future, callback = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if future is not None:
+                self._pending.discard(future)
+                if future.cancelled():
+                    continue
+            if generation != self._generation:
+                continue
+            callback()
+        if self._pending:
+            self._schedule_poll()
+
+    def shutdown(self):
+        self.cancel_pending()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class DebugPanel():
+    """Прихована панель статистики запитів, відкривається Ctrl+Shift+D."""
+    REFRESH_MS = 1000
+
+    def __init__(self, app: App):
+        self.app = app
+        self.stats = app.connector.stats
+        self.top = None
+        self.text = None
+        self.switch = None
+
+    def toggle(self, event=None):
+        if self.top is not None:
+            self.top.destroy()
+            self.top = None
+            return
+        self.top = tk.Toplevel(self.app.win)
+        self.top.title("Статистика запитів")
+        self.top.protocol("WM_DELETE_WINDOW", self.toggle)
+        buttons = tk.Frame(self.top)
+        buttons.pack(fill="x", padx=5, pady=5)
+        self.switch = tk.Button(buttons, command=self._switch, width=12)
+        self.switch.pack(side="left")
+        tk.Button(buttons, text="Скинути", command=self.stats.reset).pack(side="left", padx=5)
+        tk.Button(buttons, text="Зберегти JSON", command=lambda: self._save(".json")).pack(side="left")
+        tk.Button(buttons, text="Зберегти Prometheus", command=lambda: self._save(".prom")).pack(side="left", padx=5)
+        self.text = tk.Text(self.top, width=120, height=35, font=("Courier", 10))
+        self.text.pack(fill="both", expand=True)
+        self._refresh()
+
+    def _switch(self):
+        self.app.connector.set_instrumentation(not self.stats.enabled)
+        self._refresh(schedule=False)
+
+    def _save(self, ext):
+        path = filedialog.asksaveasfilename(parent=self.top, defaultextension=ext,
+                                            filetypes=[("JSON", "*.json"), ("Prometheus", "*.prom")])
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(self.stats.to_json() if path.endswith(".json") else self.stats.to_prometheus())
+
+    def _report(self):
+        snapshot = self.stats.snapshot()
+        if not snapshot["enabled"]:
+            return "Статистику вимкнено. Увімкніть її кнопкою вище або змінною DB_INSTRUMENT=1."
+        connects = snapshot["connects"]
+        lines = [f"З'єднань відкрито: {connects['count']}, на це витрачено {connects['seconds'] * 1000:.1f} мс", "",
+                 f"{'Дія':<14}{'разів':>7}{'сер. мс':>10}{'БД мс':>10}{'запитів':>9}{'з`єднань':>10}"]
+        for name, a in sorted(snapshot["actions"].items()):
+            count = a["count"] or 1
+            lines.append(f"{name:<14}{a['count']:>7}{a['seconds'] * 1000 / count:>10.1f}"
+                         f"{a['db_seconds'] * 1000 / count:>10.1f}{a['queries'] / count:>9.1f}{a['connects']:>10}")
+        lines += ["", f"{'разів':>7}{'всього мс':>11}{'макс мс':>9}{'вибірка мс':>12}{'рядків':>9}  Запит"]
+        queries = sorted(snapshot["queries"].items(), key=lambda item: item[1]["seconds"], reverse=True)
+        for fingerprint, q in queries[:20]:
+            lines.append(f"{q['count']:>7}{q['seconds'] * 1000:>11.1f}{q['max_seconds'] * 1000:>9.1f}"
+                         f"{q['fetch_seconds'] * 1000:>12.1f}{q['rows']:>9}  {fingerprint[:80]}")
+        lines += ["", f"Повільні запити (від {snapshot['slow_threshold'] * 1000:.0f} мс):"]
+        for record in reversed(snapshot["slow"][-10:]):
+            lines.append(f"{time.strftime('%H:%M:%S', time.localtime(record['at']))} "
+                         f"{record['seconds'] * 1000:8.1f} мс  {record['action'] or '-':<12} {record['query'][:80]}")
+        return "\n".join(lines)
+
+    def _refresh(self, schedule=True):
+        if self.top is None:
+            return
+        self.switch.config(text="Вимкнути" if self.stats.enabled else "Увімкнути")
+        self.text.config(state="normal")
+        self.text.delete("1.0", "end")
+        self.text.insert("1.0", self._report())
+        self.text.config(state="disabled")
+        if schedule:
+            self.top.after(self.REFRESH_MS, self._refresh)
+
 
-class Connector():
-    def __init__(self):
-        load_dotenv()  # Завантажує змінні з .env
-
-        self.host = os.getenv("DB_HOST")
-        self.user = os.getenv("DB_USER")
-        self.password = os.getenv("DB_PASSWORD")
-        self.database = os.getenv("DB_NAME")
-        self.charset = os.getenv("DB_CHARSET", "utf8mb4")
-
-    def create_connection(self):
-        return pymysql.connect(
-            host=self.host,
-            user=self.user,
-            password=self.password,
-            database=self.database,
-            charset=self.charset,
-            cursorclass=pymysql.cursors.DictCursor
-        )
-
-    def table_exists(self, table_name):
-        with self.create_connection().cursor() as c:
-            c.execute("""
-                SELECT TABLE_NAME 
-                FROM INFORMATION_SCHEMA.TABLES 
-                WHERE TABLE_SCHEMA = %s AND TABLE_NAME = %s
-            """, (self.database, table_name))
-            return c.fetchone() is not None  # Повертає True, якщо таблиця існує
-
-    def create_table(self, table_name:str, command:str):
-        connection = self.create_connection()
-        """Створює таблицю у MySQL, якщо вона не існує."""
-        with connection.cursor() as c:
-            # Якщо таблиця не існує, створюємо її
-            if not self.table_exists(table_name):
-                c.execute(command)
-                # Збереження змін
-                connection.commit()
 class User():
+    """Поля форм входу і реєстрації та сесія поточного користувача."""
+
     def __init__(self):
-        self.user_id = None
+        self.session = Session()
         self.username = tk.StringVar()
         self.password = tk.StringVar()
         self.repeated_password = tk.StringVar()
         self.email = tk.StringVar()
 
-    def set_user_id(self, connector):
-        connection = connector.create_connection()
-        with connection.cursor() as c:
-            c.execute("""SELECT id FROM users WHERE username = %s;""", self.username.get())
-            self.user_id = c.fetchone()['id']
+    @property
+    def user_id(self):
+        return self.session.user_id
+
+    @property
+    def vault(self):
+        return self.session.vault
 
     def get_user_id(self):
-        return self.user_id
+        return self.session.user_id
 
     def clear_user_id(self):
-        self.user_id = None
+        self.session.clear()
 
     def reset_username(self):
         self.username.set("")
@@ -224,51 +428,17 @@ class User():
         self.reset_repeated_password()
         self.reset_email()
 
-    def check_for_existence_username(self, connector, username: str) -> bool:
-        connection = connector.create_connection()
-        with connection.cursor() as c:
-            # Перевіряємо, чи існує такий username
-            c.execute("SELECT EXISTS(SELECT 1 FROM users WHERE username = %s) AS user_exists", (username,))
-            return c.fetchone()["user_exists"]  # Повертає 1 або 0
-
-    def check_has_duplication_email(self, connector, email: str) -> bool:
-        connection = connector.create_connection()
-        with connection.cursor() as c:
-            # Перевіряємо, чи існує такий email
-            c.execute("SELECT EXISTS(SELECT 1 FROM users WHERE email = %s) AS email_exists", (email,))
-            return c.fetchone()["email_exists"]  # Повертає 1 або 0
-
-    def register(self, connector):
-        connection = connector.create_connection()
-        """Зберігає дані про користувача у базу даних MySQL."""
-        with connection.cursor() as c:
-            # Вставка нового користувача в таблицю 'users'
-            c.execute("""
-                INSERT INTO users (username, password, email) 
-                VALUES (%s, %s, %s)
-            """, (self.username.get(), self.password.get(), self.email.get()))
-            # Збереження змін
-            connection.commit()
-
-    def login(self,connector, username: str, password_input: str) -> bool:
-        connection = connector.create_connection()
-        """ Перевіряє, чи існує користувач з вказаним username та password у базі даних MySQL. Повертає True, якщо такий користувач існує, і False в іншому випадку. """
-        with connection.cursor() as c:
-            # Перевіряємо наявність користувача з відповідними username та password
-            c.execute("""
-                SELECT EXISTS(SELECT 1 FROM users WHERE username = %s AND password = %s)
-             AS user_exists""", (username, password_input))
-            if c.fetchone()["user_exists"]:
-                c.close()
-                self.set_user_id(connector)
-                return True
-            else: return False
-
 class SitesHandler():
+    """Форма додавання сайту, імпорт і експорт. Уся робота з БД - у SitesService."""
+
+    WRITES_POLL_MS = 100
+
     def __init__(self, app: App):
         self.app = app
         self.win = app.win
-        self.connector = app.connector
+        self.service = app.sites_service
+        self.write_queue = app.write_queue
+        self._writes_job = None
         self.user= app.user
         self.selected_kind_of_entrance = tk.StringVar()
         self.site = tk.StringVar()
@@ -288,86 +458,154 @@ class SitesHandler():
         self.selected_kind_of_entrance.set("password")
 
     def _show_warning_message(self, text):
-        self.app.clear_window()
-        label = tk.Label(self.win, text=text, font=("Arial", 14), wraplength=260, justify="left")
-        label.pack(pady=20)
-        btn = tk.Button(self.win, text="Спробувати ще раз", command=self.app.windows['my_sites_window'].show)
-        btn.pack(pady=20)
+        # Після закриття попередження форма залишається з уже введеними даними
+        self.app.screens.show_message(text, "Спробувати ще раз", lambda: None)
+
+    def _show_info_message(self, text):
+        self.app.screens.show_message(text, "Гаразд", self.app.windows['my_sites_window'].show)
 
     def add_site(self):
-        connection = self.connector.create_connection()
-        if self.validator(self.site.get(), self.selected_kind_of_entrance.get(), self.login.get(), self.password.get()):
-            with connection.cursor() as c:
-                try:
-                    query = """
-                            INSERT INTO sites (site, entrance_type, user_id, login, password)
-                            VALUES (%s, %s, %s, %s, %s)
-                        """
-                    values = (self.site.get(), self.selected_kind_of_entrance.get(), self.user.get_user_id(), self.login.get(), self.password.get())#self.user.user_id
-                    c.execute(query, values)
-                    connection.commit()
-                    self.clear_all()
-                    self.app.windows['my_sites_window'].show()
-                    return True
-                except self.connector.Error as err:
-                    self._show_warning_message(err)
-                    return False
-
-    def validator(self, site, entrance_type ,login, password):
-        site_pattern = r'[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-        if not re.match(site_pattern, site):
-            self._show_warning_message("Введіть адекватний URL")
-            return False
-        if entrance_type == 'password':
-            if login.strip() == '':
-                self._show_warning_message("Введіть логін")
-                return False
-            if password.strip() == '':
-                self._show_warning_message("Введіть пароль")
-                return False
-            with self.connector.create_connection().cursor() as c:
-                user_id = self.user.user_id
-
-                query = "SELECT COUNT(*) FROM sites WHERE user_id = %s AND site = %s AND login = %s"
-                c.execute(query, (user_id, site, login))
-                result = c.fetchone()
-                count = result['COUNT(*)']
-                if count:
-                    self._show_warning_message("Сайт з такою назвою і з таким логіном вже доданий в базу даних")
-                    return False
-                else:
-                    return True
-        else:
-            with self.connector.create_connection().cursor() as c:
-                user_id = self.user.user_id
-
-                query = "SELECT COUNT(*) FROM sites WHERE user_id = %s AND site = %s AND entrance_type = %s"
-                c.execute(query, (user_id, site, entrance_type))
-                result = c.fetchone()
-                count = result['COUNT(*)']
-                if count:
-                    self._show_warning_message("Сайт з такою назвою і таким методом входу вже доданий в базу даних")
-                    return False
-                else:
-                    print(2)
-                    return True
-
-    def get_sites(self, user_id):
-        connection = self.connector.create_connection()
-        try:
-            with connection.cursor() as c:
-                query = "SELECT * FROM sites WHERE user_id = %s"
-                c.execute(query, (user_id,))
-                result = c.fetchall()
-                return result
-        except  pymysql.MySQLError as err:
+        # Рядок з'являється у списку одразу, а запис у БД іде через чергу у фоні
+        pending = self.write_queue.submit(self.user.session, self.site.get(), self.selected_kind_of_entrance.get(),
+                                          self.login.get(), self.password.get())
+        if pending.warning:
+            self._show_warning_message(pending.warning)
+            return
+        # Результат запису забирає _poll_writes у цьому ж потоці, тож tag встигає з'явитися
+        pending.tag = SiteRecord.from_insert(pending.row, status=SiteRecord.PENDING)
+        self.app.windows['my_sites_window'].add_pending(pending.tag)
+        self.clear_all()
+        self.watch_writes()
+
+    def watch_writes(self):
+        """Опитує чергу записів, доки в ній щось є, і позначає результат у рядках, що їх спричинили."""
+        if self._writes_job is None:
+            self._writes_job = self.win.after(self.WRITES_POLL_MS, self._poll_writes)
+
+    def _poll_writes(self):
+        self._writes_job = None
+        changed = False
+        for pending, site_id, warning in self.write_queue.collect():
+            row = pending.tag
+            if row is None:
+                continue  # відновлений з локального файлу, у списку його немає
+            if warning:
+                row.status = warning
+            else:
+                row.id, row.status = site_id, None
+            changed = True
+        window = self.app.windows['my_sites_window']
+        # Прихований екран не перемальовується: після виходу сховище вже заблоковане
+        if changed and self.app.screens.current is window:
+            window.site_list.redraw()
+        if self.write_queue.outstanding():
+            self.watch_writes()
+
+    def ask_import(self):
+        path = filedialog.askopenfilename(title="Імпорт сайтів",
+                                          filetypes=[("CSV", "*.csv"), ("JSON", "*.json *.jsonl")])
+        if not path:
+            return
+        status = tk.Label(self.win, font=("Arial", 12), fg="gray30")
+        status.place(relx=0.5, rely=1.0, anchor="s", y=-30)
+        progress = self.app.db_worker.bind(
+            lambda processed, inserted: status.config(text=f"Оброблено записів: {processed}, додано: {inserted}"))
+
+        def done(summary):
+            status.destroy()
+            self._on_imported(summary)
+
+        def failed(err):
+            status.destroy()
             self._show_warning_message(err)
-            return None
+
+        self.app.run_in_background(self.service.import_sites, self.user.session, path, progress,
+                                   on_done=done, on_error=failed)
+
+    def _on_imported(self, summary):
+        text = (f"Додано: {summary['inserted']}. Дублікатів пропущено: {summary['duplicates']}. "
+                f"Некоректних записів: {summary['invalid']}.")
+        if summary["errors"]:
+            text += "\n" + "\n".join(summary["errors"])
+        self._show_info_message(text)
+
+    def ask_export(self):
+        path = filedialog.asksaveasfilename(title="Експорт сайтів", defaultextension=".csv",
+                                            filetypes=[("CSV", "*.csv"), ("JSON", "*.json"), ("JSON Lines", "*.jsonl")])
+        if not path:
+            return
+        self.app.run_in_background(self.service.export_sites, self.user.session, path,
+                                   on_done=lambda count: self._show_info_message(f"Експортовано сайтів: {count}"),
+                                   on_error=self._show_warning_message)
+
+
+class ScreenManager():
+    """Будує кадр кожного екрана лише при першому показі, далі перемикає екрани через tkraise
+    і оновлює тільки їхні динамічні частини. Попередження показуються поверх поточного екрана."""
+
+    def __init__(self, app: App):
+        self.app = app
+        self.current = None
+        self.container = tk.Frame(app.win)
+        self.container.pack(fill="both", expand=True)
+        self.container.grid_rowconfigure(0, weight=1)
+        self.container.grid_columnconfigure(0, weight=1)
+
+        self.overlay = tk.Frame(app.win)
+        self.overlay_label = tk.Label(self.overlay, font=("Arial", 14), wraplength=260, justify="left")
+        self.overlay_label.pack(pady=20)
+        self.overlay_button = tk.Button(self.overlay)
+        self.overlay_button.pack(pady=20)
+
+    def show(self, window):
+        # Перехід на інший екран скасовує запити, результати яких уже нікому не потрібні
+        self.app.db_worker.cancel_pending()
+        if self.current is not None:
+            self.current.hide()
+        self.app.hide_loading()
+        self.hide_message()
+        if window.frame is None:
+            window.frame = tk.Frame(self.container)
+            window.frame.grid(row=0, column=0, sticky="nsew")
+            window.build(window.frame)
+        window.refresh()
+        window.frame.tkraise()
+        self.current = window
+
+    def show_message(self, text, button_text, callback):
+        """Повідомлення поверх поточного екрана; екран під ним не перебудовується."""
+        def on_click():
+            self.hide_message()
+            callback()
+
+        self.overlay_label.config(text=text, wraplength=max(self.app.win.winfo_width() - 140, 260))
+        self.overlay_button.config(text=button_text, command=on_click)
+        self.overlay.place(relx=0, rely=0, relwidth=1, relheight=1)
+        self.overlay.lift()
+
+    def hide_message(self):
+        self.overlay.place_forget()
+
 
 class Window():
     def __init__(self, app:App, previous_window = None):
         self.app = app
         self.previous_window = previous_window
+        self.frame = None  # створюється ScreenManager при першому показі
+
+    def show(self):
+        self.app.screens.show(self)
+
+    def build(self, frame: tk.Frame):
+        """Створює віджети екрана. Викликається один раз."""
+        raise NotImplementedError
+
+    def refresh(self):
+        """Оновлює динамічні частини екрана при кожному поверненні на нього."""
+        self.set_small_window()
+
+    def hide(self):
+        """Викликається, коли екран перестає бути поточним."""
 
     def set_fullscreen(self):
         app = self.app
@@ -388,49 +626,45 @@ class Window():
 
 
 class StartWindow(Window):
-    def show(self):
+    def build(self, frame: tk.Frame):
         app = self.app
-        app.user.reset_all()
-        app.user.clear_user_id()
-        self.set_small_window()
         btn_font = ("Arial", 14, "bold")
-        app.clear_window()
-        suggestion = tk.Label(app.win, text="Оберіть потрібну дію:", font=("Arial", 18, 'bold'), pady=10)
-        sign_in_btn = tk.Button(app.win, text="Увійти", command=app.windows['sign_in_window'].show, pady=10, width=15,
+        suggestion = tk.Label(frame, text="Оберіть потрібну дію:", font=("Arial", 18, 'bold'), pady=10)
+        sign_in_btn = tk.Button(frame, text="Увійти", command=app.windows['sign_in_window'].show, pady=10, width=15,
                                 font=btn_font)
-        sign_on_btn = tk.Button(app.win, text="Зареєструватись", command=app.windows['sign_on_window'].show, pady=10, width=15,
+        sign_on_btn = tk.Button(frame, text="Зареєструватись", command=app.windows['sign_on_window'].show, pady=10, width=15,
                                 font=btn_font)
-        close_btn = tk.Button(app.win, text="Закрити", command=app.win.destroy, pady=10, width=15, font=btn_font)
+        close_btn = tk.Button(frame, text="Закрити", command=app.win.destroy, pady=10, width=15, font=btn_font)
         suggestion.pack()
         sign_in_btn.place(relx=0.5, rely=0.3, anchor="center")
         sign_on_btn.place(relx=0.5, rely=0.55, anchor="center")
         close_btn.place(relx=0.5, rely=0.8, anchor="center")
 
-class SignInWindow(Window):
-    def show(self):
+    def refresh(self):
+        app = self.app
+        app.user.reset_all()
+        app.user.clear_user_id()
         self.set_small_window()
 
-        app = self.app
-        user = app.user
-        app.clear_window()
-        label = tk.Label(app.win, text="Введіть Ваше ім'я і пароль!", font=("Arial", 14))
+class SignInWindow(Window):
+    def build(self, frame: tk.Frame):
+        user = self.app.user
+        label = tk.Label(frame, text="Введіть Ваше ім'я і пароль!", font=("Arial", 14))
         label.pack(pady=20)
 
-        frame = tk.Frame(app.win, bd=2, relief="ridge")
-        btns_frame = tk.Frame(app.win)
-        label = tk.Label(frame, text='Username:', bd=10)
+        fields_frame = tk.Frame(frame, bd=2, relief="ridge")
+        btns_frame = tk.Frame(frame)
+        label = tk.Label(fields_frame, text='Username:', bd=10)
         label.grid(row=0, column=0)
-        username_field = tk.Entry(frame, textvariable=user.username, bg='white', highlightthickness=1)
-        username_field.insert(0, "")
+        username_field = tk.Entry(fields_frame, textvariable=user.username, bg='white', highlightthickness=1)
         username_field.grid(row=0, column=1)
 
-        label = tk.Label(frame, text='Password:', bd=10)
+        label = tk.Label(fields_frame, text='Password:', bd=10)
         label.grid(row=1, column=0)
-        password_field = tk.Entry(frame, textvariable=user.password, bg='white', highlightthickness=1, show="*")
-        password_field.insert(0, "")
+        password_field = tk.Entry(fields_frame, textvariable=user.password, bg='white', highlightthickness=1, show="*")
         password_field.grid(row=1, column=1)
 
-        frame.pack(pady=10)
+        fields_frame.pack(pady=10)
         btns_frame.pack(pady=10)
 
         back_btn = tk.Button(btns_frame, text="Назад", command=self.app.windows['start_window'].show)
@@ -439,44 +673,36 @@ class SignInWindow(Window):
         back_btn.grid(row=0, column=1, padx=10)
 
 class SignOnWindow(Window):
-    def show(self):
-        self.set_small_window()
-
-        app = self.app
-        user = app.user
-        app.clear_window()
-        label = tk.Label(app.win, text="Введіть Ваші дані!", font=("Arial", 14))
+    def build(self, frame: tk.Frame):
+        user = self.app.user
+        label = tk.Label(frame, text="Введіть Ваші дані!", font=("Arial", 14))
         label.pack(pady=20)
 
-        frame = tk.Frame(app.win, bd=2, relief="ridge")  # рельєф межі фрейму
-        btns_frame = tk.Frame(app.win)
+        fields_frame = tk.Frame(frame, bd=2, relief="ridge")  # рельєф межі фрейму
+        btns_frame = tk.Frame(frame)
 
-        label = tk.Label(frame, text='Username:', bd=10)
+        label = tk.Label(fields_frame, text='Username:', bd=10)
         label.grid(row=0, column=0)
-        username_field = tk.Entry(frame, textvariable=user.username, bg='white', highlightthickness=1)
-        username_field.insert(0, "")
+        username_field = tk.Entry(fields_frame, textvariable=user.username, bg='white', highlightthickness=1)
         username_field.grid(row=0, column=1)
 
-        label = tk.Label(frame, text='Email:', bd=10)
+        label = tk.Label(fields_frame, text='Email:', bd=10)
         label.grid(row=1, column=0)
-        email_field = tk.Entry(frame, textvariable=user.email, bg='white', highlightthickness=1)
-        email_field.insert(0, "")
+        email_field = tk.Entry(fields_frame, textvariable=user.email, bg='white', highlightthickness=1)
         email_field.grid(row=1, column=1)
 
-        label = tk.Label(frame, text='Password:', bd=10)
+        label = tk.Label(fields_frame, text='Password:', bd=10)
         label.grid(row=2, column=0)
-        password_field = tk.Entry(frame, textvariable=user.password, bg='white', highlightthickness=1, show="*")
-        password_field.insert(0, "")
+        password_field = tk.Entry(fields_frame, textvariable=user.password, bg='white', highlightthickness=1, show="*")
         password_field.grid(row=2, column=1)
 
-        label = tk.Label(frame, text='Repeat password:', bd=10)
+        label = tk.Label(fields_frame, text='Repeat password:', bd=10)
         label.grid(row=3, column=0)
-        password_field = tk.Entry(frame, textvariable=user.repeated_password, bg='white', highlightthickness=1,
+        password_field = tk.Entry(fields_frame, textvariable=user.repeated_password, bg='white', highlightthickness=1,
                                   show="*")
-        password_field.insert(0, "")
         password_field.grid(row=3, column=1)
 
-        frame.pack(pady=10)
+        fields_frame.pack(pady=10)
         btns_frame.pack(pady=10)
 
         back_btn = tk.Button(btns_frame, text="Назад", command=self.app.windows['start_window'].show)
@@ -484,15 +710,236 @@ class SignOnWindow(Window):
         btn.grid(row=0, column=0, padx=10)
         back_btn.grid(row=0, column=1, padx=10)
 
-class MySitesWindow(Window):
-    def parser(self, pframe: tk.Frame, sites: list[dict]):
-        for count, site in enumerate(sites, start=1):
-            self._string_generator(pframe, site, count)
+class VirtualSiteList():
+    """Прокручуваний список, який створює віджети лише для видимих рядків
+    і перевикористовує їх під час прокрутки."""
+    ROW_HEIGHT = 24
+
+    def __init__(self, master, format_row, visible_rows=15, on_click=None, on_double_click=None):
+        self.format_row = format_row
+        self.rows = []
+        self._view = self.rows  # те, що показується: усі рядки або результат пошуку
+
+        self.frame = tk.Frame(master, bd=2, relief="groove", padx=10, pady=10)
+        self.canvas = tk.Canvas(self.frame, height=visible_rows * self.ROW_HEIGHT, highlightthickness=0)
+        self.scrollbar = tk.Scrollbar(self.frame, orient="vertical", command=self.canvas.yview)
+        self.canvas.configure(yscrollcommand=self._on_view_changed)
+        self.scrollbar.pack(side="right", fill="y")
+        self.canvas.pack(side="left", fill="both", expand=True)
+
+        # Пул міток на один екран з запасом; кожна мітка - вікно на канві, яке переміщується
+        self._slots = []
+        for _ in range(visible_rows + 2):
+            label = tk.Label(self.canvas, anchor="w")
+            item = self.canvas.create_window(0, 0, window=label, anchor="nw", state="hidden")
+            slot = [label, item, None]
+            self._slots.append(slot)
+            self._bind_wheel(label)
+            if on_click is not None:
+                label.bind("<Button-1>", lambda e, slot=slot: self._clicked(slot, on_click))
+            if on_double_click is not None:
+                label.bind("<Double-Button-1>", lambda e, slot=slot: self._clicked(slot, on_double_click))
+        self._bind_wheel(self.canvas)
+        self.canvas.bind("<Configure>", self._on_resize)
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    def _bind_wheel(self, widget):
+        widget.bind("<MouseWheel>", lambda e: self.canvas.yview_scroll(-1 if e.delta > 0 else 1, "units"))
+        widget.bind("<Button-4>", lambda e: self.canvas.yview_scroll(-1, "units"))
+        widget.bind("<Button-5>", lambda e: self.canvas.yview_scroll(1, "units"))
+
+    def _on_resize(self, event):
+        for label, item, _ in self._slots:
+            self.canvas.itemconfigure(item, width=event.width)
+        self._refresh()
+
+    def _on_view_changed(self, first, last):
+        self.scrollbar.set(first, last)
+        self._refresh()
+
+    def _clicked(self, slot, callback):
+        if slot[2] is not None:
+            callback(self._view[slot[2]])
+
+    def remove(self, row):
+        self.rows.remove(row)
+        if self._view is not self.rows and row in self._view:
+            self._view.remove(row)
+        self._update_scrollregion()
+
+    def extend(self, rows):
+        self.rows.extend(rows)
+        self._update_scrollregion()
+
+    def reset(self):
+        """Скидає показані рядки перед новим завантаженням."""
+        self.rows.clear()
+        self._view = self.rows
+        self.canvas.yview_moveto(0)
+        self._update_scrollregion()
+
+    def filter_rows(self, rows=None):
+        """Показує лише передані рядки (результат пошуку) або, якщо rows=None, знову весь список."""
+        self._view = self.rows if rows is None else rows
+        self.canvas.yview_moveto(0)
+        self._update_scrollregion()
+
+    def _update_scrollregion(self):
+        height = len(self._view) * self.ROW_HEIGHT
+        self.canvas.configure(scrollregion=(0, 0, 0, height), yscrollincrement=self.ROW_HEIGHT)
+        self.redraw()
+
+    def redraw(self):
+        for slot in self._slots:
+            slot[2] = None  # примусово оновити текст
+        self._refresh()
+
+    def _refresh(self):
+        first = max(int(self.canvas.canvasy(0)) // self.ROW_HEIGHT, 0)
+        view = self._view
+        for offset, slot in enumerate(self._slots):
+            label, item, shown_index = slot
+            index = first + offset
+            if index >= len(view):
+                self.canvas.itemconfigure(item, state="hidden")
+                slot[2] = None
+                continue
+            if shown_index != index:
+                label.config(text=self.format_row(view[index]))
+                self.canvas.coords(item, 0, index * self.ROW_HEIGHT)
+                self.canvas.itemconfigure(item, state="normal")
+                slot[2] = index
+
 
-    def _string_generator(self, frame: tk.Frame, site: dict, string_number: int):
-        gusset = f", Login: {site['login']}, Password: {site['password']}" if site['entrance_type'] == 'password' else "."
-        label = tk.Label(frame, text=f"Site: {site['site']}, Kind of entrance: {site['entrance_type']}{gusset}", anchor="w")
-        label.grid(row=string_number, column=0, sticky="w", padx=5, pady=2)
+class MySitesWindow(Window):
+    STREAM_AHEAD = 2  # скільки порцій фоновий потік може випередити відмальовування
+    SEARCH_DEBOUNCE_MS = 150
+    ALL_ENTRANCE_TYPES = "усі"
+    # Підписи у порядку SitesService.ENTRANCE_TYPES
+    ENTRANCE_TYPES = list(zip(("Логін-пароль", "Гугл", "Фейс.. Мета", "Гітхаб", "Яблуко"),
+                              SitesService.ENTRANCE_TYPES))
+
+    def __init__(self, app: App, previous_window=None):
+        super().__init__(app, previous_window)
+        self.revealed = set()  # id рядків, для яких користувач відкрив логін і пароль
+        self.site_list = None
+        self.search_text = tk.StringVar()
+        self.search_type = tk.StringVar(value=self.ALL_ENTRANCE_TYPES)
+        self.search_text.trace_add("write", lambda *args: self._schedule_search())
+        self.search_type.trace_add("write", lambda *args: self._schedule_search())
+        self._search_job = None
+        self._search_request = 0
+        self._stream = 0  # номер поточного потокового завантаження; зміна зупиняє попереднє
+
+    def parser(self, site_list: VirtualSiteList, sites: list[SiteRecord]):
+        site_list.extend(sites)
+
+    def _stream_sites(self):
+        """Потоково завантажує сайти: кожна порція додається до списку між ітераціями циклу подій Tk,
+        тож перші рядки видно одразу, а в дорозі ніколи не більше STREAM_AHEAD порцій."""
+        app = self.app
+        self._stream += 1
+        stream = self._stream
+        rendered = threading.Semaphore(self.STREAM_AHEAD)
+
+        def show_chunk(chunk):
+            if stream == self._stream:
+                self.parser(self.site_list, chunk)
+                rendered.release()
+
+        post = app.db_worker.bind(show_chunk)
+
+        def produce(user_id):
+            # Виконується у фоновому потоці; якщо екран закрили, генератор закривається і звільняє з'єднання
+            chunks = app.sites_service.iter_sites(user_id)
+            try:
+                for chunk in chunks:
+                    while not rendered.acquire(timeout=0.1):
+                        if stream != self._stream:
+                            return
+                    if stream != self._stream:
+                        return
+                    post(chunk)
+            finally:
+                chunks.close()
+
+        app.run_in_background(produce, app.user.user_id,
+                              on_error=app.sites_handler._show_warning_message, action="show_sites")
+
+    def hide(self):
+        self._stream += 1
+        self.revealed.clear()  # відкриті логіни і паролі не переживають виходу з екрана
+
+    def add_pending(self, row: SiteRecord):
+        """Щойно доданий сайт, ще не записаний у БД; під час потокового завантаження стає посеред списку."""
+        self.site_list.extend([row])
+
+    def _schedule_search(self):
+        # Відкладений пошук: фільтруємо лише коли користувач на мить перестав друкувати
+        if self._search_job is not None:
+            self.app.win.after_cancel(self._search_job)
+        self._search_job = self.app.win.after(self.SEARCH_DEBOUNCE_MS, self._run_search)
+
+    def _run_search(self):
+        self._search_job = None
+        site_list = self.site_list
+        if site_list is None or self.app.screens.current is not self:
+            return
+        query = self.search_text.get().strip()
+        entrance_type = self.search_type.get()
+        entrance_type = None if entrance_type == self.ALL_ENTRANCE_TYPES else entrance_type
+        self._search_request += 1
+        if not query and entrance_type is None:
+            site_list.filter_rows(None)
+            return
+        sites_handler = self.app.sites_handler
+        index = self.app.user.session.search_index
+        if index is None or index.user_id != self.app.user.user_id:
+            return  # індекс ще будується; пошук повториться, щойно він буде готовий
+        if index.local:
+            site_list.filter_rows(index.search(query, entrance_type))
+            return
+        request = self._search_request
+
+        def show_found(sites):
+            # Відповіді на застарілі запити ігноруємо
+            if request == self._search_request:
+                site_list.filter_rows(sites)
+
+        self.app.db_worker.submit(self.app.sites_service.search_sites, self.app.user.user_id, query, entrance_type,
+                                  on_done=show_found, on_error=sites_handler._show_warning_message)
+
+    def _string_generator(self, site: SiteRecord) -> str:
+        if site.entrance_type != 'password':
+            gusset = "."
+        elif site.id in self.revealed and self.app.user.vault.unlocked:
+            # Після виходу екран ще видно, доки дописуються сайти, але сховище вже заблоковане
+            vault = self.app.user.vault
+            gusset = f", Login: {vault.reveal(site.login)}, Password: {vault.reveal(site.password)}"
+        else:
+            gusset = ", Login: ••••••, Password: ••••••"
+        if site.status == SiteRecord.PENDING:
+            gusset += " (зберігається...)"
+        elif site.status:
+            gusset += f" — не збережено: {site.status} (клацніть, щоб прибрати)"
+        return f"Site: {site.site}, Kind of entrance: {site.entrance_type}{gusset}"
+
+    def _toggle_reveal(self, site: SiteRecord):
+        if site.status and site.status != SiteRecord.PENDING:
+            self.site_list.remove(site)
+            return
+        if site.entrance_type != 'password' or site.id is None:
+            return
+        self.revealed.symmetric_difference_update({site.id})
+        self.site_list.redraw()
+
+    def _copy_password(self, site: SiteRecord):
+        if site.entrance_type != 'password' or not self.app.user.vault.unlocked:
+            return
+        self.app.win.clipboard_clear()
+        self.app.win.clipboard_append(self.app.user.vault.reveal(site.password))
 
     def _toggle_inputs(self, radio_var, handled_fields: tuple):
         choice = radio_var.get()
@@ -504,26 +951,50 @@ class MySitesWindow(Window):
                 self.app.sites_handler.clear_log_pass()
                 f.config(state='disabled')
 
-    def show(self):
-
+    def refresh(self):
+        # Форма і пошук залишаються зі старого показу; заново завантажуються лише рядки
         app = self.app
         sites_handler = app.sites_handler
         sites_handler.clear_all()
-        app.clear_window()
         self.set_fullscreen()
+        self.revealed.clear()
+        self.search_text.set("")
+        self.search_type.set(self.ALL_ENTRANCE_TYPES)
+        self.site_list.reset()
+        self._stream_sites()
+        index = app.user.session.search_index
+        if index is None or index.user_id != app.user.user_id:
+            app.db_worker.submit(app.sites_service.build_search_index, app.user.session,
+                                 on_done=lambda index: self._run_search())
+
+    def build(self, frame: tk.Frame):
+
+        app = self.app
+        sites_handler = app.sites_handler
 
         # Основний контейнер
-        main_container = tk.Frame(app.win)
+        main_container = tk.Frame(frame)
         main_container.pack(fill="both", expand=True, padx=50, pady=30)
 
         # Заголовок
         title = tk.Label(main_container, text="Сайти на яких ви зареєстровані", font=("Arial", 18, "bold"))
-        title.pack(pady=(0, 20))
-
-        # Список сайтів
-        sites_frame = tk.Frame(main_container, bd=2, relief="groove", padx=10, pady=10)
-        sites_frame.pack(fill="x", padx=10, pady=10)
-        self.parser(sites_frame, sites_handler.get_sites(app.user.user_id))
+        title.pack(pady=(0, 5))
+        hint = tk.Label(main_container, text="Клацніть рядок, щоб показати логін і пароль; подвійне клацання копіює пароль.",
+                        fg="gray30")
+        hint.pack(pady=(0, 15))
+
+        # Пошук
+        search_frame = tk.Frame(main_container)
+        search_frame.pack(fill="x", padx=10)
+        tk.Label(search_frame, text='Пошук:').pack(side="left")
+        tk.Entry(search_frame, textvariable=self.search_text, bg='white', width=40).pack(side="left", padx=5)
+        tk.OptionMenu(search_frame, self.search_type, self.ALL_ENTRANCE_TYPES,
+                      *(value for _, value in self.ENTRANCE_TYPES)).pack(side="left", padx=5)
+
+        # Список сайтів: рядки надходять потоком з _stream_sites
+        site_list = self.site_list = VirtualSiteList(main_container, self._string_generator,
+                                                     on_click=self._toggle_reveal, on_double_click=self._copy_password)
+        site_list.pack(fill="x", padx=10, pady=10)
 
         # Форма додавання
         add_frame = tk.LabelFrame(main_container, text="Додати новий сайт", padx=10, pady=10, font=("Arial", 12))
@@ -545,15 +1016,7 @@ class MySitesWindow(Window):
         radio_frame = tk.Frame(add_frame)
         radio_frame.grid(row=3, column=1, sticky="w", pady=5)
 
-        radios = [
-            ("Логін-пароль", "password"),
-            ("Гугл", "google"),
-            ("Фейс.. Мета", "meta"),
-            ("Гітхаб", "github"),
-            ("Яблуко", "apple")
-        ]
-
-        for i, (text, value) in enumerate(radios):
+        for i, (text, value) in enumerate(self.ENTRANCE_TYPES):
             tk.Radiobutton(radio_frame, text=text, variable=sites_handler.selected_kind_of_entrance, command=lambda: self._toggle_inputs(sites_handler.selected_kind_of_entrance,(login_field,password_field)), value=value).grid(row=i, column=0, sticky="w")
 
         # Кнопки
@@ -561,10 +1024,12 @@ class MySitesWindow(Window):
         btns_add_frame.pack(pady=20)
 
         tk.Button(btns_add_frame, text="Додати", command=sites_handler.add_site, width=15).grid(row=0, column=0, padx=20)
-        tk.Button(btns_add_frame, text="Вийти", command=self.app.sign_out, width=15).grid(row=0, column=1, padx=20)
-
+        tk.Button(btns_add_frame, text="Імпорт", command=sites_handler.ask_import, width=15).grid(row=0, column=1, padx=20)
+        tk.Button(btns_add_frame, text="Експорт", command=sites_handler.ask_export, width=15).grid(row=0, column=2, padx=20)
+        tk.Button(btns_add_frame, text="Вийти", command=self.app.sign_out, width=15).grid(row=0, column=3, padx=20)
 
-import pymysql
 
-some_app = App()
-some_app.start_app()
\ No newline at end of file
+if __name__ == "__main__":
+    # Захист потрібен, бо процеси пулу хешування імпортують цей модуль заново
+    some_app = App()
+    some_app.start_app(measure_startup="--measure-startup" in sys.argv)
@@ -0,0 +1,179 @@
+"""Переносить сайти користувачів між шардами, щоб розміщення (users.shard) відповідало карті
+шардів з DB_SHARD_MAP, напр. після додавання нового шарду. Шард, з якого треба лише забрати
+користувачів, лишається в карті з "placement": false. Працює без зупинки застосунку:
+
+    python rebalance.py --dry-run
+    python rebalance.py
+    python rebalance.py --users 12,40
+
+Перенесення одного користувача:
+1. рядок у shard_moves фіксує намір, тож перерваний запуск продовжується з того самого місця;
+2. сайти копіюються у новий шард порціями, поки застосунок і далі пише в старий;
+3. users.shard перемикається на новий шард - нові звернення йдуть уже туди;
+4. після паузи, довшої за Connector.PLACEMENT_TTL, ніхто не пише в старий шард: дописане
+   за цей час докопійовується, а старі рядки видаляються.
+
+Скопійовані рядки отримують нові id. Зміни старих рядків у вікні перенесення (шифрування
+старих записів після входу) можуть загубитися - вони повторяться при наступному вході.
+"""
+import argparse
+import time
+
+from service import Connector, SitesService
+
+COPY_COLUMNS = ("id", "site", "entrance_type", "user_id", "login", "password", "login_digest")
+
+
+def planned_moves(connector, only_users=None):
+    """[(user_id, звідки, куди)]: спершу незавершені перенесення з shard_moves, потім користувачі,
+    чиє розміщення не збігається з картою. None - основна база."""
+    shard_map = connector.shard_map
+    with connector.connection() as connection, connection.cursor() as c:
+        c.execute("SELECT user_id, from_shard, to_shard FROM shard_moves ORDER BY user_id")
+        moves = [(row["user_id"], row["from_shard"], row["to_shard"]) for row in c.fetchall()]
+        c.execute("SELECT id, shard FROM users ORDER BY id")
+        users = c.fetchall()
+    resumed = {user_id for user_id, _, _ in moves}
+    for row in users:
+        target = shard_map.placement(row["id"])
+        if row["id"] not in resumed and row["shard"] != target:
+            moves.append((row["id"], row["shard"], target))
+    if only_users is not None:
+        moves = [move for move in moves if move[0] in only_users]
+    return moves
+
+
+class ShardMover():
+    """Копіює, перемикає і прибирає сайти користувачів; стан кожного перенесення - у shard_moves."""
+
+    def __init__(self, connector, batch_size=500):
+        self.connector = connector
+        self.batch_size = batch_size
+        self.sites = SitesService(connector)
+
+    def _move_state(self, user_id):
+        with self.connector.connection() as connection, connection.cursor() as c:
+            c.execute("SELECT copied_id, switched_at FROM shard_moves WHERE user_id = %s", (user_id,))
+            return c.fetchone()
+
+    def count_sites(self, name, user_id):
+        with self.connector.shard(name).connection() as connection, connection.cursor() as c:
+            c.execute("SELECT COUNT(*) AS total FROM sites WHERE user_id = %s", (user_id,))
+            return c.fetchone()["total"]
+
+    def copy(self, user_id, source, target, after_id):
+        """Копіює сайти з id більшим за after_id порціями, кожна - окремою транзакцією в target.
+        Після кожної порції copied_id у shard_moves посувається. Повертає (скопійовано, дублікатів)."""
+        summary = {"inserted": 0, "duplicates": 0}
+        source_db, target_db = self.connector.shard(source), self.connector.shard(target)
+        while True:
+            with source_db.connection() as connection, connection.cursor() as c:
+                c.execute(f"SELECT {', '.join(COPY_COLUMNS)} FROM sites WHERE user_id = %s AND id > %s "
+                          "ORDER BY id LIMIT %s", (user_id, after_id, self.batch_size))
+                rows = c.fetchall()
+            if not rows:
+                return summary["inserted"], summary["duplicates"]
+            batch = [tuple(row[column] for column in COPY_COLUMNS[1:]) for row in rows]
+            with target_db.connection() as connection:
+                connection.begin()
+                with connection.cursor() as c:
+                    # Той самий шлях, що й в імпорту: дублікат (напр. сайт, уже доданий у новий шард) пропускається
+                    self.sites._insert_batch(c, batch, summary)
+                connection.commit()
+            after_id = rows[-1]["id"]
+            with self.connector.connection() as connection, connection.cursor() as c:
+                c.execute("UPDATE shard_moves SET copied_id = %s WHERE user_id = %s", (after_id, user_id))
+                connection.commit()
+
+    def start(self, user_id, source, target):
+        """Кроки 1-3: копія і перемикання. Якщо користувач уже перемкнений, нічого не робить."""
+        state = self._move_state(user_id)
+        if state is not None and state["switched_at"] is not None:
+            return
+        with self.connector.connection() as connection, connection.cursor() as c:
+            if state is None:
+                c.execute("INSERT INTO shard_moves (user_id, from_shard, to_shard) VALUES (%s, %s, %s)",
+                          (user_id, source, target))
+            else:
+                c.execute("UPDATE shard_moves SET copied_id = 0 WHERE user_id = %s", (user_id,))
+            connection.commit()
+        if state is not None:
+            # До перемикання в target пише лише цей інструмент, тож незавершену копію простіше почати заново,
+            # ніж з'ясовувати, чи встигла закомітитися остання порція
+            self.delete(target, user_id)
+        copied, duplicates = self.copy(user_id, source, target, 0)
+        with self.connector.connection() as connection:
+            connection.begin()
+            with connection.cursor() as c:
+                c.execute("UPDATE users SET shard = %s WHERE id = %s", (target, user_id))
+                c.execute("UPDATE shard_moves SET switched_at = CURRENT_TIMESTAMP WHERE user_id = %s", (user_id,))
+            connection.commit()
+        print(f"  користувач {user_id}: {source or 'основна'} -> {target or 'основна'}, "
+              f"скопійовано {copied}, дублікатів {duplicates}")
+
+    def finish(self, user_id, source, target):
+        """Крок 4: докопійовує дописане в старий шард після копії і прибирає його."""
+        state = self._move_state(user_id)
+        if state is None:
+            return
+        copied, duplicates = self.copy(user_id, source, target, state["copied_id"])
+        removed = self.delete(source, user_id)
+        with self.connector.connection() as connection, connection.cursor() as c:
+            c.execute("DELETE FROM shard_moves WHERE user_id = %s", (user_id,))
+            connection.commit()
+        print(f"  користувач {user_id}: докопійовано {copied}, дублікатів {duplicates}, "
+              f"видалено зі старого шарду {removed}")
+
+    def delete(self, name, user_id):
+        """Видаляє сайти користувача з бази name порціями, щоб не тримати довгих блокувань."""
+        removed = 0
+        with self.connector.shard(name).connection() as connection, connection.cursor() as c:
+            while True:
+                c.execute("SELECT id FROM sites WHERE user_id = %s ORDER BY id LIMIT %s", (user_id, self.batch_size))
+                ids = [row["id"] for row in c.fetchall()]
+                if not ids:
+                    return removed
+                c.execute("DELETE FROM sites WHERE user_id = %s AND id <= %s", (user_id, ids[-1]))
+                connection.commit()
+                removed += len(ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Переносить сайти користувачів у шарди згідно з DB_SHARD_MAP")
+    parser.add_argument("--dry-run", action="store_true", help="лише показати, кого і куди буде перенесено")
+    parser.add_argument("--users", type=lambda text: {int(part) for part in text.split(",")},
+                        help="id користувачів через кому; типово - усі")
+    parser.add_argument("--batch", type=int, default=500, help="рядків в одній порції копіювання")
+    parser.add_argument("--settle", type=float, default=Connector.PLACEMENT_TTL + 5,
+                        help="пауза між перемиканням і прибиранням старого шарду, с; не менша за PLACEMENT_TTL")
+    args = parser.parse_args()
+
+    connector = Connector()
+    try:
+        connector.migrate()
+        moves = planned_moves(connector, args.users)
+        if not moves:
+            print("Розміщення відповідає карті шардів, переносити нічого")
+            return
+        mover = ShardMover(connector, args.batch)
+        if args.dry_run:
+            for user_id, source, target in moves:
+                print(f"  користувач {user_id}: {source or 'основна'} -> {target or 'основна'}, "
+                      f"сайтів {mover.count_sites(source, user_id)}")
+            print(f"Буде перенесено користувачів: {len(moves)}")
+            return
+        print(f"Копіювання і перемикання ({len(moves)} користувачів)")
+        for user_id, source, target in moves:
+            mover.start(user_id, source, target)
+        # Одна пауза на всіх: застосунки мають забути старе розміщення, перш ніж старий шард прибирається
+        print(f"Очікування {args.settle:.0f} с, поки застосунки оновлять розміщення")
+        time.sleep(max(args.settle, Connector.PLACEMENT_TTL))
+        print("Докопіювання і прибирання старих шардів")
+        for user_id, source, target in moves:
+            mover.finish(user_id, source, target)
+    finally:
+        connector.close()
+
+
+if __name__ == "__main__":
+    main()
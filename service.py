@@ -0,0 +1,2368 @@
+"""Бізнес-логіка застосунку без залежності від Tk: з'єднання з БД, міграції, хешування паролів,
+шифрування облікових даних сайтів, облікові записи та сайти користувачів.
+
+Tk-застосунок (main.py) використовує ці класи напряму, а AsyncBackend і serve() надають
+той самий функціонал багатьом клієнтам одночасно як локальний JSON-over-HTTP сервер:
+
+    python service.py --port 8765
+    python service.py --unix /tmp/sites.sock
+
+Залежності: pymysql і python-dotenv, а для шифрування облікових даних - cryptography
+(AES-GCM); без нього вхід в акаунт неможливий.
+"""
+import importlib.util
+import re
+import os
+import csv
+import json
+import base64
+import hashlib
+import hmac
+import secrets
+import sys
+import threading
+import time
+from bisect import bisect_right
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+
+
+def _lazy_import(name):
+    """Модуль, що виконується лише при першому зверненні до його атрибутів. Драйвер БД, sqlite3
+    та asyncio не потрібні для першого кадру вікна, тож не затримують запуск застосунку."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+argparse = _lazy_import("argparse")
+asyncio = _lazy_import("asyncio")
+inspect = _lazy_import("inspect")
+multiprocessing = _lazy_import("multiprocessing")
+pymysql = _lazy_import("pymysql")  # підмодулі cursors і err завантажуються разом з пакетом
+sqlite3 = _lazy_import("sqlite3")
+traceback = _lazy_import("traceback")
+
+_env_lock = threading.Lock()
+_env_loaded = False
+
+
+def load_env():
+    """Завантажує змінні з .env один раз за процес; викликається з фонових потоків,
+    тож запуск застосунку не чекає на читання файлу."""
+    global _env_loaded
+    with _env_lock:
+        if not _env_loaded:
+            from dotenv import load_dotenv
+            load_dotenv()
+            _env_loaded = True
+
+
+DUP_ENTRY = 1062  # код помилки MySQL ER_DUP_ENTRY
+NO_SUCH_TABLE = 1146  # код помилки MySQL ER_NO_SUCH_TABLE
+
+# Версійовані міграції схеми: (версія, опис, команди). Уже випущені кроки не змінюються -
+# нові індекси чи колонки додаються наступним кроком у кінці списку.
+# IF NOT EXISTS у перших кроках дозволяє прийняти бази, створені ще до появи міграцій.
+MIGRATIONS = [
+    (1, "users table", ["""
+        CREATE TABLE IF NOT EXISTS users (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(255) UNIQUE,
+            password VARCHAR(255),
+            email VARCHAR(255) UNIQUE
+        )
+    """]),
+    (2, "sites table", ["""
+        CREATE TABLE IF NOT EXISTS sites (
+            id INT AUTO_INCREMENT,
+            site VARCHAR(255),
+            entrance_type VARCHAR(255),
+            user_id INT, PRIMARY KEY (id),
+            FOREIGN KEY (user_id) REFERENCES users(id),
+            login VARCHAR(255),
+            password VARCHAR(255)
+        )
+    """]),
+    (3, "encrypted site credentials", [
+        "ALTER TABLE users ADD COLUMN enc_salt VARCHAR(32) NULL",
+        # Шифротекст у base64 довший за відкритий текст; login_digest - HMAC логіна для пошуку дублікатів
+        """ALTER TABLE sites
+            MODIFY login VARCHAR(1024),
+            MODIFY password VARCHAR(1024),
+            ADD COLUMN login_digest CHAR(64) NULL""",
+    ]),
+    (4, "site prefix search index", [
+        "CREATE INDEX sites_user_site ON sites (user_id, site)",
+    ]),
+    # Порожній: розраховував на індекс зовнішнього ключа user_id, але MySQL прибирає його ще на кроці 4,
+    # коли з'являється (user_id, site). Сам індекс додає крок 8
+    (5, "site list order index", []),
+    # Обидва правила дублікатів як унікальні індекси. Для входу за паролем login_digest заповнений,
+    # а entrance_key - NULL; для інших методів навпаки, тож кожен рядок обмежує лише один з індексів.
+    # Наявні дублікати спершу прибираються (лишається найраніший), sites_user_site стає префіксом нових індексів
+    (6, "unique site keys", [
+        """DELETE s FROM sites s JOIN sites d
+            ON d.user_id = s.user_id AND d.site = s.site AND d.login_digest = s.login_digest AND d.id < s.id""",
+        """DELETE s FROM sites s JOIN sites d
+            ON d.user_id = s.user_id AND d.site = s.site AND d.entrance_type = s.entrance_type AND d.id < s.id
+            WHERE s.entrance_type <> 'password'""",
+        """ALTER TABLE sites ADD COLUMN entrance_key VARCHAR(255)
+            GENERATED ALWAYS AS (IF(entrance_type = 'password', NULL, entrance_type)) VIRTUAL""",
+        "CREATE UNIQUE INDEX sites_user_site_login ON sites (user_id, site, login_digest)",
+        "CREATE UNIQUE INDEX sites_user_site_entrance ON sites (user_id, site, entrance_key)",
+        "DROP INDEX sites_user_site ON sites",
+    ]),
+    # Шард, у якому лежать сайти користувача (NULL - основна база), і незавершені перенесення rebalance.py
+    (7, "sites shard placement", [
+        "ALTER TABLE users ADD COLUMN shard VARCHAR(64) NULL",
+        """CREATE TABLE IF NOT EXISTS shard_moves (
+            user_id INT PRIMARY KEY,
+            from_shard VARCHAR(64) NULL,
+            to_shard VARCHAR(64) NULL,
+            copied_id INT NOT NULL DEFAULT 0,
+            switched_at TIMESTAMP NULL
+        )""",
+    ]),
+    # Вторинний індекс InnoDB містить id, тож WHERE user_id = %s ORDER BY id читає акаунт уже впорядкованим
+    # і iter_sites віддає першу порцію без сортування всього акаунта
+    (8, "site list order index", [
+        "CREATE INDEX sites_user ON sites (user_id)",
+    ]),
+]
+
+# Ті самі версії схеми для вбудованої бази SQLite. Кожен новий крок додається в обидва списки
+SQLITE_MIGRATIONS = [
+    (1, "users table", ["""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username VARCHAR(255) UNIQUE,
+            password VARCHAR(255),
+            email VARCHAR(255) UNIQUE
+        )
+    """]),
+    (2, "sites table", ["""
+        CREATE TABLE IF NOT EXISTS sites (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            site VARCHAR(255),
+            entrance_type VARCHAR(255),
+            user_id INT REFERENCES users(id),
+            login VARCHAR(255),
+            password VARCHAR(255)
+        )
+    """]),
+    (3, "encrypted site credentials", [
+        # SQLite не обмежує довжину VARCHAR, тож MODIFY з MySQL тут не потрібен
+        "ALTER TABLE users ADD COLUMN enc_salt VARCHAR(32) NULL",
+        "ALTER TABLE sites ADD COLUMN login_digest CHAR(64) NULL",
+    ]),
+    (4, "site prefix search index", [
+        "CREATE INDEX sites_user_site ON sites (user_id, site)",
+    ]),
+    # Записи індексу SQLite впорядковані за rowid, тож WHERE user_id = ? ORDER BY id не сортує весь акаунт
+    (5, "site list order index", [
+        "CREATE INDEX sites_user ON sites (user_id)",
+    ]),
+    # Замість згенерованого стовпця - частковий унікальний індекс
+    (6, "unique site keys", [
+        """DELETE FROM sites WHERE EXISTS (SELECT 1 FROM sites d WHERE d.user_id = sites.user_id
+            AND d.site = sites.site AND d.login_digest = sites.login_digest AND d.id < sites.id)""",
+        """DELETE FROM sites WHERE entrance_type <> 'password' AND EXISTS (SELECT 1 FROM sites d
+            WHERE d.user_id = sites.user_id AND d.site = sites.site AND d.entrance_type = sites.entrance_type
+            AND d.id < sites.id)""",
+        "CREATE UNIQUE INDEX sites_user_site_login ON sites (user_id, site, login_digest)",
+        "CREATE UNIQUE INDEX sites_user_site_entrance ON sites (user_id, site, entrance_type) "
+        "WHERE entrance_type <> 'password'",
+        "DROP INDEX sites_user_site",
+    ]),
+    (7, "sites shard placement", [
+        "ALTER TABLE users ADD COLUMN shard VARCHAR(64) NULL",
+        """CREATE TABLE IF NOT EXISTS shard_moves (
+            user_id INTEGER PRIMARY KEY,
+            from_shard VARCHAR(64) NULL,
+            to_shard VARCHAR(64) NULL,
+            copied_id INTEGER NOT NULL DEFAULT 0,
+            switched_at TIMESTAMP NULL
+        )""",
+    ]),
+    # Індекс sites_user тут створено ще на кроці 5
+    (8, "site list order index", []),
+]
+
+# Схема баз-шардів: лише таблиця sites у стані останньої версії основної схеми. Користувачі живуть
+# в основній базі, тож зовнішнього ключа на users тут немає. Версії нумеруються окремо від основних
+SHARD_MIGRATIONS = [
+    (1, "sites table", ["""
+        CREATE TABLE IF NOT EXISTS sites (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            site VARCHAR(255),
+            entrance_type VARCHAR(255),
+            user_id INT,
+            login VARCHAR(1024),
+            password VARCHAR(1024),
+            login_digest CHAR(64) NULL,
+            entrance_key VARCHAR(255) GENERATED ALWAYS AS (IF(entrance_type = 'password', NULL, entrance_type)) VIRTUAL,
+            INDEX sites_user (user_id),
+            UNIQUE INDEX sites_user_site_login (user_id, site, login_digest),
+            UNIQUE INDEX sites_user_site_entrance (user_id, site, entrance_key)
+        )
+    """]),
+]
+
+SQLITE_SHARD_MIGRATIONS = [
+    (1, "sites table", [
+        """CREATE TABLE IF NOT EXISTS sites (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            site VARCHAR(255),
+            entrance_type VARCHAR(255),
+            user_id INT,
+            login VARCHAR(255),
+            password VARCHAR(255),
+            login_digest CHAR(64) NULL
+        )""",
+        "CREATE INDEX sites_user ON sites (user_id)",
+        "CREATE UNIQUE INDEX sites_user_site_login ON sites (user_id, site, login_digest)",
+        "CREATE UNIQUE INDEX sites_user_site_entrance ON sites (user_id, site, entrance_type) "
+        "WHERE entrance_type <> 'password'",
+    ]),
+]
+
+
+class PoolTimeout(TimeoutError):
+    """Усі з'єднання пулу зайняті довше, ніж дозволяє таймаут очікування."""
+
+
+class ConnectionPool():
+    """Обмежений потокобезпечний пул з'єднань з перевіркою ping при видачі."""
+
+    def __init__(self, factory, min_size=1, max_size=5, idle_timeout=300.0, timeout=10.0):
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self._idle = deque()  # (з'єднання, час повернення в пул)
+        self._in_use = {}  # id виданого з'єднання -> покоління пулу, у якому його видано
+        self._generation = 0  # зростає з кожним close()
+        self._opened = 0
+        self._peak = 0  # найбільше одночасно відкритих з'єднань
+        self._timeouts = 0
+        self._cond = threading.Condition()
+
+    def _reap_idle(self):
+        # Закриваємо з'єднання, що простоюють надто довго, залишаючи щонайменше min_size
+        now = time.monotonic()
+        while self._idle and self._opened > self.min_size and now - self._idle[0][1] > self.idle_timeout:
+            conn, _ = self._idle.popleft()
+            self._opened -= 1
+            self._close_quietly(conn)
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _open(self):
+        try:
+            return self.factory()
+        except Exception:
+            with self._cond:
+                self._opened -= 1
+                self._cond.notify()
+            raise
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                self._reap_idle()
+                generation = self._generation
+                if self._idle:
+                    # Беремо найсвіжіше з'єднання - воно найімовірніше ще живе
+                    conn, _ = self._idle.pop()
+                    break
+                if self._opened < self.max_size:
+                    self._opened += 1
+                    self._peak = max(self._peak, self._opened)
+                    conn = None
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout("Немає вільних з'єднань з базою даних")
+                self._cond.wait(remaining)
+        if conn is None:
+            conn = self._open()
+        else:
+            try:
+                conn.ping(reconnect=True)
+            except Exception:
+                self._close_quietly(conn)
+                conn = self._open()
+        with self._cond:
+            self._in_use[id(conn)] = generation
+        return conn
+
+    def release(self, conn, discard=False):
+        with self._cond:
+            # З'єднання, видане до close(), у пул не повертається
+            if self._in_use.pop(id(conn), self._generation) != self._generation:
+                discard = True
+            if discard:
+                self._opened -= 1
+                self._close_quietly(conn)
+            else:
+                self._idle.append((conn, time.monotonic()))
+            self._reap_idle()
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        """Видає з'єднання з пулу і повертає його назад після виходу з блоку with."""
+        conn = self.acquire()
+        try:
+            yield conn
+        except BaseException as err:
+            broken = isinstance(err, (pymysql.err.OperationalError, pymysql.err.InterfaceError))
+            if not broken:
+                try:
+                    conn.rollback()
+                except Exception:
+                    broken = True
+            self.release(conn, discard=broken)
+            raise
+        else:
+            self.release(conn)
+
+    def close(self):
+        """Закриває вільні з'єднання; зайняті закриються, щойно їх повернуть."""
+        with self._cond:
+            self._generation += 1
+            while self._idle:
+                conn, _ = self._idle.pop()
+                self._opened -= 1
+                self._close_quietly(conn)
+
+    def stats(self):
+        with self._cond:
+            return {"opened": self._opened, "idle": len(self._idle), "in_use": self._opened - len(self._idle),
+                    "peak": self._peak, "max_size": self.max_size, "timeouts": self._timeouts}
+
+
+class QueryStats():
+    """Статистика запитів: час виконання і вибірки за відбитком запиту, відкриття з'єднань,
+    зведення за діями користувача та журнал повільних запитів.
+    Вимкнена статистика нічого не обгортає, тож і не коштує нічого."""
+    SLOW_LOG_SIZE = 100
+
+    def __init__(self, enabled=False, slow_threshold=0.2, slow_log_path=None):
+        self.enabled = enabled
+        self.slow_threshold = slow_threshold
+        self.slow_log_path = slow_log_path
+        self._lock = threading.Lock()
+        self._local = threading.local()  # дія, що виконується в поточному потоці
+        self._fingerprints = {}  # текст запиту -> відбиток
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.queries = {}
+            self.actions = {}
+            self.connects = {"count": 0, "seconds": 0.0}
+            self.slow = deque(maxlen=self.SLOW_LOG_SIZE)
+
+    def fingerprint(self, sql):
+        """Запит без літералів і зайвих пробілів, щоб однакові запити з різними даними збігалися."""
+        fingerprint = self._fingerprints.get(sql)
+        if fingerprint is None:
+            fingerprint = re.sub(r"'(?:[^'\\]|\\.|'')*'|\b\d+\b", "?", sql)
+            fingerprint = re.sub(r"\(\s*(?:%s|\?)(?:\s*,\s*(?:%s|\?))+\s*\)", "(...)", fingerprint)
+            fingerprint = " ".join(fingerprint.split())
+            if len(self._fingerprints) < 1000:
+                self._fingerprints[sql] = fingerprint
+        return fingerprint
+
+    def bind(self, action, fn):
+        """fn, чиї запити зараховуються до дії action. Без статистики повертає fn як є."""
+        if not self.enabled:
+            return fn
+
+        def tracked(*args, **kwargs):
+            self._local.action = action
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._local.action = None
+                with self._lock:
+                    entry = self.actions.setdefault(action, {"count": 0, "seconds": 0.0, "queries": 0,
+                                                             "db_seconds": 0.0, "connects": 0})
+                    entry["count"] += 1
+                    entry["seconds"] += time.perf_counter() - start
+        return tracked
+
+    def _action_entry(self):
+        action = getattr(self._local, "action", None)
+        if action is None:
+            return None
+        return self.actions.setdefault(action, {"count": 0, "seconds": 0.0, "queries": 0,
+                                                "db_seconds": 0.0, "connects": 0})
+
+    def record_connect(self, seconds):
+        with self._lock:
+            self.connects["count"] += 1
+            self.connects["seconds"] += seconds
+            entry = self._action_entry()
+            if entry is not None:
+                entry["connects"] += 1
+                entry["db_seconds"] += seconds
+
+    def record_query(self, sql, seconds, rows):
+        fingerprint = self.fingerprint(sql)
+        with self._lock:
+            entry = self.queries.get(fingerprint)
+            if entry is None:
+                entry = self.queries[fingerprint] = {"count": 0, "seconds": 0.0, "max_seconds": 0.0,
+                                                     "fetch_seconds": 0.0, "rows": 0}
+            entry["count"] += 1
+            entry["seconds"] += seconds
+            entry["max_seconds"] = max(entry["max_seconds"], seconds)
+            # Небуферизований курсор повідомляє rowcount -1 (або 2**64-1), його рядки рахуються при вибірці
+            entry["rows"] += rows if 0 <= rows < 2 ** 63 else 0
+            action = self._action_entry()
+            if action is not None:
+                action["queries"] += 1
+                action["db_seconds"] += seconds
+            slow = self.slow_threshold is not None and seconds >= self.slow_threshold
+            if slow:
+                record = {"at": time.time(), "seconds": seconds, "query": fingerprint,
+                          "action": getattr(self._local, "action", None)}
+                self.slow.append(record)
+        if slow and self.slow_log_path:
+            with open(self.slow_log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        return fingerprint
+
+    def record_fetch(self, fingerprint, seconds, rows):
+        with self._lock:
+            entry = self.queries.get(fingerprint)
+            if entry is not None:
+                entry["fetch_seconds"] += seconds
+                entry["rows"] += rows
+            action = self._action_entry()
+            if action is not None:
+                action["db_seconds"] += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "slow_threshold": self.slow_threshold,
+                "connects": dict(self.connects),
+                "actions": {name: dict(entry) for name, entry in self.actions.items()},
+                "queries": {name: dict(entry) for name, entry in self.queries.items()},
+                "slow": list(self.slow),
+            }
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), ensure_ascii=False, indent=2)
+
+    def to_prometheus(self):
+        """Текстовий формат експозиції Prometheus."""
+        def label(value):
+            return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+        snapshot = self.snapshot()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                text = ",".join(f'{key}="{label(val)}"' for key, val in labels.items())
+                lines.append(f"{name}{{{text}}} {value}" if text else f"{name} {value}")
+
+        metric("app_db_connections_opened_total", "counter", "Opened database connections",
+               [({}, snapshot["connects"]["count"])])
+        metric("app_db_connect_seconds_total", "counter", "Time spent opening database connections",
+               [({}, snapshot["connects"]["seconds"])])
+        queries = snapshot["queries"].items()
+        metric("app_db_queries_total", "counter", "Executed statements by fingerprint",
+               [({"query": fp}, q["count"]) for fp, q in queries])
+        metric("app_db_query_seconds_total", "counter", "Statement execution time by fingerprint",
+               [({"query": fp}, q["seconds"]) for fp, q in queries])
+        metric("app_db_fetch_seconds_total", "counter", "Result fetch time by fingerprint",
+               [({"query": fp}, q["fetch_seconds"]) for fp, q in queries])
+        metric("app_db_rows_total", "counter", "Rows returned or affected by fingerprint",
+               [({"query": fp}, q["rows"]) for fp, q in queries])
+        actions = snapshot["actions"].items()
+        metric("app_actions_total", "counter", "Completed user actions",
+               [({"action": name}, a["count"]) for name, a in actions])
+        metric("app_action_seconds_total", "counter", "Wall time of user actions",
+               [({"action": name}, a["seconds"]) for name, a in actions])
+        metric("app_action_db_seconds_total", "counter", "Database time of user actions",
+               [({"action": name}, a["db_seconds"]) for name, a in actions])
+        metric("app_action_queries_total", "counter", "Database round trips of user actions",
+               [({"action": name}, a["queries"]) for name, a in actions])
+        metric("app_slow_queries", "gauge", "Slow queries currently in the log", [({}, len(snapshot["slow"]))])
+        return "\n".join(lines) + "\n"
+
+
+class InstrumentedCursor():
+    """Курсор, що передає все справжньому курсору і записує час, рядки та відбиток кожного запиту."""
+
+    def __init__(self, cursor, stats: QueryStats):
+        self._cursor = cursor
+        self._stats = stats
+        self._fingerprint = None
+        # У SSCursor rowcount до кінця вибірки невідомий, тож рядки рахуються під час читання;
+        # адаптер SQLite позначає такі курсори атрибутом unbuffered
+        self._unbuffered = getattr(cursor, "unbuffered", False) or isinstance(cursor, pymysql.cursors.SSCursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._cursor.close()
+
+    def _timed(self, method, query, args):
+        start = time.perf_counter()
+        try:
+            return method(query, args)
+        finally:
+            self._fingerprint = self._stats.record_query(query, time.perf_counter() - start, self._cursor.rowcount)
+
+    def execute(self, query, args=None):
+        return self._timed(self._cursor.execute, query, args)
+
+    def executemany(self, query, args):
+        return self._timed(self._cursor.executemany, query, args)
+
+    def _fetched(self, start, rows):
+        self._stats.record_fetch(self._fingerprint, time.perf_counter() - start, rows)
+
+    def fetchone(self):
+        start = time.perf_counter()
+        row = self._cursor.fetchone()
+        # Рядки буферизованого курсора вже враховані у rowcount
+        self._fetched(start, 1 if self._unbuffered and row is not None else 0)
+        return row
+
+    def fetchmany(self, size=None):
+        start = time.perf_counter()
+        rows = self._cursor.fetchmany(size)
+        self._fetched(start, len(rows) if self._unbuffered else 0)
+        return rows
+
+    def fetchall(self):
+        start = time.perf_counter()
+        rows = self._cursor.fetchall()
+        self._fetched(start, len(rows) if self._unbuffered else 0)
+        return rows
+
+    def __iter__(self):
+        # Час вибірки небуферизованого курсора - лише очікування наступного рядка, без обробки викликачем
+        fetchone = self._cursor.fetchone
+        while True:
+            start = time.perf_counter()
+            row = fetchone()
+            if row is None:
+                self._fetched(start, 0)
+                return
+            self._fetched(start, 1 if self._unbuffered else 0)
+            yield row
+
+
+class InstrumentedConnection():
+    def __init__(self, connection, stats: QueryStats):
+        self._connection = connection
+        self._stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self._connection, name)
+
+    def cursor(self, *args, **kwargs):
+        return InstrumentedCursor(self._connection.cursor(*args, **kwargs), self._stats)
+
+
+class MySQLBackend():
+    """Віддалений MySQL через pymysql - параметри з'єднання з .env."""
+    name = "mysql"
+    migrations = MIGRATIONS
+    shard_migrations = SHARD_MIGRATIONS
+
+    def __init__(self, host=None, user=None, password=None, database=None, charset="utf8mb4"):
+        self.host = host
+        self.user = user
+        self.password = password
+        self.database = database
+        self.charset = charset
+
+    @property
+    def identity(self):
+        return f"mysql://{self.user}@{self.host}/{self.database}"
+
+    def connect(self):
+        # autocommit, щоб з'єднання з пулу не тримали старий знімок даних між запитами;
+        # багатокрокові транзакції відкриваються явно через connection.begin()
+        return pymysql.connect(
+            host=self.host,
+            user=self.user,
+            password=self.password,
+            database=self.database,
+            charset=self.charset,
+            cursorclass=pymysql.cursors.DictCursor,
+            autocommit=True
+        )
+
+    @contextmanager
+    def migration_lock(self, connection, c):
+        # Блокування, щоб два клієнти, запущені одночасно, не застосовували ті самі кроки
+        c.execute("SELECT GET_LOCK('schema_migration', 30) AS locked")
+        if not c.fetchone()["locked"]:
+            raise pymysql.MySQLError("Не вдалося дочекатися міграції схеми іншим клієнтом")
+        try:
+            yield
+        finally:
+            c.execute("SELECT RELEASE_LOCK('schema_migration')")
+
+
+class SQLiteCursor():
+    """Курсор sqlite3 з інтерфейсом курсора pymysql: параметри %s, рядки-словники
+    (або кортежі для SSCursor/Cursor) і помилки pymysql з кодами MySQL,
+    тож код сервісів не залежить від того, яка база під ним."""
+
+    def __init__(self, connection, as_dict=True, unbuffered=False):
+        self._cursor = connection.cursor()
+        self.as_dict = as_dict
+        self.unbuffered = unbuffered
+        self._names = ()
+        self._rows = None  # буфер рядків для буферизованих курсорів
+        self.lastrowid = None
+        self.rowcount = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @staticmethod
+    def translate(query):
+        sql = query.replace("%s", "?")
+        # У MySQL \ - типовий символ екранування для LIKE, у SQLite його треба вказати явно
+        return sql.replace(" LIKE ?", " LIKE ? ESCAPE '\\'")
+
+    @staticmethod
+    def _error(err):
+        message = str(err)
+        if isinstance(err, sqlite3.IntegrityError):
+            # Як у MySQL 8: "Duplicate entry ... for key 'users.email'"
+            if message.startswith("UNIQUE constraint failed: "):
+                return pymysql.err.IntegrityError(DUP_ENTRY, f"Duplicate entry for key '{message[26:]}'")
+            return pymysql.err.IntegrityError(0, message)
+        if "no such table" in message:
+            return pymysql.err.ProgrammingError(NO_SUCH_TABLE, message)
+        if isinstance(err, sqlite3.OperationalError) and ("syntax error" in message or "no such column" in message):
+            return pymysql.err.ProgrammingError(0, message)
+        if isinstance(err, sqlite3.OperationalError):
+            return pymysql.err.OperationalError(0, message)
+        return pymysql.err.DatabaseError(0, message)
+
+    def _run(self, method, query, args):
+        try:
+            method(self.translate(query), args)
+        except sqlite3.Error as err:
+            raise self._error(err) from err
+        self._names = tuple(d[0] for d in self._cursor.description or ())
+        self.lastrowid = self._cursor.lastrowid
+        if self._names and not self.unbuffered:
+            # Буферизований курсор pymysql читає весь результат одразу і знає кількість рядків
+            self._rows = deque(self._convert(row) for row in self._cursor.fetchall())
+            self.rowcount = len(self._rows)
+        else:
+            self._rows = None
+            self.rowcount = self._cursor.rowcount
+        return self.rowcount
+
+    def execute(self, query, args=None):
+        return self._run(self._cursor.execute, query, args or ())
+
+    def executemany(self, query, args):
+        return self._run(self._cursor.executemany, query, args)
+
+    def _convert(self, row):
+        return dict(zip(self._names, row)) if self.as_dict else row
+
+    def fetchone(self):
+        if self._rows is not None:
+            return self._rows.popleft() if self._rows else None
+        row = self._cursor.fetchone()
+        return None if row is None else self._convert(row)
+
+    def fetchmany(self, size=None):
+        if self._rows is None:
+            return [self._convert(row) for row in self._cursor.fetchmany(size or 1)]
+        rows = []
+        for _ in range(size or 1):
+            row = self.fetchone()
+            if row is None:
+                break
+            rows.append(row)
+        return rows
+
+    def fetchall(self):
+        if self._rows is not None:
+            rows, self._rows = list(self._rows), deque()
+            return rows
+        return [self._convert(row) for row in self._cursor.fetchall()]
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection():
+    """З'єднання sqlite3 з інтерфейсом pymysql. Як і з'єднання MySQL, працює в режимі autocommit,
+    а транзакції відкриваються явно через begin()."""
+
+    def __init__(self, path):
+        # Пул видає з'єднання різним потокам, але кожне - лише одному за раз
+        self._db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+
+    def cursor(self, cursorclass=None):
+        cursorclass = cursorclass or pymysql.cursors.DictCursor
+        return SQLiteCursor(self._db, as_dict=issubclass(cursorclass, pymysql.cursors.DictCursorMixin),
+                            unbuffered=issubclass(cursorclass, pymysql.cursors.SSCursor))
+
+    def ping(self, reconnect=False):
+        pass  # вбудованій базі нема з чим втрачати зв'язок
+
+    def begin(self):
+        self._db.execute("BEGIN")
+
+    def commit(self):
+        if self._db.in_transaction:
+            self._db.commit()
+
+    def rollback(self):
+        if self._db.in_transaction:
+            self._db.rollback()
+
+    def close(self):
+        self._db.close()
+
+
+class SQLiteBackend():
+    """Вбудована база SQLite у файлі (WAL): без мережі і сервера, для однокористувацьких
+    встановлень, тестів і бенчмарків."""
+    name = "sqlite"
+    migrations = SQLITE_MIGRATIONS
+    shard_migrations = SQLITE_SHARD_MIGRATIONS
+
+    def __init__(self, path="sites.db"):
+        self.path = path
+
+    @property
+    def identity(self):
+        return f"sqlite://{os.path.abspath(self.path)}"
+
+    def connect(self):
+        return SQLiteConnection(self.path)
+
+    @contextmanager
+    def migration_lock(self, connection, c):
+        # BEGIN IMMEDIATE бере блокування запису: інший процес чекає, доки міграція не завершиться.
+        # DDL у SQLite транзакційний, тож невдала міграція відкочується повністю
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            connection.rollback()
+            raise
+        connection.commit()
+
+
+class ShardMap():
+    """Бази-шарди для таблиці sites. Шард нового користувача обирається rendezvous-хешуванням:
+    з names береться той, чий sha256("назва:user_id") найбільший. Тож додавання чи виведення
+    шарду змінює розміщення лише ~1/n користувачів, а не майже всіх, як user_id % len(names).
+    Фактичне розміщення кожного записане в users.shard, тож зміна карти сама нікого
+    не переносить - це робить rebalance.py. Порожня карта - без шардів.
+    Шард, що виводиться з роботи, лишається в карті з "placement": false: нових користувачів
+    туди не розміщує, але rebalance.py ще може з нього перенести."""
+
+    def __init__(self, shards=None, names=None):
+        self.shards = dict(shards or {})  # назва -> бекенд, у порядку карти
+        self.names = list(self.shards) if names is None else list(names)  # шарди для нових розміщень
+
+    def placement(self, user_id):
+        if not self.names:
+            return None
+        return max(self.names, key=lambda name: hashlib.sha256(f"{name}:{user_id}".encode()).digest())
+
+    @classmethod
+    def load(cls, path):
+        """JSON {"shards": [{"name": "s1", "backend": "mysql", "host": ..., "user": ..., "password_env": ...,
+        "database": ...}, {"name": "s2", "backend": "sqlite", "path": ...}]}. Пароль можна вказати
+        прямо (password) або назвою змінної оточення (password_env)."""
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+        shards, names = {}, []
+        for spec in config["shards"]:
+            kind = spec.get("backend", "mysql")
+            if kind == "sqlite":
+                backend = SQLiteBackend(spec["path"])
+            elif kind == "mysql":
+                password = os.getenv(spec["password_env"]) if "password_env" in spec else spec.get("password")
+                backend = MySQLBackend(host=spec.get("host"), user=spec.get("user"), password=password,
+                                       database=spec.get("database"), charset=spec.get("charset", "utf8mb4"))
+            else:
+                raise ValueError(f"Невідомий бекенд шарду {spec.get('name')}: {kind}")
+            shards[spec["name"]] = backend
+            if spec.get("placement", True):
+                names.append(spec["name"])
+        return cls(shards, names)
+
+
+class Connector():
+    """Пул з'єднань над обраною базою. Створення нічого не читає і не відкриває:
+    .env, вибір бази і пул налаштовуються при першому зверненні до БД, тобто вже у фоновому потоці.
+
+    З картою шардів (DB_SHARD_MAP) основна база тримає користувачів, а сайти кожного користувача -
+    шард з users.shard; for_user() повертає Connector потрібної бази зі своїм пулом."""
+    PLACEMENT_TTL = 30.0  # скільки пам'ятати шард користувача; rebalance.py чекає довше перед очищенням
+    MAX_PLACEMENTS = 10000  # скільки користувачів пам'ятати; найдавніше використаних забуваємо
+
+    def __init__(self, backend=None, shard_map=None):
+        self._backend = backend
+        self._shard_map = shard_map
+        self._shards = {}  # назва шарду -> Connector
+        self._placements = OrderedDict()  # user_id -> (назва шарду або None, до якого часу дійсно)
+        self._placements_lock = threading.Lock()
+        self._pool = None
+        self._configure_lock = threading.Lock()
+        self.stats = QueryStats()
+
+    @property
+    def Error(self):
+        return pymysql.MySQLError
+
+    def _configure(self):
+        with self._configure_lock:
+            if self._pool is not None:
+                return
+            load_env()
+            # Модуль-заглушку LazyLoader виконуємо тут, під блокуванням, а не одночасно з кількох потоків
+            pymysql.err
+            if self._backend is None:
+                self._backend = self._backend_from_env()
+            if self._shard_map is None:
+                path = os.getenv("DB_SHARD_MAP")
+                self._shard_map = ShardMap.load(path) if path else ShardMap()
+            for name, backend in self._shard_map.shards.items():
+                shard = Connector(backend, ShardMap())
+                shard.stats = self.stats  # одна статистика на всі бази
+                self._shards[name] = shard
+            self.stats.enabled = self.stats.enabled or os.getenv("DB_INSTRUMENT", "") == "1"
+            self.stats.slow_threshold = float(os.getenv("DB_SLOW_QUERY_MS", 200)) / 1000
+            self.stats.slow_log_path = os.getenv("DB_SLOW_QUERY_LOG") or None
+            self._pool = ConnectionPool(
+                self.create_connection,
+                min_size=int(os.getenv("DB_POOL_MIN_SIZE", 1)),
+                max_size=int(os.getenv("DB_POOL_MAX_SIZE", 5)),
+                idle_timeout=float(os.getenv("DB_POOL_IDLE_TIMEOUT", 300)),
+                timeout=float(os.getenv("DB_POOL_TIMEOUT", 10)),
+            )
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._configure()
+        return self._backend
+
+    @property
+    def pool(self) -> ConnectionPool:
+        if self._pool is None:
+            self._configure()
+        return self._pool
+
+    @property
+    def shard_map(self) -> ShardMap:
+        if self._pool is None:
+            self._configure()
+        return self._shard_map
+
+    def shard(self, name):
+        """Connector шарду за назвою; None - основна база."""
+        if name is None:
+            return self
+        if self._pool is None:
+            self._configure()
+        try:
+            return self._shards[name]
+        except KeyError:
+            raise ValueError(f"Шарду {name} немає в карті шардів") from None
+
+    def for_user(self, user_id):
+        """Connector бази, де лежать сайти користувача. Без шардів - сама основна база."""
+        if not self.shard_map.shards:
+            return self
+        with self._placements_lock:
+            cached = self._placements.get(user_id)
+            if cached is not None:
+                self._placements.move_to_end(user_id)
+        if cached is not None and cached[1] > time.monotonic():
+            return self.shard(cached[0])
+        with self.connection() as connection, connection.cursor() as c:
+            c.execute("SELECT shard FROM users WHERE id = %s", (user_id,))
+            row = c.fetchone()
+        name = row["shard"] if row is not None else None
+        self.remember_placement(user_id, name)
+        return self.shard(name)
+
+    def remember_placement(self, user_id, name):
+        """Запам'ятовує шард користувача, прочитаний разом з ним самим (напр. при вході)."""
+        if self._shard_map is not None and self._shard_map.shards:
+            with self._placements_lock:
+                self._placements[user_id] = (name, time.monotonic() + self.PLACEMENT_TTL)
+                self._placements.move_to_end(user_id)
+                while len(self._placements) > self.MAX_PLACEMENTS:
+                    self._placements.popitem(last=False)
+
+    def place_new_user(self, c, user_id):
+        """Розміщує сайти щойно зареєстрованого користувача за картою шардів; c - курсор основної бази."""
+        name = self.shard_map.placement(user_id)
+        if name is not None:
+            c.execute("UPDATE users SET shard = %s WHERE id = %s", (name, user_id))
+            self.remember_placement(user_id, name)
+
+    def create_connection(self):
+        if not self.stats.enabled:
+            return self._connect()
+        start = time.perf_counter()
+        connection = self._connect()
+        self.stats.record_connect(time.perf_counter() - start)
+        return InstrumentedConnection(connection, self.stats)
+
+    def set_instrumentation(self, enabled):
+        """Вмикає чи вимикає статистику запитів. Вільні з'єднання закриваються, а зайняті -
+        після повернення в пул, щоб усі наступні відкрилися вже з обгорткою (або без неї)."""
+        self.stats.enabled = enabled
+        if self._pool is not None:
+            self._pool.close()
+        for shard in self._shards.values():
+            shard.set_instrumentation(enabled)
+
+    @staticmethod
+    def _backend_from_env():
+        """DB_BACKEND=mysql (типово) або sqlite з файлом DB_PATH."""
+        kind = os.getenv("DB_BACKEND", "mysql").lower()
+        if kind == "sqlite":
+            return SQLiteBackend(os.getenv("DB_PATH", "sites.db"))
+        if kind != "mysql":
+            raise ValueError(f"Невідомий DB_BACKEND: {kind}")
+        return MySQLBackend(
+            host=os.getenv("DB_HOST"),
+            user=os.getenv("DB_USER"),
+            password=os.getenv("DB_PASSWORD"),
+            database=os.getenv("DB_NAME"),
+            charset=os.getenv("DB_CHARSET", "utf8mb4"),
+        )
+
+    def _connect(self):
+        return self.backend.connect()
+
+    def connection(self):
+        """Контекстний менеджер: бере з'єднання з пулу і повертає його після використання."""
+        return self.pool.connection()
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+        for shard in self._shards.values():
+            shard.close()
+
+    def _schema_version(self, c):
+        """Поточна версія схеми або None, якщо таблиці schema_version ще немає."""
+        try:
+            c.execute("SELECT MAX(version) AS version FROM schema_version")
+        except pymysql.err.ProgrammingError as err:
+            if err.args[0] != NO_SUCH_TABLE:
+                raise
+            return None
+        return c.fetchone()["version"] or 0
+
+    def local_path(self, name):
+        """Шлях до локального файлу застосунку, прив'язаного саме до цієї бази."""
+        cache_dir = os.getenv("DB_SCHEMA_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "some-app")
+        key = hashlib.sha256(self.backend.identity.encode()).hexdigest()[:16]
+        return os.path.join(cache_dir, name.format(key=key))
+
+    def _schema_marker(self, latest):
+        """Файл-позначка, що схема цієї бази вже перевірена до версії latest.
+        Поки він є, запуск не звертається до БД взагалі."""
+        return self.local_path(f"schema-{{key}}-v{latest}")
+
+    def _mark_schema_verified(self, marker):
+        try:
+            os.makedirs(os.path.dirname(marker), exist_ok=True)
+            with open(marker, "w", encoding="utf-8") as f:
+                f.write(self.backend.identity + "\n")
+        except OSError:
+            pass  # без позначки наступний запуск просто перевірить схему ще раз
+
+    def forget_schema_verified(self):
+        """Прибирає позначки основної бази і шардів, напр. якщо базу перестворили без застосунку."""
+        markers = [self._schema_marker(self.backend.migrations[-1][0])]
+        markers += [shard._schema_marker(shard.backend.shard_migrations[-1][0]) for shard in self._shards.values()]
+        for marker in markers:
+            try:
+                os.remove(marker)
+            except FileNotFoundError:
+                pass
+
+    def run_with_schema(self, fn, *args):
+        """fn(*args), а якщо таблиці немає (базу перестворили, а позначка перевіреної схеми лишилася) -
+        позначки прибираються, схема доводиться заново і fn повторюється один раз."""
+        try:
+            return fn(*args)
+        except pymysql.err.ProgrammingError as err:
+            if err.args[0] != NO_SUCH_TABLE:
+                raise
+        self.forget_schema_verified()
+        self.migrate()
+        return fn(*args)
+
+    def migrate(self, migrations=None, use_marker=True):
+        """Доводить схему до останньої версії. Якщо вона актуальна - це один запит,
+        а якщо є позначка перевіреної схеми - жодного. Шарди отримують свою схему (shard_migrations)."""
+        if migrations is None and self.shard_map.shards:
+            for shard in self._shards.values():
+                shard.migrate(shard.backend.shard_migrations, use_marker)
+        migrations = migrations or self.backend.migrations
+        latest = migrations[-1][0]
+        marker = self._schema_marker(latest) if use_marker else None
+        if marker is not None and os.path.exists(marker):
+            return latest
+        current = self._apply_migrations(migrations, latest)
+        if marker is not None and current >= latest:
+            self._mark_schema_verified(marker)
+        return current
+
+    def _apply_migrations(self, migrations, latest):
+        with self.connection() as connection, connection.cursor() as c:
+            current = self._schema_version(c)
+            if current is not None and current >= latest:
+                return current
+            with self.backend.migration_lock(connection, c):
+                c.execute("""
+                    CREATE TABLE IF NOT EXISTS schema_version (
+                        version INT PRIMARY KEY,
+                        description VARCHAR(255),
+                        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                current = self._schema_version(c)
+                for version, description, statements in migrations:
+                    if version <= current:
+                        continue
+                    for statement in statements:
+                        c.execute(statement)
+                    c.execute("INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                              (version, description))
+                    current = version
+        return current
+
+def _scrypt(password: str, salt: bytes, n: int, r: int, p: int) -> bytes:
+    # Функція рівня модуля, щоб її можна було передати в процес пулу
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=256 * r * n, dklen=32)
+
+
+def _calibrate_scrypt(target_seconds: float, r: int, p: int, max_n: int) -> int:
+    """Найменше n (степінь двійки), за якого хеш рахується щонайменше target_seconds."""
+    n = 2 ** 12
+    while n < max_n:
+        start = time.perf_counter()
+        _scrypt("calibration", b"\0" * 16, n, r, p)
+        if time.perf_counter() - start >= target_seconds:
+            break
+        n *= 2
+    return n
+
+
+class PasswordHasher():
+    """Хешування паролів scrypt у пулі процесів, щоб дорогий KDF не блокував потоки застосунку.
+    Формат хешу: scrypt$n$r$p$сіль$хеш - параметри зберігаються разом з хешем,
+    тож вартість можна підвищувати, а старі хеші перераховуються при вході."""
+    PREFIX = "scrypt"
+    MAX_N = 2 ** 17
+    KEY_PARAMS = (2 ** 14, 8, 1)
+
+    def __init__(self, target_seconds=0.1, workers=None):
+        self.target_seconds = target_seconds  # None - з PASSWORD_HASH_TARGET_MS (мс) під час калібрування
+        self.workers = workers
+        self.n = 2 ** 14  # до завершення калібрування
+        self.r = 8
+        self.p = 1
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                from concurrent.futures import ProcessPoolExecutor
+                # spawn, а не fork: батьківський процес уже має потоки і Tk
+                self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                     mp_context=multiprocessing.get_context("spawn"))
+            return self._executor
+
+    def calibrate(self):
+        if self.target_seconds is None:
+            load_env()
+            self.target_seconds = float(os.getenv("PASSWORD_HASH_TARGET_MS", 100)) / 1000
+        self.n = self._pool().submit(_calibrate_scrypt, self.target_seconds, self.r, self.p, self.MAX_N).result()
+        return self.n
+
+    def hash(self, password: str) -> str:
+        salt = os.urandom(16)
+        n, r, p = self.n, self.r, self.p
+        digest = self._pool().submit(_scrypt, password, salt, n, r, p).result()
+        return "$".join((self.PREFIX, str(n), str(r), str(p),
+                         base64.b64encode(salt).decode(), base64.b64encode(digest).decode()))
+
+    def verify(self, password: str, stored: str):
+        """Повертає (пароль вірний, хеш треба перерахувати). Рядки без префікса - старі паролі у відкритому вигляді."""
+        if not stored.startswith(self.PREFIX + "$"):
+            ok = hmac.compare_digest(stored.encode(), password.encode())
+            return ok, ok
+        _, n, r, p, salt, digest = stored.split("$")
+        n, r, p = int(n), int(r), int(p)
+        computed = self._pool().submit(_scrypt, password, base64.b64decode(salt), n, r, p).result()
+        ok = hmac.compare_digest(computed, base64.b64decode(digest))
+        return ok, ok and (n, r, p) < (self.n, self.r, self.p)
+
+    def derive_key(self, password: str, salt: str) -> bytes:
+        """Ключ шифрування облікових даних сайтів; параметри фіксовані, бо від них залежать уже зашифровані дані."""
+        return self._pool().submit(_scrypt, password, base64.b64decode(salt), *self.KEY_PARAMS).result()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+class CredentialVault():
+    """Шифрування логінів і паролів сайтів ключем, виведеним з пароля користувача.
+    Ключ живе лише протягом сесії; розшифровуються тільки рядки, які користувач відкрив,
+    а розшифровані значення тримаються в невеликому LRU-кеші, що стирається при виході.
+
+    Значення шифруються AES-256-GCM з пакета cryptography (префікс enc2$). Записи, збережені
+    до появи шифрування, лишаються відкритим текстом, доки їх не зашифрує encrypt_legacy_sites."""
+    PREFIX = "enc2$"
+    NONCE_SIZE = 12
+
+    def __init__(self, cache_size=64):
+        self.cache_size = cache_size
+        self._aead = self._index_key = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def unlocked(self):
+        return self._aead is not None
+
+    def unlock(self, master_key: bytes):
+        # Окремі ключі для AES-GCM та індексу дублікатів
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+        with self._lock:
+            self._aead = AESGCM(hmac.new(master_key, b"aead", hashlib.sha256).digest())
+            self._index_key = hmac.new(master_key, b"index", hashlib.sha256).digest()
+            self._cache.clear()
+
+    def lock(self):
+        with self._lock:
+            self._aead = self._index_key = None
+            self._cache.clear()
+
+    def encrypt(self, value: str) -> str:
+        nonce = os.urandom(self.NONCE_SIZE)
+        return self.PREFIX + base64.b64encode(nonce + self._aead.encrypt(nonce, value.encode(), None)).decode()
+
+    def decrypt(self, blob: str) -> str:
+        """Розшифровує одне значення. Рядки без префікса - старі записи у відкритому вигляді."""
+        if blob and blob.startswith(self.PREFIX):
+            from cryptography.exceptions import InvalidTag
+            raw = base64.b64decode(blob[len(self.PREFIX):])
+            try:
+                return self._aead.decrypt(raw[:self.NONCE_SIZE], raw[self.NONCE_SIZE:], None).decode()
+            except InvalidTag:
+                raise ValueError("Пошкоджені або чужі облікові дані") from None
+        return blob
+
+    def reveal(self, blob: str) -> str:
+        """decrypt з кешем останніх розшифрованих значень."""
+        with self._lock:
+            if blob in self._cache:
+                self._cache.move_to_end(blob)
+                return self._cache[blob]
+        value = self.decrypt(blob)
+        with self._lock:
+            self._cache[blob] = value
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return value
+
+    def digest(self, value: str) -> str:
+        """Детермінований HMAC значення для пошуку дублікатів без розшифрування."""
+        return hmac.new(self._index_key, value.encode(), hashlib.sha256).hexdigest()
+
+
+class SiteRecord():
+    """Компактний рядок списку сайтів замість словника DictCursor: лише те, що потрібно списку,
+    пошуку й експорту, без user_id. Будується з кортежу курсора у порядку COLUMNS.
+    status - лише для рядків UI, що ще чекають запису: PENDING або текст попередження."""
+    __slots__ = ("id", "site", "entrance_type", "login", "password", "login_digest", "status")
+    COLUMNS = ("id", "site", "entrance_type", "login", "password", "login_digest")
+    PENDING = "pending"
+    _entrance_types = {}  # одна копія рядка на тип входу замість окремої в кожному рядку
+
+    def __init__(self, id, site, entrance_type, login, password, login_digest=None, status=None):
+        self.id = id
+        self.site = site
+        self.entrance_type = self._entrance_types.setdefault(entrance_type, entrance_type)
+        self.login = login
+        self.password = password
+        self.login_digest = login_digest
+        self.status = status
+
+    @classmethod
+    def from_insert(cls, row, site_id=None, status=None):
+        """З кортежу значень SitesService.INSERT_QUERY."""
+        site, entrance_type, _, login, password, login_digest = row
+        return cls(site_id, site, entrance_type, login, password, login_digest, status)
+
+    def __repr__(self):
+        return f"SiteRecord(id={self.id!r}, site={self.site!r}, entrance_type={self.entrance_type!r})"
+
+
+class SitesCache():
+    """Кеш сайтів користувачів: LRU за кількістю акаунтів і TTL для кожного запису.
+    Для кожного користувача зберігається неперервний початок списку, впорядкованого за id."""
+
+    def __init__(self, max_users=16, ttl=300.0):
+        self.max_users = max_users
+        self.ttl = ttl
+        self._entries = OrderedDict()  # user_id -> {"rows", "ids", "complete", "created"}
+        self._generation = 0  # зростає з кожною зміною записів поза store_page
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self):
+        """Читається перед запитом і передається в store_page: якщо між ними кеш змінювали
+        (add, invalidate), прочитана сторінка могла не побачити цієї зміни."""
+        with self._lock:
+            return self._generation
+
+    def _entry(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        if time.monotonic() - entry["created"] > self.ttl:
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return entry
+
+    def get_page(self, user_id, after_id=0, limit=None):
+        """Повертає сторінку з кешу або None, якщо її там немає повністю."""
+        with self._lock:
+            entry = self._entry(user_id)
+            if entry is None:
+                return None
+            start = bisect_right(entry["ids"], after_id)
+            if limit is None:
+                return entry["rows"][start:] if entry["complete"] else None
+            if start + limit <= len(entry["rows"]) or entry["complete"]:
+                return entry["rows"][start:start + limit]
+            return None
+
+    def store_page(self, user_id, after_id, limit, rows, generation=None):
+        """Зберігає сторінку, лише якщо вона продовжує вже закешований початок списку
+        і кеш не змінювався після generation (якщо його передано)."""
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            entry = self._entry(user_id)
+            if entry is None:
+                if after_id != 0:
+                    return
+                entry = {"rows": [], "ids": [], "complete": False, "created": time.monotonic()}
+                self._entries[user_id] = entry
+                while len(self._entries) > self.max_users:
+                    self._entries.popitem(last=False)
+            elif entry["complete"] or (entry["ids"][-1] if entry["ids"] else 0) != after_id:
+                return
+            entry["rows"].extend(rows)
+            entry["ids"].extend(row.id for row in rows)
+            entry["complete"] = limit is None or len(rows) < limit
+
+    def add(self, user_id, row):
+        """Write-through після успішного INSERT. Неповний запис скидається: його може саме заповнювати
+        сторінка, прочитана до INSERT; з тієї ж причини сторінки, запитані до add, уже не зберігаються."""
+        with self._lock:
+            self._generation += 1
+            entry = self._entry(user_id)
+            if entry is None:
+                return
+            if entry["complete"]:
+                entry["rows"].append(row)
+                entry["ids"].append(row.id)
+            else:
+                del self._entries[user_id]
+
+    def invalidate(self, user_id=None):
+        with self._lock:
+            self._generation += 1
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+
+
+def _iter_json_array(file, chunk_size=65536):
+    """Потоково розбирає JSON-масив об'єктів, не завантажуючи весь файл у пам'ять."""
+    decoder = json.JSONDecoder()
+    buffer = file.read(chunk_size).lstrip()
+    if not buffer.startswith("["):
+        raise ValueError("Очікувався JSON-масив записів")
+    buffer = buffer[1:]
+    eof = False
+    while True:
+        buffer = buffer.lstrip()
+        if buffer.startswith(","):
+            buffer = buffer[1:].lstrip()
+        if buffer.startswith("]"):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = file.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+            continue
+        yield item
+        buffer = buffer[end:]
+
+
+IMPORT_FIELDS = ("site", "url", "entrance_type", "login", "username", "password")
+
+
+def _read_import_rows(path):
+    """Записи з CSV, JSON Lines (.jsonl) або JSON-масиву. Поля url/username інших
+    менеджерів паролів приймаються як site/login. Замість запису, що не є об'єктом
+    або має нерядкові значення полів, повертається None."""
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        if ext == ".csv":
+            rows = csv.DictReader(f)
+        elif ext == ".jsonl":
+            rows = (json.loads(line) for line in f if line.strip())
+        else:
+            rows = _iter_json_array(f)
+        for row in rows:
+            if not isinstance(row, dict) or any(not isinstance(row.get(field), (str, type(None)))
+                                                for field in IMPORT_FIELDS):
+                yield None
+                continue
+            site = (row.get("site") or row.get("url") or "").strip()
+            if "://" in site:
+                site = site.split("://", 1)[1].split("/", 1)[0]
+            yield (site,
+                   (row.get("entrance_type") or "password").strip().lower(),
+                   row.get("login") or row.get("username") or "",
+                   row.get("password") or "")
+
+
+class SiteSearchIndex():
+    """Індекс пошуку підрядка в назві сайту та логіні з фільтром за типом входу.
+    Для запитів від трьох символів кандидати беруться з найкоротшого списку триграм,
+    коротші запити перевіряються прямим переглядом уже приведених до нижнього регістру рядків.
+    Якщо акаунт завеликий для локального індексу (local=False), пошук іде на сервер.
+    Заодно індекс тримає множину ключів дублікатів акаунта, щоб перевірка при додаванні обходилася без запиту."""
+
+    def __init__(self, user_id, vault, local=True):
+        self.user_id = user_id
+        self.vault = vault
+        self.local = local
+        self.keys = set()  # SitesService._duplicate_key усіх проіндексованих рядків
+        self._rows = []
+        self._texts = []
+        self._trigrams = {}  # триграма -> позиції рядків у порядку додавання
+        self._lock = threading.Lock()
+
+    def add(self, row):
+        # Логін розшифровується один раз при індексації, у фоновому потоці
+        login = self.vault.decrypt(row.login) if row.entrance_type == 'password' else ''
+        text = f"{row.site}\n{login or ''}".lower()
+        key = SitesService._duplicate_key(row.site, row.entrance_type, row.login_digest)
+        with self._lock:
+            self.keys.add(key)
+            position = len(self._rows)
+            self._rows.append(row)
+            self._texts.append(text)
+            for trigram in {text[i:i + 3] for i in range(len(text) - 2)}:
+                self._trigrams.setdefault(trigram, []).append(position)
+
+    def search(self, query, entrance_type=None):
+        query = query.lower()
+        with self._lock:
+            rows, texts = self._rows, self._texts
+            if len(query) >= 3:
+                postings = [self._trigrams.get(query[i:i + 3], ()) for i in range(len(query) - 2)]
+                candidates = min(postings, key=len)
+            else:
+                candidates = range(len(rows))
+            return [rows[i] for i in candidates
+                    if query in texts[i] and (entrance_type is None or rows[i].entrance_type == entrance_type)]
+
+
+def valid_username(username: str) -> bool:
+    """Дозволяє лише літери, цифри та _, від 3 до 20 символів."""
+    return bool(re.fullmatch(r'^[a-zA-Z0-9_]{3,20}$', username))
+
+
+def valid_password(password: str) -> bool:
+    """Пароль має бути довжиною від 8 до 20 символів, містити хоча б одну літеру та одну цифру."""
+    return bool(re.fullmatch(r'^(?=.*[A-Za-z])(?=.*\d)[A-Za-z\d@#$%^&+=!]{8,20}$', password))
+
+
+def valid_email(email: str) -> bool:
+    """Проста перевірка коректного формату email."""
+    return bool(re.fullmatch(r'^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$', email))
+
+
+class Session():
+    """Стан одного входу: id користувача, ключ шифрування його облікових даних та індекс пошуку."""
+
+    def __init__(self):
+        self.user_id = None
+        self.vault = CredentialVault()
+        self.search_index = None
+        self.last_used = time.monotonic()
+
+    def clear(self):
+        # Кінець сесії: ключ і розшифровані облікові дані більше не потрібні
+        self.user_id = None
+        self.search_index = None
+        self.vault.lock()
+
+
+class AccountService():
+    # Результати login/register, що не є id користувача
+    NO_SUCH_USER = "no_such_user"
+    WRONG_PASSWORD = "wrong_password"
+    USERNAME_TAKEN = "username_taken"
+    EMAIL_TAKEN = "email_taken"
+
+    def __init__(self, connector, hasher: PasswordHasher):
+        self.connector = connector
+        self.hasher = hasher
+
+    def register(self, session: Session, username: str, password: str, email: str):
+        """Зберігає дані про користувача в основну базу даних одним INSERT; розміщення в шард
+        (якщо шарди є) записується в тій самій транзакції.
+        Повертає id нового користувача або USERNAME_TAKEN/EMAIL_TAKEN, якщо спрацювало UNIQUE-обмеження."""
+        password_hash = self.hasher.hash(password)
+        enc_salt = base64.b64encode(os.urandom(16)).decode()
+        try:
+            with self.connector.connection() as connection, connection.cursor() as c:
+                # Вставка нового користувача в таблицю 'users'
+                c.execute("""
+                    INSERT INTO users (username, password, email, enc_salt) 
+                    VALUES (%s, %s, %s, %s)
+                """, (username, password_hash, email, enc_salt))
+                user_id = c.lastrowid
+                self.connector.place_new_user(c, user_id)
+                # Збереження змін
+                connection.commit()
+        except pymysql.err.IntegrityError as err:
+            return self._duplicate_result(err)
+        session.vault.unlock(self.hasher.derive_key(password, enc_salt))
+        session.user_id = user_id
+        return user_id
+
+    def _duplicate_result(self, err):
+        # "Duplicate entry '...' for key 'email'" (у MySQL 8.0 і адаптері SQLite - 'users.email')
+        if err.args[0] != DUP_ENTRY:
+            raise err
+        key = re.search(r"for key '(?:\w+\.)?(\w+)'", str(err.args[1]))
+        return self.EMAIL_TAKEN if key and key.group(1) == "email" else self.USERNAME_TAKEN
+
+    def login(self, session: Session, username: str, password_input: str):
+        """ Перевіряє username і password одним запитом. Повертає id користувача (і запам'ятовує його в сесії),
+        NO_SUCH_USER, якщо такого користувача немає, або WRONG_PASSWORD.
+        Старий пароль у відкритому вигляді чи хеш із заниженою вартістю перераховується після успішного входу. """
+        with self.connector.connection() as connection, connection.cursor() as c:
+            c.execute("SELECT id, password, enc_salt, shard FROM users WHERE username = %s", (username,))
+            row = c.fetchone()
+        if row is None:
+            return self.NO_SUCH_USER
+        ok, needs_rehash = self.hasher.verify(password_input, row["password"] or "")
+        if not ok:
+            return self.WRONG_PASSWORD
+        enc_salt = row["enc_salt"]
+        if needs_rehash or enc_salt is None:
+            # Користувачі, зареєстровані до появи шифрування, отримують сіль ключа при першому вході
+            enc_salt = enc_salt or base64.b64encode(os.urandom(16)).decode()
+            with self.connector.connection() as connection, connection.cursor() as c:
+                c.execute("UPDATE users SET password = %s, enc_salt = %s WHERE id = %s",
+                          (self.hasher.hash(password_input) if needs_rehash else row["password"], enc_salt, row["id"]))
+                connection.commit()
+        self.connector.remember_placement(row["id"], row["shard"])
+        session.vault.unlock(self.hasher.derive_key(password_input, enc_salt))
+        session.user_id = row["id"]
+        return session.user_id
+
+
+class SitesService():
+    """Сайти користувачів. Усі методи блокуючі й не звертаються до Tk, тож виконуються
+    у фонових потоках застосунку або сервера."""
+    IMPORT_BATCH_SIZE = 500
+    LOCAL_SEARCH_LIMIT = 50000  # більші акаунти шукаються запитом до сервера
+    SERVER_SEARCH_LIMIT = 500
+    INSERT_QUERY = """
+            INSERT INTO sites (site, entrance_type, user_id, login, password, login_digest)
+            VALUES (%s, %s, %s, %s, %s, %s)
+        """
+    EXPORT_FIELDS = ("site", "entrance_type", "login", "password")
+    ENTRANCE_TYPES = ("password", "google", "meta", "github", "apple")  # ті самі, що пропонує форма MySitesWindow
+    LIST_COLUMNS = SiteRecord.COLUMNS[:5]  # усе, що потрібно списку і пошуку; login_digest - лише індексу
+    STREAM_CHUNK_SIZE = 500
+    MAX_PLACED = 1024  # скільки користувачів пам'ятає _shard
+    DUPLICATE_LOGIN = "Сайт з такою назвою і з таким логіном вже доданий в базу даних"
+    DUPLICATE_ENTRANCE = "Сайт з такою назвою і таким методом входу вже доданий в базу даних"
+
+    def __init__(self, connector):
+        self.connector = connector
+        self.cache = SitesCache()
+        self._placed = OrderedDict()  # user_id -> Connector, з якого кешовано сторінки
+        self._placed_lock = threading.Lock()
+
+    def _shard(self, user_id):
+        """Connector бази із сайтами користувача. Після перенесення rebalance.py рядки мають нові id,
+        тож закешовані сторінки зі старої бази скидаються. Кеш забутого користувача теж скидається:
+        зміну його бази вже не буде з чим порівняти."""
+        connector = self.connector.for_user(user_id)
+        with self._placed_lock:
+            previous = self._placed.pop(user_id, connector)
+            self._placed[user_id] = connector
+            evicted = [self._placed.popitem(last=False)[0] for _ in range(len(self._placed) - self.MAX_PLACED)]
+        if previous is not connector:
+            self.cache.invalidate(user_id)
+        for user in evicted:
+            self.cache.invalidate(user)
+        return connector
+
+    def save_site(self, session: Session, site, entrance_type, login, password):
+        """Повертає текст попередження або None, якщо сайт збережено."""
+        warning = self.validator(session, site, entrance_type, login, password)
+        if warning:
+            return warning
+        row = self._encrypted_row(session, site, entrance_type, login, password)
+        try:
+            with self._shard(session.user_id).connection() as connection, connection.cursor() as c:
+                c.execute(self.INSERT_QUERY, row)
+                connection.commit()
+                site_id = c.lastrowid
+        except pymysql.err.IntegrityError as err:
+            return self._duplicate_result(err, entrance_type)
+        self._remember_saved(session, row, site_id)
+        return None
+
+    def _remember_saved(self, session: Session, row, site_id):
+        """Додає щойно вставлений рядок INSERT_QUERY до кешу сторінок і локального індексу пошуку."""
+        user_id = row[2]
+        saved = SiteRecord.from_insert(row, site_id)
+        self.cache.add(user_id, saved)
+        index = session.search_index
+        if index is not None and index.local and index.user_id == user_id:
+            index.add(saved)
+        return saved
+
+    def _encrypted_row(self, session: Session, site, entrance_type, login, password):
+        """Значення для INSERT_QUERY: логін і пароль шифруються, для входу за паролем додається HMAC логіна."""
+        vault = session.vault
+        login_digest = vault.digest(login) if entrance_type == 'password' else None
+        return site, entrance_type, session.user_id, vault.encrypt(login), vault.encrypt(password), login_digest
+
+    def encrypt_legacy_sites(self, session: Session):
+        """Шифрує записи, збережені до появи шифрування. Виконується у фоні одразу після входу."""
+        vault, user_id = session.vault, session.user_id
+        with self._shard(user_id).connection() as connection, connection.cursor() as c:
+            c.execute("SELECT id, entrance_type, login, password FROM sites "
+                      "WHERE user_id = %s AND password NOT LIKE %s", (user_id, vault.PREFIX + "%"))
+            updates = []
+            for row in c.fetchall():
+                login, password = row["login"] or "", row["password"] or ""
+                updates.append((vault.encrypt(login), vault.encrypt(password),
+                                vault.digest(login) if row["entrance_type"] == 'password' else None, row["id"]))
+            query = "UPDATE sites SET login = %s, password = %s, login_digest = %s WHERE id = %s"
+            try:
+                if updates:
+                    c.executemany(query, updates)
+            except pymysql.err.IntegrityError as err:
+                if err.args[0] != DUP_ENTRY:
+                    raise
+                # Старі записи з однаковим логіном: решту шифруємо без HMAC, щоб не порушити унікальний індекс
+                for login, password, login_digest, site_id in updates:
+                    try:
+                        c.execute(query, (login, password, login_digest, site_id))
+                    except pymysql.err.IntegrityError as err:
+                        if err.args[0] != DUP_ENTRY:
+                            raise
+                        c.execute(query, (login, password, None, site_id))
+            connection.commit()
+        if updates:
+            self.cache.invalidate(user_id)
+        return len(updates)
+
+    @staticmethod
+    def _check_fields(site, entrance_type, login, password):
+        """Правила формату з validator без звернення до БД."""
+        if entrance_type not in SitesService.ENTRANCE_TYPES:
+            return "Невідомий тип входу"
+        site_pattern = r'[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
+        if not re.match(site_pattern, site):
+            return "Введіть адекватний URL"
+        if entrance_type == 'password':
+            if login.strip() == '':
+                return "Введіть логін"
+            if password.strip() == '':
+                return "Введіть пароль"
+        return None
+
+    @staticmethod
+    def _duplicate_key(site, entrance_type, login_digest):
+        # Ті самі правила дублікатів, що й у validator: сайт+логін або сайт+метод входу
+        return (site, "password", login_digest) if entrance_type == 'password' else (site, entrance_type, None)
+
+    @classmethod
+    def _duplicate_warning(cls, entrance_type):
+        return cls.DUPLICATE_LOGIN if entrance_type == 'password' else cls.DUPLICATE_ENTRANCE
+
+    @classmethod
+    def _duplicate_result(cls, err, entrance_type):
+        # Рядок для входу за паролем може порушити лише sites_user_site_login, інші - лише
+        # sites_user_site_entrance, тож попередження визначається самим рядком, а не назвою ключа
+        if err.args[0] != DUP_ENTRY:
+            raise err
+        return cls._duplicate_warning(entrance_type)
+
+    @staticmethod
+    def _known_duplicate(session: Session, key):
+        """Чи є key серед ключів локального індексу сесії. False не означає, що дубліката немає:
+        індекс може бути ще не побудований або не тримати великий акаунт, тож остаточно вирішує БД."""
+        index = session.search_index
+        return index is not None and index.local and index.user_id == session.user_id and key in index.keys
+
+    def validator(self, session: Session, site, entrance_type ,login, password):
+        """Повертає текст попередження, якщо сайт не можна додати, або None.
+        Дублікати тут шукаються лише в пам'яті сесії; решту відсіює унікальний індекс при вставці."""
+        warning = self._check_fields(site, entrance_type, login, password)
+        if warning:
+            return warning
+        # Логіни зашифровані, тому порівнюємо їх HMAC
+        login_digest = session.vault.digest(login) if entrance_type == 'password' else None
+        if self._known_duplicate(session, self._duplicate_key(site, entrance_type, login_digest)):
+            return self._duplicate_warning(entrance_type)
+        return None
+
+    def get_sites(self, user_id, after_id=0, limit=None):
+        """Помилки бази даних передаються викликачу.
+        Пагінація за ключем: повертає до limit сайтів з id більшим за after_id, впорядкованих за id."""
+        # Шард визначається до кешу: після перенесення закешовані сторінки мають старі id
+        shard = self._shard(user_id)
+        cached = self.cache.get_page(user_id, after_id, limit)
+        if cached is not None:
+            return cached
+        generation = self.cache.generation
+        with shard.connection() as connection, connection.cursor(pymysql.cursors.Cursor) as c:
+            query = f"SELECT {', '.join(self.LIST_COLUMNS)} FROM sites WHERE user_id = %s AND id > %s ORDER BY id"
+            if limit is None:
+                c.execute(query, (user_id, after_id))
+            else:
+                c.execute(query + " LIMIT %s", (user_id, after_id, limit))
+            sites = [SiteRecord(*row) for row in c.fetchall()]
+        self.cache.store_page(user_id, after_id, limit, sites, generation)
+        return sites
+
+    def iter_sites(self, user_id, chunk_size=None, with_digest=False, use_cache=True):
+        """Потоково віддає SiteRecord користувача порціями до chunk_size рядків (лише LIST_COLUMNS,
+        а з with_digest - ще й login_digest). Небуферизований курсор не тримає весь результат
+        ні на клієнті, ні в пам'яті; з'єднання зайняте, доки генератор не вичерпано або не закрито.
+        Повністю закешований список віддається з SitesCache без запитів. Потік кладе в кеш лише
+        акаунт, що вмістився в першу порцію: більші акаунти не тримаються в пам'яті цілком.
+        use_cache=False не читає і не заповнює кеш (напр. для експорту)."""
+        chunk_size = chunk_size or self.STREAM_CHUNK_SIZE
+        use_cache = use_cache and not with_digest
+        shard = self._shard(user_id)
+        if use_cache:
+            cached = self.cache.get_page(user_id)
+            if cached is not None:
+                for start in range(0, len(cached), chunk_size):
+                    yield cached[start:start + chunk_size]
+                return
+            generation = self.cache.generation
+        columns = SiteRecord.COLUMNS if with_digest else self.LIST_COLUMNS
+        first = True
+        with shard.connection() as connection, connection.cursor(pymysql.cursors.SSCursor) as c:
+            c.execute(f"SELECT {', '.join(columns)} FROM sites WHERE user_id = %s ORDER BY id", (user_id,))
+            while True:
+                chunk = [SiteRecord(*row) for row in c.fetchmany(chunk_size)]
+                if first and use_cache and len(chunk) < chunk_size:
+                    self.cache.store_page(user_id, 0, None, chunk, generation)
+                first = False
+                if not chunk:
+                    return
+                yield chunk
+
+    def get_site(self, user_id, site_id):
+        """Один сайт користувача (SiteRecord) за id або None."""
+        with self._shard(user_id).connection() as connection, connection.cursor(pymysql.cursors.Cursor) as c:
+            c.execute(f"SELECT {', '.join(self.LIST_COLUMNS)} FROM sites WHERE id = %s AND user_id = %s",
+                      (site_id, user_id))
+            row = c.fetchone()
+        return None if row is None else SiteRecord(*row)
+
+    def import_sites(self, session: Session, path, progress=None):
+        """Потоковий імпорт сайтів з файлу однією транзакцією пакетами executemany.
+        progress(оброблено, додано) викликається після кожного пакета."""
+        summary = {"inserted": 0, "duplicates": 0, "invalid": 0, "errors": []}
+        vault, user_id = session.vault, session.user_id
+        with self._shard(user_id).connection() as connection:
+            # Усі наявні ключі дублікатів одним потоковим запитом
+            with connection.cursor(pymysql.cursors.SSCursor) as c:
+                c.execute("SELECT site, entrance_type, login_digest FROM sites WHERE user_id = %s", (user_id,))
+                seen = {self._duplicate_key(*row) for row in c}
+            connection.begin()
+            batch = []
+            with connection.cursor() as c:
+                for number, row in enumerate(_read_import_rows(path), start=1):
+                    if row is None:
+                        warning = "Некоректний запис"
+                    else:
+                        site, entrance_type, login, password = row
+                        if entrance_type != 'password':
+                            login = password = ''
+                        warning = self._check_fields(site, entrance_type, login, password)
+                    if warning:
+                        summary["invalid"] += 1
+                        if len(summary["errors"]) < 10:
+                            summary["errors"].append(f"Рядок {number}: {warning}")
+                        continue
+                    key = self._duplicate_key(site, entrance_type, vault.digest(login))
+                    if key in seen:
+                        summary["duplicates"] += 1
+                        continue
+                    seen.add(key)
+                    batch.append(self._encrypted_row(session, site, entrance_type, login, password))
+                    if len(batch) >= self.IMPORT_BATCH_SIZE:
+                        self._insert_batch(c, batch, summary)
+                        batch.clear()
+                        if progress is not None:
+                            progress(number, summary["inserted"])
+                if batch:
+                    self._insert_batch(c, batch, summary)
+            connection.commit()
+        # id вставлених рядків невідомі поштучно, тому просто скидаємо кеш та індекс пошуку користувача
+        self.cache.invalidate(user_id)
+        session.search_index = None
+        return summary
+
+    def _insert_batch(self, c, batch, summary):
+        """executemany одного пакета імпорту. Якщо інший клієнт тим часом додав такий самий сайт,
+        пакет відкочується до точки збереження і вставляється поштучно, пропускаючи дублікати."""
+        c.execute("SAVEPOINT import_batch")
+        try:
+            c.executemany(self.INSERT_QUERY, batch)
+            summary["inserted"] += len(batch)
+            return
+        except pymysql.err.IntegrityError as err:
+            if err.args[0] != DUP_ENTRY:
+                raise
+            c.execute("ROLLBACK TO SAVEPOINT import_batch")
+        for row in batch:
+            try:
+                c.execute(self.INSERT_QUERY, row)
+                summary["inserted"] += 1
+            except pymysql.err.IntegrityError as err:
+                if err.args[0] != DUP_ENTRY:
+                    raise
+                summary["duplicates"] += 1
+
+    def build_search_index(self, session: Session):
+        """Невеликі акаунти індексуються локально, для великих індекс лише позначає,
+        що шукати треба на сервері."""
+        user_id = session.user_id
+        with self._shard(user_id).connection() as connection, connection.cursor() as c:
+            c.execute("SELECT COUNT(*) AS total FROM sites WHERE user_id = %s", (user_id,))
+            total = c.fetchone()["total"]
+        index = SiteSearchIndex(user_id, session.vault, local=total <= self.LOCAL_SEARCH_LIMIT)
+        if index.local:
+            for chunk in self.iter_sites(user_id, with_digest=True):
+                for row in chunk:
+                    index.add(row)
+        session.search_index = index
+        return index
+
+    def search_sites(self, user_id, query, entrance_type=None):
+        """Пошук на сервері за префіксом назви сайту (префікс (user_id, site) унікальних індексів).
+        Логіни зашифровані, тому серверний пошук за ними неможливий."""
+        pattern = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        sql = f"SELECT {', '.join(self.LIST_COLUMNS)} FROM sites WHERE user_id = %s AND site LIKE %s"
+        params = [user_id, pattern]
+        if entrance_type is not None:
+            sql += " AND entrance_type = %s"
+            params.append(entrance_type)
+        with self._shard(user_id).connection() as connection, connection.cursor(pymysql.cursors.Cursor) as c:
+            c.execute(sql + " ORDER BY site LIMIT %s", (*params, self.SERVER_SEARCH_LIMIT))
+            return [SiteRecord(*row) for row in c.fetchall()]
+
+    def export_sites(self, session: Session, path):
+        """Потоковий експорт сайтів користувача у CSV, JSON Lines або JSON-масив.
+        Рядки надходять порціями з iter_sites повз SitesCache, тож весь результат не тримається в пам'яті."""
+        ext = os.path.splitext(path)[1].lower()
+        vault = session.vault
+        count = 0
+        with closing(self.iter_sites(session.user_id, use_cache=False)) as chunks, open(path, "w", newline="", encoding="utf-8") as f:
+            # Експорт - єдине місце, де розшифровуються всі рядки, і то по одному
+            rows = (dict(zip(self.EXPORT_FIELDS, (record.site, record.entrance_type,
+                                                  vault.decrypt(record.login), vault.decrypt(record.password))))
+                    for chunk in chunks for record in chunk)
+            if ext == ".csv":
+                writer = csv.DictWriter(f, fieldnames=self.EXPORT_FIELDS)
+                writer.writeheader()
+                for row in rows:
+                    writer.writerow(row)
+                    count += 1
+            elif ext == ".jsonl":
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    count += 1
+            else:
+                f.write("[")
+                for row in rows:
+                    f.write((",\n" if count else "\n") + json.dumps(row, ensure_ascii=False))
+                    count += 1
+                f.write("\n]\n")
+        return count
+
+
+class PendingSite():
+    """Сайт у черзі SiteWriteQueue. row - уже зашифровані значення для INSERT_QUERY, тож запис
+    не залежить від того, чи користувач ще в системі. tag належить UI (напр. показаний рядок)."""
+    __slots__ = ("session", "row", "tag", "warning")
+
+    def __init__(self, session: Session, row, tag=None):
+        self.session = session
+        self.row = tuple(row)
+        self.tag = tag
+        self.warning = None
+
+    @property
+    def user_id(self):
+        return self.row[2]
+
+
+class SiteWriteQueue():
+    """Відкладений запис доданих сайтів: submit() лише шифрує рядок і ставить його в чергу,
+    тож UI оновлюється одразу, а фоновий потік пише накопичене однією транзакцією.
+
+    Результати (pending, id або None, попередження або None) забирає потік UI через collect().
+    Обрив з'єднання і тайм-аут пулу повторюються з паузою, що подвоюється; що так і не вдалося
+    записати, зберігається локально через persist() і дописується при наступному вході (restore)."""
+    BATCH_SIZE = 100
+    COALESCE_SECONDS = 0.05  # скільки чекати сусідніх вставок перед транзакцією
+    MAX_ATTEMPTS = 5
+    RETRY_DELAY = 0.5
+    PENDING_FILE = "pending-{{key}}-{user_id}.jsonl"
+
+    def __init__(self, sites: SitesService):
+        self.sites = sites
+        self._queue = deque()
+        self._batch = []  # порція, що зараз пишеться
+        self._failed = []  # вичерпали спроби; чекають persist
+        self._results = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+
+    def submit(self, session: Session, site, entrance_type, login, password, tag=None):
+        """Повертає PendingSite; якщо поля некоректні, у нього заповнено warning і в чергу він не потрапляє.
+        Після виходу з акаунта (сховище заблоковане) рядок зашифрувати нічим - це помилка викликача."""
+        if not session.vault.unlocked:
+            raise RuntimeError("Сховище облікових даних заблоковане: користувач вийшов з акаунта")
+        if entrance_type != 'password':
+            login = password = ''
+        pending = PendingSite(session, (), tag)
+        pending.warning = self.sites._check_fields(site, entrance_type, login, password)
+        if pending.warning:
+            return pending
+        pending.row = row = self.sites._encrypted_row(session, site, entrance_type, login, password)
+        if self.sites._known_duplicate(session, self.sites._duplicate_key(site, entrance_type, row[5])):
+            # Відомий дублікат відхиляється одразу, без черги і запиту
+            pending.warning = self.sites._duplicate_warning(entrance_type)
+            return pending
+        self._enqueue([pending])
+        return pending
+
+    def _enqueue(self, items):
+        with self._cond:
+            self._queue.extend(items)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="site-writer", daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def collect(self):
+        """Результати, що накопичилися з попереднього виклику."""
+        results = []
+        while self._results:
+            results.append(self._results.popleft())
+        return results
+
+    def outstanding(self):
+        """Чи є ще незаписані сайти або незібрані результати."""
+        with self._cond:
+            return bool(self._queue or self._batch or self._results)
+
+    def flush(self, timeout=None):
+        """Чекає, доки черга спорожніє. Повертає False, якщо не встигла за timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._queue and not self._batch, timeout)
+
+    def flush_or_persist(self, timeout=None):
+        """Для виходу з акаунта: дописує чергу, а що не встигло - зберігає локально. Повертає кількість збереженого."""
+        self.flush(timeout)
+        return self.persist()
+
+    def close(self, timeout=None):
+        """Для закриття застосунку: зупиняє фоновий потік після запису черги і зберігає залишок локально."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.persist()
+
+    def _pending_path(self, user_id):
+        return self.sites.connector.local_path(self.PENDING_FILE.format(user_id=user_id))
+
+    def persist(self):
+        """Переносить незаписані сайти з пам'яті у локальні файли, по одному на користувача.
+        Порцію, що пишеться саме зараз, теж зберігаємо: повторний запис відсіє перевірка дублікатів."""
+        with self._cond:
+            items = list(self._batch) + self._failed + list(self._queue)
+            self._failed.clear()
+            self._queue.clear()
+            by_user = {}
+            for item in items:
+                by_user.setdefault(item.user_id, []).append(item)
+            for user_id, user_items in by_user.items():
+                path = self._pending_path(user_id)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, "a", encoding="utf-8") as f:
+                    for item in user_items:
+                        f.write(json.dumps(item.row) + "\n")
+        return len(items)
+
+    def restore(self, session: Session):
+        """Ставить у чергу сайти, збережені persist() для цього користувача. Повертає їх кількість."""
+        path = self._pending_path(session.user_id)
+        with self._cond:
+            try:
+                with open(path, encoding="utf-8") as f:
+                    items = [PendingSite(session, json.loads(line)) for line in f if line.strip()]
+            except FileNotFoundError:
+                return 0
+            os.remove(path)
+        if items:
+            self._enqueue(items)
+        return len(items)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or self._closed)
+                if not self._queue:
+                    return
+            if not self._closed:
+                time.sleep(self.COALESCE_SECONDS)
+            with self._cond:
+                # Порція - лише одного користувача, щоб перевірити дублікати одним запитом
+                user_id = self._queue[0].user_id
+                while self._queue and len(self._batch) < self.BATCH_SIZE and self._queue[0].user_id == user_id:
+                    self._batch.append(self._queue.popleft())
+            results = self._write_with_retries(list(self._batch))
+            with self._cond:
+                self._batch.clear()
+                self._results.extend(results)
+                self._cond.notify_all()
+
+    def _write_with_retries(self, batch):
+        delay = self.RETRY_DELAY
+        write = self.sites.connector.stats.bind("add_site", self._write_batch)
+        for attempt in range(1, self.MAX_ATTEMPTS + 1):
+            try:
+                return write(batch)
+            except (pymysql.err.OperationalError, pymysql.err.InterfaceError, PoolTimeout) as err:
+                error = err
+            except pymysql.MySQLError as err:
+                # Повтор тут не допоможе; повідомляємо кожному рядку порції
+                return [(item, None, f"Помилка бази даних: {err}") for item in batch]
+            with self._cond:
+                # Під час закриття не чекаємо: залишок усе одно збережеться локально
+                if attempt == self.MAX_ATTEMPTS or self._cond.wait_for(lambda: self._closed, delay):
+                    break
+            delay *= 2
+        with self._cond:
+            self._failed.extend(batch)
+        return [(item, None, f"Не вдалося зберегти, спробуємо ще раз при наступному вході: {error}")
+                for item in batch]
+
+    def _write_batch(self, batch):
+        """Одна транзакція на порцію. Дублікати - і з уже збереженими сайтами, і всередині порції -
+        відхиляє унікальний індекс; відкочується лише та вставка, а рядок отримує попередження."""
+        sites = self.sites
+        results = []
+        # _run складає порції з рядків одного користувача, тож і база в порції одна
+        with sites._shard(batch[0].user_id).connection() as connection:
+            connection.begin()
+            with connection.cursor() as c:
+                for item in batch:
+                    try:
+                        c.execute(sites.INSERT_QUERY, item.row)
+                    except pymysql.err.IntegrityError as err:
+                        results.append((item, None, sites._duplicate_result(err, item.row[1])))
+                        continue
+                    results.append((item, c.lastrowid, None))
+            connection.commit()
+        for item, site_id, warning in results:
+            if site_id is not None:
+                sites._remember_saved(item.session, item.row, site_id)
+        return results
+
+
+class ServiceError(Exception):
+    """Помилка запиту клієнта; сервер повертає її як JSON з відповідним HTTP-статусом."""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class AsyncBackend():
+    """Асинхронний інтерфейс до AccountService і SitesService для багатьох одночасних сесій.
+    Блокуючі виклики виконуються у спільному пулі потоків поверх спільного пулу з'єднань."""
+    SESSION_TTL = 1800.0
+
+    def __init__(self, connector, hasher: PasswordHasher, max_workers=16):
+        self.connector = connector
+        self.stats = connector.stats
+        self.accounts = AccountService(connector, hasher)
+        self.sites = SitesService(connector)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="service")
+        self.sessions = {}  # токен -> Session
+
+    async def _run(self, fn, *args):
+        fn = self.stats.bind(fn.__name__, fn)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self.connector.run_with_schema, fn, *args)
+
+    def _expire_sessions(self):
+        now = time.monotonic()
+        for token, session in list(self.sessions.items()):
+            if now - session.last_used > self.SESSION_TTL:
+                del self.sessions[token]
+                session.clear()
+
+    def _session(self, token) -> Session:
+        self._expire_sessions()
+        session = self.sessions.get(token)
+        if session is None or session.user_id is None:
+            raise ServiceError(401, "Потрібен вхід")
+        session.last_used = time.monotonic()
+        return session
+
+    def _open_session(self, session: Session):
+        token = secrets.token_urlsafe(32)
+        self.sessions[token] = session
+        return {"token": token, "user_id": session.user_id}
+
+    @staticmethod
+    def _public(site):
+        # Зашифровані облікові дані клієнт отримує лише через reveal
+        return {"id": site.id, "site": site.site, "entrance_type": site.entrance_type}
+
+    async def register(self, username, password, email):
+        if not valid_username(username):
+            raise ServiceError(400, "Ім'я має містити лише латинські літери, цифри та знак підкреслення, та має бути довжиною від 3 до 20 символів.")
+        if not valid_email(email):
+            raise ServiceError(400, "Введіть коректну пошту.")
+        if not valid_password(password):
+            raise ServiceError(400, "Пароль має бути довжиною від 8 до 20 символів, містити хоча б одну латинську літеру та одну цифру.")
+        session = Session()
+        result = await self._run(self.accounts.register, session, username, password, email)
+        if result == AccountService.USERNAME_TAKEN:
+            raise ServiceError(409, "Користувач з таким ім'ям вже зареєстрований!")
+        if result == AccountService.EMAIL_TAKEN:
+            raise ServiceError(409, "Користувач з такою поштою вже зареєстрований!")
+        return self._open_session(session)
+
+    async def login(self, username, password):
+        session = Session()
+        result = await self._run(self.accounts.login, session, username, password)
+        if result == AccountService.NO_SUCH_USER:
+            raise ServiceError(401, "Користувач з таким логіном не зареєстрований.")
+        if result == AccountService.WRONG_PASSWORD:
+            raise ServiceError(401, "Невірний пароль!")
+        future = self.executor.submit(self.sites.encrypt_legacy_sites, session)
+        future.add_done_callback(self._report_background_error)
+        return self._open_session(session)
+
+    @staticmethod
+    def _report_background_error(future):
+        # Результат фонової задачі ніхто не чекає, тож без цього її виняток зник би беззвучно
+        if future.cancelled() or future.exception() is None:
+            return
+        err = future.exception()
+        print("Помилка фонового шифрування старих записів:", file=sys.stderr)
+        traceback.print_exception(type(err), err, err.__traceback__)
+
+    async def logout(self, token):
+        session = self.sessions.pop(token, None)
+        if session is not None:
+            session.clear()
+        return {}
+
+    async def add_site(self, token, site, entrance_type="password", login="", password=""):
+        session = self._session(token)
+        if entrance_type != 'password':
+            login = password = ''
+        warning = SitesService._check_fields(site, entrance_type, login, password)
+        if warning:
+            raise ServiceError(400, warning)
+        warning = await self._run(self.sites.save_site, session, site, entrance_type, login, password)
+        if warning:
+            raise ServiceError(409, warning)
+        return {}
+
+    async def get_sites(self, token, after_id=0, limit=100):
+        session = self._session(token)
+        if limit < 1:
+            raise ServiceError(400, "limit має бути додатним")
+        sites = await self._run(self.sites.get_sites, session.user_id, after_id, min(limit, 1000))
+        return {"sites": [self._public(site) for site in sites]}
+
+    async def search(self, token, query, entrance_type=None):
+        session = self._session(token)
+        index = session.search_index
+        if index is None:
+            index = await self._run(self.sites.build_search_index, session)
+        if index.local:
+            sites = index.search(query, entrance_type)[:SitesService.SERVER_SEARCH_LIMIT]
+        else:
+            sites = await self._run(self.sites.search_sites, session.user_id, query, entrance_type)
+        return {"sites": [self._public(site) for site in sites]}
+
+    async def reveal(self, token, id):
+        session = self._session(token)
+        site = await self._run(self.sites.get_site, session.user_id, id)
+        if site is None:
+            raise ServiceError(404, "Сайт не знайдено")
+        return {**self._public(site), "login": session.vault.reveal(site.login),
+                "password": session.vault.reveal(site.password)}
+
+    def close(self):
+        for session in self.sessions.values():
+            session.clear()
+        self.sessions.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class JsonHttpServer():
+    """Мінімальний HTTP/1.1 сервер з keep-alive: кожен маршрут - POST з JSON-тілом,
+    токен сесії передається заголовком Authorization: Bearer <токен>."""
+    MAX_BODY = 1024 * 1024
+    ROUTES = {
+        "/register": ("register", False),
+        "/login": ("login", False),
+        "/logout": ("logout", True),
+        "/sites/list": ("get_sites", True),
+        "/sites/add": ("add_site", True),
+        "/sites/search": ("search", True),
+        "/sites/reveal": ("reveal", True),
+    }
+    # Типи параметрів маршрутів; None дозволено лише там, де це типове значення параметра
+    PARAM_TYPES = {"username": str, "password": str, "email": str, "site": str, "entrance_type": str,
+                   "login": str, "query": str, "after_id": int, "limit": int, "id": int}
+    REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found", 405: "Method Not Allowed",
+               409: "Conflict", 413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+    def __init__(self, backend: AsyncBackend):
+        self.backend = backend
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, path, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length", 0))
+                if length > self.MAX_BODY:
+                    await self._respond(writer, 413, {"error": "Завеликий запит"}, keep_alive=False)
+                    break
+                body = await reader.readexactly(length) if length else b""
+                status, payload = await self.dispatch(method, path, headers, body)
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                await self._respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, path, headers, body):
+        if path == "/health":
+            return 200, {"status": "ok", "sessions": len(self.backend.sessions)}
+        # Статистика запитів (DB_INSTRUMENT=1): текст Prometheus або повний JSON
+        if path == "/metrics":
+            return 200, self.backend.stats.to_prometheus()
+        if path == "/debug/queries":
+            return 200, self.backend.stats.snapshot()
+        route = self.ROUTES.get(path)
+        if route is None:
+            return 404, {"error": "Невідомий маршрут"}
+        if method != "POST":
+            return 405, {"error": "Дозволено лише POST"}
+        name, needs_token = route
+        try:
+            params = json.loads(body or b"{}")
+            if not isinstance(params, dict):
+                raise ValueError
+        except ValueError:
+            return 400, {"error": "Тіло запиту має бути JSON-об'єктом"}
+        handler = getattr(self.backend, name)
+        error = self._check_params(handler, params)
+        if error:
+            return 400, {"error": error}
+        if needs_token:
+            params["token"] = headers.get("authorization", "").removeprefix("Bearer ").strip()
+        try:
+            return 200, await handler(**params)
+        except ServiceError as err:
+            return err.status, {"error": err.message}
+        except (pymysql.MySQLError, PoolTimeout) as err:
+            return 503, {"error": f"Помилка бази даних: {err}"}
+        except Exception:
+            # Помилка самого сервера: клієнт отримує 500, а подробиці лишаються в журналі
+            traceback.print_exc()
+            return 500, {"error": "Внутрішня помилка сервера"}
+
+    def _check_params(self, handler, params):
+        """Текст помилки, якщо параметри не підходять методу AsyncBackend за назвами і типами, або None."""
+        signature = inspect.signature(handler).parameters
+        for key, value in params.items():
+            if key == "token" or key not in signature:
+                return f"Невідомий параметр {key}"
+            expected = self.PARAM_TYPES[key]
+            # bool у Python - підклас int, але в JSON це окремий тип
+            if value is None and signature[key].default is None:
+                continue
+            if not isinstance(value, expected) or isinstance(value, bool):
+                return f"Параметр {key} має бути {'рядком' if expected is str else 'цілим числом'}"
+        missing = [key for key, parameter in signature.items()
+                   if key != "token" and parameter.default is inspect.Parameter.empty and key not in params]
+        if missing:
+            return f"Бракує параметрів: {', '.join(missing)}"
+        return None
+
+    async def _respond(self, writer, status, payload, keep_alive=True):
+        if isinstance(payload, str):
+            body, content_type = payload.encode(), "text/plain; version=0.0.4"
+        else:
+            body, content_type = json.dumps(payload, ensure_ascii=False).encode(), "application/json"
+        head = (f"HTTP/1.1 {status} {self.REASONS.get(status, '')}\r\n"
+                f"Content-Type: {content_type}; charset=utf-8\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+
+async def serve(backend: AsyncBackend, host="127.0.0.1", port=8765, unix_path=None):
+    server = JsonHttpServer(backend)
+    if unix_path:
+        listener = await asyncio.start_unix_server(server.handle, path=unix_path)
+    else:
+        listener = await asyncio.start_server(server.handle, host, port)
+    async with listener:
+        await listener.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальний JSON-over-HTTP сервер застосунку")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="шлях до Unix-сокета замість TCP")
+    parser.add_argument("--workers", type=int, default=16, help="потоки для звернень до БД")
+    args = parser.parse_args()
+
+    connector = Connector()
+    connector.migrate()
+    hasher = PasswordHasher(target_seconds=None)
+    hasher.calibrate()
+    backend = AsyncBackend(connector, hasher, max_workers=args.workers)
+    try:
+        asyncio.run(serve(backend, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        backend.close()
+        hasher.shutdown()
+        connector.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Тести rebalance.py на базах SQLite: основна база і два шарди в тимчасовому каталозі.
+
+    python -m unittest discover tests
+"""
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from service import Connector, ShardMap, SQLiteBackend, PasswordHasher, Session, AccountService, SitesService
+from rebalance import ShardMover, planned_moves
+
+HASHER = None
+
+
+def setUpModule():
+    global HASHER
+    HASHER = PasswordHasher(target_seconds=0.001, workers=1)
+
+
+def tearDownModule():
+    HASHER.shutdown()
+
+
+class RebalanceTest(unittest.TestCase):
+    """Користувачі реєструються, поки в карті лише s1, а переносяться після появи s2."""
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+        previous = os.environ.get("DB_SCHEMA_CACHE_DIR")
+        os.environ["DB_SCHEMA_CACHE_DIR"] = self.tmpdir
+        self.addCleanup(self._restore_env, previous)
+        # ShardMover звітує про кожного користувача у stdout
+        quiet = contextlib.redirect_stdout(io.StringIO())
+        quiet.__enter__()
+        self.addCleanup(quiet.__exit__, None, None, None)
+        old = self.connect(["s1"])
+        accounts, sites = AccountService(old, HASHER), SitesService(old)
+        self.sessions = {}
+        for number in range(8):
+            session = Session()
+            user_id = accounts.register(session, f"user{number}", "passw0rd1", f"user{number}@mail.com")
+            for site in ("a.com", "b.com", "c.com"):
+                sites.save_site(session, site, "password", "me", "pw")
+            self.sessions[user_id] = session
+        self.connector = self.connect(["s1", "s2"])
+        self.mover = ShardMover(self.connector, batch_size=2)
+        self.moves = planned_moves(self.connector)
+
+    @staticmethod
+    def _restore_env(previous):
+        if previous is None:
+            os.environ.pop("DB_SCHEMA_CACHE_DIR", None)
+        else:
+            os.environ["DB_SCHEMA_CACHE_DIR"] = previous
+
+    def connect(self, names):
+        shards = {name: SQLiteBackend(os.path.join(self.tmpdir, f"{name}.db")) for name in ("s1", "s2")}
+        connector = Connector(SQLiteBackend(os.path.join(self.tmpdir, "main.db")), ShardMap(shards, names))
+        self.addCleanup(connector.close)
+        connector.migrate()
+        return connector
+
+    def sites_in(self, name, user_id):
+        with self.connector.shard(name).connection() as connection, connection.cursor() as c:
+            c.execute("SELECT site FROM sites WHERE user_id = %s ORDER BY site", (user_id,))
+            return [row["site"] for row in c.fetchall()]
+
+    def shard_of(self, user_id):
+        with self.connector.connection() as connection, connection.cursor() as c:
+            c.execute("SELECT shard FROM users WHERE id = %s", (user_id,))
+            return c.fetchone()["shard"]
+
+    def test_planned_moves_follow_new_map(self):
+        self.assertTrue(self.moves)
+        self.assertTrue(all(source == "s1" and target == "s2" for _, source, target in self.moves))
+        moved = {user_id for user_id, _, _ in self.moves}
+        self.assertEqual(moved, {user_id for user_id in self.sessions if self.connector.shard_map.placement(user_id) == "s2"})
+        user_id = self.moves[0][0]
+        self.assertEqual(planned_moves(self.connector, {user_id}), [(user_id, "s1", "s2")])
+
+    def test_start_copies_and_switches(self):
+        user_id, source, target = self.moves[0]
+        self.mover.start(user_id, source, target)
+        self.assertEqual(self.shard_of(user_id), "s2")
+        self.assertEqual(self.sites_in("s2", user_id), ["a.com", "b.com", "c.com"])
+        # Старий шард прибирається лише у finish
+        self.assertEqual(self.sites_in("s1", user_id), ["a.com", "b.com", "c.com"])
+        # Перемкнений користувач лишається в плані до finish, а повторний start нічого не робить
+        self.assertIn((user_id, source, target), planned_moves(self.connector))
+        self.mover.start(user_id, source, target)
+        self.assertEqual(self.sites_in("s2", user_id), ["a.com", "b.com", "c.com"])
+
+    def test_finish_copies_late_writes_and_cleans_up(self):
+        user_id, source, target = self.moves[0]
+        self.mover.start(user_id, source, target)
+        # Застосунок зі старим розміщенням ще встиг дописати в s1
+        stale = SitesService(self.connect(["s1"]))
+        self.assertIsNone(stale.save_site(self.sessions[user_id], "late.com", "password", "me", "pw"))
+        self.mover.finish(user_id, source, target)
+        self.assertEqual(self.sites_in("s1", user_id), [])
+        self.assertEqual(self.sites_in("s2", user_id), ["a.com", "b.com", "c.com", "late.com"])
+        self.assertNotIn(user_id, {move[0] for move in planned_moves(self.connector)})
+        sites = SitesService(self.connector)
+        self.assertEqual(len(sites.get_sites(user_id)), 4)
+
+    def test_interrupted_copy_resumes(self):
+        user_id, source, target = self.moves[0]
+        insert_batch = self.mover.sites._insert_batch
+        calls = []
+
+        def interrupted(c, batch, summary):
+            calls.append(len(batch))
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            insert_batch(c, batch, summary)
+        self.mover.sites._insert_batch = interrupted
+        with self.assertRaises(KeyboardInterrupt):
+            self.mover.start(user_id, source, target)
+        self.assertEqual(self.shard_of(user_id), "s1")
+        self.assertEqual(self.sites_in("s2", user_id), ["a.com", "b.com"])
+        self.assertEqual(planned_moves(self.connector, {user_id}), [(user_id, "s1", "s2")])
+
+        self.mover.sites._insert_batch = insert_batch
+        self.mover.start(user_id, source, target)
+        self.mover.finish(user_id, source, target)
+        self.assertEqual(self.shard_of(user_id), "s2")
+        self.assertEqual(self.sites_in("s2", user_id), ["a.com", "b.com", "c.com"])
+        self.assertEqual(self.sites_in("s1", user_id), [])
+
+    def test_retired_shard_is_emptied(self):
+        for user_id, source, target in self.moves:
+            self.mover.start(user_id, source, target)
+            self.mover.finish(user_id, source, target)
+        # s1 виводиться з роботи: лишається в карті без нових розміщень
+        retiring = self.connect(["s2"])
+        moves = planned_moves(retiring)
+        self.assertEqual({user_id for user_id, _, _ in moves},
+                         {user_id for user_id in self.sessions if self.shard_of(user_id) == "s1"})
+        mover = ShardMover(retiring)
+        for user_id, source, target in moves:
+            mover.start(user_id, source, target)
+            mover.finish(user_id, source, target)
+        self.assertEqual(planned_moves(retiring), [])
+        for user_id in self.sessions:
+            self.assertEqual(self.sites_in("s1", user_id), [])
+            self.assertEqual(self.sites_in("s2", user_id), ["a.com", "b.com", "c.com"])
+
+
+if __name__ == "__main__":
+    unittest.main()
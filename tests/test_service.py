@@ -0,0 +1,758 @@
+"""Тести service.py на вбудованій базі SQLite: не потребують MySQL, мережі чи Tk.
+
+    python -m unittest discover tests
+"""
+import asyncio
+import contextlib
+import io
+import json
+import os
+import tempfile
+import threading
+import unittest
+
+from service import (Connector, ShardMap, SQLiteBackend, ConnectionPool, PoolTimeout, PasswordHasher,
+                     CredentialVault, Session, AccountService, SitesService, SitesCache, SiteRecord,
+                     SiteWriteQueue, AsyncBackend, JsonHttpServer, NO_SUCH_TABLE, pymysql)
+
+HASHER = None
+
+
+def setUpModule():
+    # Один пул процесів хешування на весь модуль: запуск spawn-процесу дорожчий за сам хеш
+    global HASHER
+    HASHER = PasswordHasher(target_seconds=0.001, workers=1)
+
+
+def tearDownModule():
+    HASHER.shutdown()
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """Свіжа база SQLite і каталог позначок схеми в тимчасовому каталозі для кожного тесту."""
+
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.tmpdir = tmpdir.name
+        previous = os.environ.get("DB_SCHEMA_CACHE_DIR")
+        os.environ["DB_SCHEMA_CACHE_DIR"] = self.tmpdir
+        self.addCleanup(self._restore_env, previous)
+        self.connector = Connector(SQLiteBackend(os.path.join(self.tmpdir, "test.db")), ShardMap())
+        self.addCleanup(self.connector.close)
+        self.connector.migrate()
+        self.accounts = AccountService(self.connector, HASHER)
+        self.sites = SitesService(self.connector)
+
+    @staticmethod
+    def _restore_env(previous):
+        if previous is None:
+            os.environ.pop("DB_SCHEMA_CACHE_DIR", None)
+        else:
+            os.environ["DB_SCHEMA_CACHE_DIR"] = previous
+
+    def register(self, username="user1", password="passw0rd1", email=None):
+        session = Session()
+        result = self.accounts.register(session, username, password, email or f"{username}@mail.com")
+        return session, result
+
+
+class FakeConnection():
+    def __init__(self):
+        self.closed = False
+
+    def ping(self, reconnect=False):
+        if self.closed:
+            raise pymysql.err.OperationalError(2006, "gone away")
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.opened = []
+
+    def factory(self):
+        conn = FakeConnection()
+        self.opened.append(conn)
+        return conn
+
+    def test_reuses_released_connection(self):
+        pool = ConnectionPool(self.factory, max_size=2)
+        with pool.connection() as first:
+            pass
+        with pool.connection() as second:
+            self.assertIs(first, second)
+        self.assertEqual(len(self.opened), 1)
+
+    def test_times_out_when_exhausted(self):
+        pool = ConnectionPool(self.factory, max_size=1, timeout=0.05)
+        conn = pool.acquire()
+        with self.assertRaises(PoolTimeout):
+            pool.acquire()
+        pool.release(conn)
+        stats = pool.stats()
+        self.assertEqual((stats["opened"], stats["idle"], stats["peak"], stats["timeouts"]), (1, 1, 1, 1))
+
+    def test_waiter_gets_released_connection(self):
+        pool = ConnectionPool(self.factory, max_size=1, timeout=2)
+        conn = pool.acquire()
+        threading.Timer(0.05, pool.release, (conn,)).start()
+        self.assertIs(pool.acquire(), conn)
+
+    def test_dead_connection_is_replaced(self):
+        pool = ConnectionPool(self.factory, max_size=1)
+        with pool.connection() as conn:
+            pass
+        conn.closed = True
+        with pool.connection() as fresh:
+            self.assertIsNot(fresh, conn)
+
+    def test_broken_connection_is_discarded(self):
+        pool = ConnectionPool(self.factory, max_size=1)
+        with self.assertRaises(pymysql.err.OperationalError):
+            with pool.connection():
+                raise pymysql.err.OperationalError(2013, "lost")
+        self.assertEqual(pool.stats()["opened"], 0)
+
+    def test_close_retires_connections_in_use(self):
+        pool = ConnectionPool(self.factory, max_size=2)
+        idle = pool.acquire()
+        with pool.connection() as busy:
+            pool.release(idle)
+            pool.close()
+            self.assertTrue(idle.closed)
+            self.assertFalse(busy.closed)
+        self.assertTrue(busy.closed)
+        self.assertEqual(pool.stats()["opened"], 0)
+        with pool.connection() as fresh:
+            self.assertNotIn(fresh, (idle, busy))
+        self.assertEqual(pool.stats()["idle"], 1)
+
+
+class QueryStatsTest(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.connector.set_instrumentation(True)
+        self.session, self.user_id = self.register()
+        for i in range(5):
+            self.sites.save_site(self.session, f"site{i}.com", "password", "me", "pw")
+        self.sites.cache.invalidate()
+        self.stats = self.connector.stats
+        self.stats.reset()
+
+    def site_queries(self):
+        return [entry for fingerprint, entry in self.stats.snapshot()["queries"].items()
+                if fingerprint.startswith("SELECT id, site") and "FROM sites" in fingerprint]
+
+    def test_fingerprint_hides_literals(self):
+        self.assertEqual(self.stats.fingerprint("SELECT * FROM t  WHERE id = 5 AND name = 'it''s'"),
+                         "SELECT * FROM t WHERE id = ? AND name = ?")
+        self.assertEqual(self.stats.fingerprint("SELECT * FROM t WHERE id IN (%s, %s, %s)"),
+                         "SELECT * FROM t WHERE id IN (...)")
+
+    def test_buffered_rows_are_counted(self):
+        self.sites.get_sites(self.user_id)
+        entry, = self.site_queries()
+        self.assertEqual((entry["count"], entry["rows"]), (1, 5))
+
+    def test_streamed_rows_are_counted(self):
+        chunks = list(self.sites.iter_sites(self.user_id, chunk_size=2, use_cache=False))
+        self.assertEqual([len(chunk) for chunk in chunks], [2, 2, 1])
+        entry, = self.site_queries()
+        self.assertEqual((entry["count"], entry["rows"]), (1, 5))
+
+    def test_queries_are_attributed_to_action(self):
+        self.stats.bind("show_sites", self.sites.get_sites)(self.user_id)
+        action = self.stats.snapshot()["actions"]["show_sites"]
+        self.assertEqual((action["count"], action["queries"]), (1, 1))
+
+    def test_disabling_retires_connections_in_use(self):
+        with self.connector.connection():
+            self.connector.set_instrumentation(False)
+        self.stats.reset()
+        self.sites.get_sites(self.user_id)
+        self.assertEqual(self.stats.snapshot()["queries"], {})
+
+
+class MigrationTest(DatabaseTestCase):
+    def test_migrates_to_latest_version(self):
+        latest = self.connector.backend.migrations[-1][0]
+        with self.connector.connection() as connection, connection.cursor() as c:
+            self.assertEqual(self.connector._schema_version(c), latest)
+
+    def test_marker_skips_database(self):
+        latest = self.connector.backend.migrations[-1][0]
+        self.assertTrue(os.path.exists(self.connector._schema_marker(latest)))
+        self.connector.close()
+        os.remove(self.connector.backend.path)
+        # Позначка каже, що схема перевірена, тож migrate не дивиться в (уже порожню) базу
+        self.assertEqual(self.connector.migrate(), latest)
+
+    def test_recreated_database_is_migrated_again(self):
+        self.connector.close()
+        os.remove(self.connector.backend.path)
+        session, user_id = self.connector.run_with_schema(self.register)
+        self.assertEqual(user_id, 1)
+
+    def test_missing_table_maps_to_mysql_code(self):
+        with self.connector.connection() as connection, connection.cursor() as c:
+            with self.assertRaises(pymysql.err.ProgrammingError) as caught:
+                c.execute("SELECT * FROM missing_table")
+        self.assertEqual(caught.exception.args[0], NO_SUCH_TABLE)
+
+
+class AccountServiceTest(DatabaseTestCase):
+    def test_register_and_login(self):
+        _, user_id = self.register()
+        session = Session()
+        self.assertEqual(self.accounts.login(session, "user1", "passw0rd1"), user_id)
+        self.assertEqual(session.user_id, user_id)
+        self.assertTrue(session.vault.unlocked)
+
+    def test_login_failures(self):
+        self.register()
+        self.assertEqual(self.accounts.login(Session(), "nobody", "passw0rd1"), AccountService.NO_SUCH_USER)
+        self.assertEqual(self.accounts.login(Session(), "user1", "wrong0pass"), AccountService.WRONG_PASSWORD)
+
+    def test_duplicate_username_and_email(self):
+        self.register()
+        self.assertEqual(self.register(email="other@mail.com")[1], AccountService.USERNAME_TAKEN)
+        self.assertEqual(self.register("user2", email="user1@mail.com")[1], AccountService.EMAIL_TAKEN)
+
+    def stored_password(self, user_id):
+        with self.connector.connection() as connection, connection.cursor() as c:
+            c.execute("SELECT password, enc_salt FROM users WHERE id = %s", (user_id,))
+            return c.fetchone()
+
+    def set_password(self, user_id, stored, enc_salt):
+        with self.connector.connection() as connection, connection.cursor() as c:
+            c.execute("UPDATE users SET password = %s, enc_salt = %s WHERE id = %s", (stored, enc_salt, user_id))
+            connection.commit()
+
+    def test_hash_keeps_its_parameters(self):
+        stored = HASHER.hash("passw0rd1")
+        self.assertEqual(stored.split("$")[:4], ["scrypt", str(HASHER.n), str(HASHER.r), str(HASHER.p)])
+        self.assertEqual(HASHER.verify("passw0rd1", stored), (True, False))
+        self.assertEqual(HASHER.verify("wrong0pass", stored), (False, False))
+
+    def test_weaker_hash_is_upgraded_on_login(self):
+        _, user_id = self.register()
+        enc_salt = self.stored_password(user_id)["enc_salt"]
+        # Хеш, порахований до підвищення вартості
+        n = HASHER.n
+        HASHER.n = n // 4
+        try:
+            weak = HASHER.hash("passw0rd1")
+        finally:
+            HASHER.n = n
+        self.set_password(user_id, weak, enc_salt)
+        self.assertEqual(self.accounts.login(Session(), "user1", "passw0rd1"), user_id)
+        upgraded = self.stored_password(user_id)
+        self.assertEqual(upgraded["password"].split("$")[1], str(HASHER.n))
+        self.assertEqual(upgraded["enc_salt"], enc_salt)
+        self.assertEqual(HASHER.verify("passw0rd1", upgraded["password"]), (True, False))
+
+    def test_plaintext_password_is_hashed_on_login(self):
+        _, user_id = self.register()
+        self.set_password(user_id, "passw0rd1", None)
+        self.assertEqual(self.accounts.login(Session(), "user1", "wrong0pass"), AccountService.WRONG_PASSWORD)
+        self.assertEqual(self.stored_password(user_id)["password"], "passw0rd1")
+        session = Session()
+        self.assertEqual(self.accounts.login(session, "user1", "passw0rd1"), user_id)
+        stored = self.stored_password(user_id)
+        self.assertTrue(stored["password"].startswith("scrypt$"))
+        self.assertIsNotNone(stored["enc_salt"])
+        self.assertTrue(session.vault.unlocked)
+
+
+class SitesServiceTest(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.session, self.user_id = self.register()
+
+    def test_duplicate_login_is_rejected_by_index(self):
+        self.assertIsNone(self.sites.save_site(self.session, "example.com", "password", "me", "pw"))
+        # Без індексу пошуку в сесії дублікат відсіює лише унікальний індекс бази
+        self.assertEqual(self.sites.save_site(self.session, "example.com", "password", "me", "other"),
+                         SitesService.DUPLICATE_LOGIN)
+        self.assertIsNone(self.sites.save_site(self.session, "example.com", "password", "me2", "pw"))
+
+    def test_duplicate_entrance_type_is_rejected_by_index(self):
+        self.assertIsNone(self.sites.save_site(self.session, "example.com", "google", "", ""))
+        self.assertEqual(self.sites.save_site(self.session, "example.com", "google", "", ""),
+                         SitesService.DUPLICATE_ENTRANCE)
+
+    def test_unknown_entrance_type(self):
+        self.assertEqual(self.sites.save_site(self.session, "example.com", "myspace", "", ""), "Невідомий тип входу")
+
+    def test_saved_sites_are_encrypted(self):
+        self.sites.save_site(self.session, "example.com", "password", "me", "secret")
+        site, = self.sites.get_sites(self.user_id)
+        self.assertTrue(site.password.startswith(CredentialVault.PREFIX))
+        self.assertEqual(self.session.vault.decrypt(site.password), "secret")
+
+    def test_plaintext_sites_are_encrypted_after_login(self):
+        with self.connector.connection() as connection, connection.cursor() as c:
+            c.execute("INSERT INTO sites (site, entrance_type, user_id, login, password) VALUES (%s, %s, %s, %s, %s)",
+                      ("example.com", "password", self.user_id, "me", "secret"))
+            connection.commit()
+        self.assertEqual(self.sites.encrypt_legacy_sites(self.session), 1)
+        site, = self.sites.get_sites(self.user_id)
+        self.assertTrue(site.login.startswith(CredentialVault.PREFIX))
+        self.assertEqual(self.session.vault.decrypt(site.password), "secret")
+        # Тепер дублікат відсіює унікальний індекс за login_digest
+        self.assertEqual(self.sites.save_site(self.session, "example.com", "password", "me", "pw"),
+                         SitesService.DUPLICATE_LOGIN)
+        self.assertEqual(self.sites.encrypt_legacy_sites(self.session), 0)
+
+    def save_sites(self, count):
+        for i in range(count):
+            self.sites.save_site(self.session, f"site{i}.com", "password", "me", "pw")
+        self.sites.cache.invalidate()
+
+    def test_stream_caches_single_chunk_account(self):
+        self.save_sites(3)
+        streamed = [row.id for chunk in self.sites.iter_sites(self.user_id, chunk_size=5) for row in chunk]
+        self.assertEqual(streamed, [1, 2, 3])
+        self.assertEqual([row.id for row in self.sites.cache.get_page(self.user_id)], streamed)
+
+    def test_stream_does_not_cache_large_account(self):
+        self.save_sites(5)
+        streamed = [row.id for chunk in self.sites.iter_sites(self.user_id, chunk_size=2) for row in chunk]
+        self.assertEqual(streamed, [1, 2, 3, 4, 5])
+        self.assertIsNone(self.sites.cache.get_page(self.user_id))
+        self.assertIsNone(self.sites.cache.get_page(self.user_id, 0, 2))
+
+    def test_stream_without_cache(self):
+        self.save_sites(2)
+        list(self.sites.iter_sites(self.user_id, use_cache=False))
+        self.assertIsNone(self.sites.cache.get_page(self.user_id))
+
+    def test_add_during_stream_keeps_cache_consistent(self):
+        self.save_sites(1)
+        chunks = self.sites.iter_sites(self.user_id)
+        self.assertEqual([row.id for row in next(chunks)], [1])
+        self.sites.save_site(self.session, "late.com", "password", "me", "pw")
+        chunks.close()
+        expected = [row.site for chunk in self.sites.iter_sites(self.user_id, use_cache=False) for row in chunk]
+        self.assertEqual([row.site for row in self.sites.cache.get_page(self.user_id)], expected)
+
+
+class SiteSearchIndexTest(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.session, self.user_id = self.register()
+        for site, entrance_type, login in (("github.com", "password", "Octo"), ("gitlab.com", "password", "me"),
+                                           ("example.com", "google", ""), ("mail.example.org", "password", "git")):
+            self.sites.save_site(self.session, site, entrance_type, login, "pw")
+        self.index = self.sites.build_search_index(self.session)
+
+    def found(self, query, entrance_type=None):
+        return sorted(row.site for row in self.index.search(query, entrance_type))
+
+    def test_substring_of_site_or_login(self):
+        self.assertTrue(self.index.local)
+        self.assertEqual(self.found("GIT"), ["github.com", "gitlab.com", "mail.example.org"])
+        self.assertEqual(self.found("octo"), ["github.com"])
+        self.assertEqual(self.found("ample"), ["example.com", "mail.example.org"])
+        self.assertEqual(self.found("nothing"), [])
+
+    def test_short_query_and_type_filter(self):
+        self.assertEqual(self.found("me"), ["gitlab.com"])
+        self.assertEqual(self.found("co"), ["example.com", "github.com", "gitlab.com"])
+        self.assertEqual(self.found("", "google"), ["example.com"])
+        self.assertEqual(self.found("example", "password"), ["mail.example.org"])
+
+    def test_saved_site_is_searchable_and_known_duplicate(self):
+        self.assertIsNone(self.sites.save_site(self.session, "bitbucket.org", "password", "octocat", "pw"))
+        self.assertEqual(self.found("octo"), ["bitbucket.org", "github.com"])
+        # Дублікат відсіюється за ключами індексу, ще до запиту в базу
+        self.assertEqual(self.sites.validator(self.session, "github.com", "password", "Octo", "other"),
+                         SitesService.DUPLICATE_LOGIN)
+        self.assertIsNone(self.sites.validator(self.session, "github.com", "password", "octo2", "other"))
+
+    def test_import_drops_index(self):
+        path = os.path.join(self.tmpdir, "import.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"site": "octopus.com", "login": "me", "password": "pw"}) + "\n")
+        self.sites.import_sites(self.session, path)
+        self.assertIsNone(self.session.search_index)
+        index = self.sites.build_search_index(self.session)
+        self.assertEqual([row.site for row in index.search("octopus")], ["octopus.com"])
+
+    def test_server_search_by_site_prefix(self):
+        self.assertEqual([row.site for row in self.sites.search_sites(self.user_id, "git")],
+                         ["github.com", "gitlab.com"])
+        self.assertEqual([row.site for row in self.sites.search_sites(self.user_id, "ex", "google")],
+                         ["example.com"])
+        self.assertEqual(self.sites.search_sites(self.user_id, "%"), [])
+
+
+class ImportExportTest(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.session, self.user_id = self.register()
+
+    def write(self, name, text):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return path
+
+    def import_json(self, items):
+        return self.sites.import_sites(self.session, self.write("import.json", json.dumps(items)))
+
+    def test_duplicates_are_skipped(self):
+        self.sites.save_site(self.session, "example.com", "password", "me", "pw")
+        summary = self.import_json([
+            {"url": "https://example.com/login", "username": "me", "password": "other"},
+            {"site": "example.com", "login": "you", "password": "pw"},
+            {"site": "example.com", "login": "you", "password": "pw2"},
+        ])
+        self.assertEqual((summary["inserted"], summary["duplicates"], summary["invalid"]), (1, 2, 0))
+        logins = [self.session.vault.decrypt(row.login) for row in self.sites.get_sites(self.user_id)]
+        self.assertEqual(logins, ["me", "you"])
+
+    def test_invalid_rows_are_counted(self):
+        path = self.write("import.csv", "site,entrance_type,login,password\n"
+                                        "example.com,password,me,pw\n"
+                                        ",password,me,pw\n"
+                                        "example.org,myspace,,\n")
+        summary = self.sites.import_sites(self.session, path)
+        self.assertEqual((summary["inserted"], summary["invalid"]), (1, 2))
+        self.assertEqual([error.split(":")[0] for error in summary["errors"]], ["Рядок 2", "Рядок 3"])
+
+    def test_malformed_json_items_are_invalid(self):
+        summary = self.import_json([["example.com"], "example.com", None,
+                                    {"site": "example.com", "password": 12345},
+                                    {"site": {"name": "example.com"}},
+                                    {"site": "example.com", "login": "me", "password": "pw"}])
+        self.assertEqual((summary["inserted"], summary["invalid"]), (1, 5))
+
+    def test_export_round_trip_bypasses_cache(self):
+        self.sites.save_site(self.session, "example.com", "password", "me", "pw")
+        self.sites.save_site(self.session, "example.org", "google", "", "")
+        self.sites.cache.invalidate()
+        path = os.path.join(self.tmpdir, "export.jsonl")
+        self.assertEqual(self.sites.export_sites(self.session, path), 2)
+        self.assertIsNone(self.sites.cache.get_page(self.user_id))
+        with open(path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f]
+        self.assertEqual(rows[0], {"site": "example.com", "entrance_type": "password", "login": "me", "password": "pw"})
+        self.assertEqual(rows[1]["entrance_type"], "google")
+
+
+class SiteWriteQueueTest(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.session, self.user_id = self.register()
+        self.queue = SiteWriteQueue(self.sites)
+        self.queue.RETRY_DELAY = 0.01
+        self.addCleanup(self.queue.close, 5)
+        self.batches = []
+        write_batch = self.queue._write_batch
+
+        def record(batch):
+            self.batches.append(len(batch))
+            return write_batch(batch)
+        self.queue._write_batch = record
+
+    def submit(self, site, login="me"):
+        return self.queue.submit(self.session, site, "password", login, "pw", tag=site)
+
+    def results(self):
+        self.assertTrue(self.queue.flush(5))
+        return {pending.tag: (site_id, warning) for pending, site_id, warning in self.queue.collect()}
+
+    def test_adjacent_submits_share_a_transaction(self):
+        self.queue.COALESCE_SECONDS = 0.5
+        for site in ("a.com", "b.com", "c.com"):
+            self.assertIsNone(self.submit(site).warning)
+        results = self.results()
+        self.assertEqual(self.batches, [3])
+        self.assertEqual(sorted(site_id for site_id, _ in results.values()), [1, 2, 3])
+        self.assertEqual([row.site for row in self.sites.get_sites(self.user_id)], ["a.com", "b.com", "c.com"])
+
+    def test_duplicate_in_batch_gets_warning(self):
+        self.queue.COALESCE_SECONDS = 0.5
+        self.queue.submit(self.session, "a.com", "password", "me", "pw", tag=1)
+        self.queue.submit(self.session, "a.com", "password", "me", "other", tag=2)
+        results = self.results()
+        self.assertIsNone(results[1][1])
+        self.assertEqual(results[2], (None, SitesService.DUPLICATE_LOGIN))
+        self.assertEqual(len(self.sites.get_sites(self.user_id)), 1)
+
+    def test_invalid_fields_are_not_queued(self):
+        self.assertTrue(self.queue.submit(self.session, "", "password", "me", "pw").warning)
+        self.assertFalse(self.queue.outstanding())
+
+    def test_lost_connection_is_retried(self):
+        write_batch = self.queue._write_batch
+        failures = [pymysql.err.OperationalError(2013, "Lost connection")]
+
+        def flaky(batch):
+            if failures:
+                raise failures.pop()
+            return write_batch(batch)
+        self.queue._write_batch = flaky
+        self.submit("a.com")
+        site_id, warning = self.results()["a.com"]
+        self.assertIsNone(warning)
+        self.assertEqual(self.batches, [1])
+        self.assertEqual(self.sites.get_site(self.user_id, site_id).site, "a.com")
+
+    def test_unwritten_sites_are_persisted_and_restored(self):
+        self.queue.MAX_ATTEMPTS = 1
+        write_batch = self.queue._write_batch
+
+        def offline(batch):
+            raise pymysql.err.OperationalError(2003, "Can't connect")
+        self.queue._write_batch = offline
+        self.submit("a.com")
+        self.submit("b.com")
+        self.assertEqual(self.queue.flush_or_persist(5), 2)
+        self.assertEqual(self.sites.get_sites(self.user_id), [])
+        self.queue._write_batch = write_batch
+        self.assertEqual(self.queue.restore(self.session), 2)
+        self.assertTrue(self.queue.flush(5))
+        self.assertEqual(sorted(row.site for row in self.sites.get_sites(self.user_id)), ["a.com", "b.com"])
+        self.assertEqual(self.queue.restore(self.session), 0)
+
+    def test_submit_after_sign_out_is_rejected(self):
+        self.session.clear()
+        with self.assertRaises(RuntimeError):
+            self.submit("a.com")
+
+
+class ShardRoutingTest(unittest.TestCase):
+    USERS = range(1, 2001)
+
+    @staticmethod
+    def placements(names):
+        shard_map = ShardMap({name: None for name in names})
+        return {user_id: shard_map.placement(user_id) for user_id in ShardRoutingTest.USERS}
+
+    def test_added_shard_takes_its_share_only(self):
+        before, after = self.placements(["s1", "s2", "s3"]), self.placements(["s1", "s2", "s3", "s4"])
+        moved = [user_id for user_id in self.USERS if before[user_id] != after[user_id]]
+        self.assertTrue(all(after[user_id] == "s4" for user_id in moved))
+        self.assertLess(abs(len(moved) / len(self.USERS) - 0.25), 0.05)
+
+    def test_removed_shard_gives_away_its_users_only(self):
+        before = self.placements(["s1", "s2", "s3"])
+        after = {user_id: ShardMap({"s1": None, "s2": None, "s3": None}, ["s1", "s3"]).placement(user_id)
+                 for user_id in self.USERS}
+        self.assertEqual([user_id for user_id in self.USERS if before[user_id] != after[user_id]],
+                         [user_id for user_id in self.USERS if before[user_id] == "s2"])
+
+    def test_no_shards(self):
+        self.assertIsNone(ShardMap().placement(1))
+
+    def test_placement_cache_is_bounded(self):
+        connector = Connector(SQLiteBackend(":memory:"), ShardMap({"s1": None}))
+        connector.MAX_PLACEMENTS = 2
+        for user_id in (1, 2, 3):
+            connector.remember_placement(user_id, "s1")
+        self.assertEqual(list(connector._placements), [2, 3])
+
+
+class PlacedUsersTest(DatabaseTestCase):
+    def test_forgotten_user_cache_is_dropped(self):
+        self.sites.MAX_PLACED = 1
+        self.sites.get_sites(1)
+        self.assertIsNotNone(self.sites.cache.get_page(1))
+        self.sites.get_sites(2)
+        self.assertIsNone(self.sites.cache.get_page(1))
+        self.assertIsNotNone(self.sites.cache.get_page(2))
+
+
+class CredentialVaultTest(unittest.TestCase):
+    def setUp(self):
+        self.vault = CredentialVault()
+        self.vault.unlock(b"k" * 32)
+
+    def test_round_trip(self):
+        blob = self.vault.encrypt("пароль")
+        self.assertTrue(blob.startswith(CredentialVault.PREFIX))
+        self.assertNotEqual(blob, self.vault.encrypt("пароль"))
+        self.assertEqual(self.vault.decrypt(blob), "пароль")
+        self.assertEqual(self.vault.reveal(blob), "пароль")
+
+    def test_plaintext_passes_through(self):
+        self.assertEqual(self.vault.decrypt("legacy"), "legacy")
+
+    def test_other_key_is_rejected(self):
+        blob = self.vault.encrypt("secret")
+        other = CredentialVault()
+        other.unlock(b"x" * 32)
+        with self.assertRaises(ValueError):
+            other.decrypt(blob)
+
+    def test_digest_is_deterministic(self):
+        self.assertEqual(self.vault.digest("me"), self.vault.digest("me"))
+        self.assertNotEqual(self.vault.digest("me"), self.vault.digest("you"))
+
+    def test_lock_forgets_key(self):
+        self.vault.lock()
+        self.assertFalse(self.vault.unlocked)
+
+
+class SitesCacheTest(unittest.TestCase):
+    @staticmethod
+    def rows(*ids):
+        return [SiteRecord(i, f"site{i}.com", "google", "", "") for i in ids]
+
+    def test_pages_continue_cached_prefix(self):
+        cache = SitesCache()
+        cache.store_page(1, 0, 2, self.rows(1, 2))
+        cache.store_page(1, 2, 2, self.rows(3))
+        self.assertEqual([row.id for row in cache.get_page(1, 1, 5)], [2, 3])
+        self.assertEqual([row.id for row in cache.get_page(1)], [1, 2, 3])
+
+    def test_incomplete_list_is_not_served_whole(self):
+        cache = SitesCache()
+        cache.store_page(1, 0, 2, self.rows(1, 2))
+        self.assertIsNone(cache.get_page(1))
+        # Сторінка, що не продовжує закешований початок, ігнорується
+        cache.store_page(1, 7, 2, self.rows(8))
+        self.assertIsNone(cache.get_page(1, 2, 2))
+
+    def test_add_and_invalidate(self):
+        cache = SitesCache()
+        cache.store_page(1, 0, None, self.rows(1))
+        cache.add(1, self.rows(2)[0])
+        self.assertEqual([row.id for row in cache.get_page(1)], [1, 2])
+        cache.invalidate(1)
+        self.assertIsNone(cache.get_page(1))
+
+    def test_page_read_before_change_is_discarded(self):
+        cache = SitesCache()
+        generation = cache.generation
+        cache.invalidate(2)
+        cache.store_page(1, 0, None, self.rows(1), generation)
+        self.assertIsNone(cache.get_page(1))
+        cache.store_page(1, 0, None, self.rows(1), cache.generation)
+        self.assertIsNotNone(cache.get_page(1))
+
+    def test_least_recently_used_user_is_evicted(self):
+        cache = SitesCache(max_users=2)
+        for user_id in (1, 2, 3):
+            cache.store_page(user_id, 0, None, self.rows(user_id))
+        self.assertIsNone(cache.get_page(1))
+        self.assertIsNotNone(cache.get_page(3))
+
+    def test_entries_expire(self):
+        cache = SitesCache(ttl=0)
+        cache.store_page(1, 0, None, self.rows(1))
+        self.assertIsNone(cache.get_page(1))
+
+
+class HttpServerTest(DatabaseTestCase):
+    """Маршрути JsonHttpServer через справжнє TCP-з'єднання з keep-alive."""
+
+    def setUp(self):
+        super().setUp()
+        self.backend = AsyncBackend(self.connector, HASHER, max_workers=2)
+        self.addCleanup(self.backend.close)
+
+    def run_requests(self, requests):
+        """Надсилає [(шлях, тіло, токен)] одним з'єднанням; тіло-рядок передається як є."""
+        async def scenario():
+            http, handled = JsonHttpServer(self.backend), asyncio.Event()
+
+            async def handle(reader, writer):
+                try:
+                    await http.handle(reader, writer)
+                finally:
+                    handled.set()
+
+            server = await asyncio.start_server(handle, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            responses = []
+            for path, body, token in requests:
+                payload = (body if isinstance(body, str) else json.dumps(body)).encode()
+                auth = f"Authorization: Bearer {token}\r\n" if token else ""
+                writer.write(f"POST {path} HTTP/1.1\r\nHost: test\r\n{auth}"
+                             f"Content-Length: {len(payload)}\r\n\r\n".encode() + payload)
+                status = int((await reader.readline()).split()[1])
+                length = 0
+                while (line := await reader.readline()) != b"\r\n":
+                    name, _, value = line.decode().partition(":")
+                    if name.lower() == "content-length":
+                        length = int(value)
+                responses.append((status, json.loads(await reader.readexactly(length))))
+            writer.close()
+            await handled.wait()  # сервер сам закриває з'єднання, побачивши кінець потоку
+            server.close()
+            await server.wait_closed()
+            return responses
+        return asyncio.run(scenario())
+
+    def login_token(self):
+        (status, body), = self.run_requests([
+            ("/register", {"username": "user1", "password": "passw0rd1", "email": "user1@mail.com"}, None)])
+        self.assertEqual(status, 200)
+        return body["token"]
+
+    def test_sites_round_trip(self):
+        token = self.login_token()
+        responses = self.run_requests([
+            ("/sites/add", {"site": "example.com", "login": "me", "password": "secret"}, token),
+            ("/sites/add", {"site": "example.com", "login": "me", "password": "secret"}, token),
+            ("/sites/list", {}, token),
+            ("/sites/search", {"query": "exa"}, token),
+            ("/sites/reveal", {"id": 1}, token),
+            ("/sites/reveal", {"id": 99}, token),
+        ])
+        self.assertEqual([status for status, _ in responses], [200, 409, 200, 200, 200, 404])
+        self.assertEqual(responses[2][1]["sites"], [{"id": 1, "site": "example.com", "entrance_type": "password"}])
+        self.assertEqual(len(responses[3][1]["sites"]), 1)
+        self.assertEqual((responses[4][1]["login"], responses[4][1]["password"]), ("me", "secret"))
+
+    def test_auth_and_login_errors(self):
+        self.login_token()
+        responses = self.run_requests([
+            ("/sites/list", {}, "bad-token"),
+            ("/login", {"username": "user1", "password": "wrong0pass"}, None),
+            ("/register", {"username": "user1", "password": "passw0rd1", "email": "x@mail.com"}, None),
+        ])
+        self.assertEqual([status for status, _ in responses], [401, 401, 409])
+
+    def test_bad_requests(self):
+        token = self.login_token()
+        responses = self.run_requests([
+            ("/sites/list", {"after_id": "abc"}, token),
+            ("/sites/search", {"query": 5}, token),
+            ("/sites/search", {}, token),
+            ("/sites/list", {"unknown": 1}, token),
+            ("/sites/list", "[1, 2]", token),
+            ("/sites/add", {"site": "example.com", "entrance_type": "myspace"}, token),
+            ("/nowhere", {}, token),
+        ])
+        self.assertEqual([status for status, _ in responses], [400, 400, 400, 400, 400, 400, 404])
+
+    def test_background_encryption_error_is_reported(self):
+        self.login_token()
+        done = threading.Event()
+
+        def failing(session):
+            done.set()
+            raise RuntimeError("encryption failed")
+        self.backend.sites.encrypt_legacy_sites = failing
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            (status, _), = self.run_requests([("/login", {"username": "user1", "password": "passw0rd1"}, None)])
+            self.assertTrue(done.wait(5))
+            self.backend.executor.shutdown(wait=True)
+        self.assertEqual(status, 200)
+        self.assertIn("RuntimeError: encryption failed", stderr.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()